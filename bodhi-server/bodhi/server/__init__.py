@@ -21,7 +21,6 @@ import importlib.metadata
 import logging as python_logging
 
 from cornice.validators import DEFAULT_FILTERS
-from dogpile.cache import make_region
 from munch import munchify
 from pyramid.config import Configurator
 from pyramid.renderers import JSONP
@@ -31,7 +30,7 @@ from sqlalchemy import engine_from_config, event
 from sqlalchemy.orm import scoped_session, sessionmaker
 import pkg_resources
 
-from bodhi.server import bugs, buildsys
+from bodhi.server import bugs, buildsys, cache
 from bodhi.server.config import config as bodhi_config
 from bodhi.server.security import BodhiSecurityPolicy
 
@@ -52,16 +51,17 @@ log = python_logging.getLogger(__name__)
 
 def get_cacheregion(request):
     """
-    Return a CacheRegion to be used to cache results.
+    Return the CacheRegion to be used to cache results.
+
+    The region is shared by the whole process, so values cached while serving a request can be
+    used by the next ones.
 
     Args:
         request (pyramid.request.Request): The current web request. Unused.
     Returns:
-        dogpile.cache.region.CacheRegion: A configured CacheRegion.
+        dogpile.cache.region.CacheRegion: The default region of :mod:`bodhi.server.cache`.
     """
-    region = make_region()
-    region.configure_from_config(bodhi_config, "dogpile.cache.")
-    return region
+    return cache.get_region()
 
 
 def setup_buildsys():
@@ -199,6 +199,7 @@ def main(global_config, testing=None, session=None, **settings):
     # Setup our bugtracker and buildsystem
     bugs.set_bugtracker()
     setup_buildsys()
+    cache.configure(bodhi_config)
 
     # Sessions & Caching
     session_factory = SignedCookieSessionFactory(
@@ -273,6 +274,7 @@ def main(global_config, testing=None, session=None, **settings):
     config.add_tween(
         'bodhi.server.services.metrics_tween.histo_tween_factory', over=EXCVIEW
     )
+    config.add_tween('bodhi.server.webapp.memoize_tween_factory', over=EXCVIEW)
 
     # Metrics Route
     config.add_route('prometheus_metric', '/metrics')
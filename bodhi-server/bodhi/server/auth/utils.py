@@ -5,9 +5,11 @@ import typing
 from authlib.oauth2.rfc6750 import InvalidTokenError
 from pyramid.httpexceptions import HTTPFound, HTTPUnauthorized
 from pyramid.security import remember
+from sqlalchemy import event, insert
 
 from bodhi.server import log
 from bodhi.server.models import Group, User
+from bodhi.server.security import identity_cache
 
 
 if typing.TYPE_CHECKING:  # pragma: no cover
@@ -123,26 +125,32 @@ def create_or_update_user(db, username, email, groups):
             user.email = email
             db.flush()
 
+    # Drop empty group names https://github.com/fedora-infra/bodhi/issues/306
+    group_names = {name for name in groups if name.strip()}
+    current_groups = {group.name: group for group in user.groups}
+
     # Keep track of what groups the user is a member of
-    for group_name in groups:
-        # Drop empty group names https://github.com/fedora-infra/bodhi/issues/306
-        if not group_name.strip():
-            continue
-
-        group = db.query(Group).filter_by(name=group_name).first()
-        if not group:
-            group = Group(name=group_name)
-            db.add(group)
-            db.flush()
-        if group not in user.groups:
+    added_names = group_names - current_groups.keys()
+    if added_names:
+        added_groups = db.query(Group).filter(Group.name.in_(added_names)).all()
+        new_names = added_names - {group.name for group in added_groups}
+        if new_names:
+            db.execute(insert(Group), [{'name': name} for name in sorted(new_names)])
+            added_groups.extend(db.query(Group).filter(Group.name.in_(new_names)))
+        for group in sorted(added_groups, key=lambda group: group.name):
             log.info('Adding %s to %s group', user.name, group.name)
             user.groups.append(group)
 
     # See if the user was removed from any groups
-    for group in user.groups:
-        if group.name not in groups:
-            log.info('Removing %s from %s group', user.name, group.name)
-            user.groups.remove(group)
+    for group_name in sorted(current_groups.keys() - group_names):
+        log.info('Removing %s from %s group', user.name, group_name)
+        user.groups.remove(current_groups[group_name])
+
+    # The cached identities of this user may have outdated groups. Forget them once the new groups
+    # are committed, or another request could cache the old groups again in the meantime.
+    username = user.name
+    event.listen(db, 'after_commit', lambda session: identity_cache.invalidate(username),
+                 once=True)
 
     return user
 
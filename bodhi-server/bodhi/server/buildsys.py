@@ -17,8 +17,10 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """Define tools for interacting with the build system and a fake build system for development."""
 
+from concurrent.futures import as_completed, ThreadPoolExecutor
 from functools import wraps
 import hashlib
+from queue import Empty, SimpleQueue
 from threading import Lock
 import logging
 import os
@@ -27,6 +29,10 @@ import typing
 
 import backoff
 import koji
+import requests.exceptions
+import urllib3.exceptions
+
+from bodhi.server.config import config
 
 
 if typing.TYPE_CHECKING:  # pragma: no cover
@@ -148,6 +154,7 @@ class DevBuildsys:
         self.multicall = False
         return result
 
+    @multicall_enabled
     def moveBuild(self, from_tag: str, to_tag: str, build: str, *args, **kw):
         """Emulate Koji's moveBuild."""
         if to_tag is None:
@@ -350,6 +357,7 @@ class DevBuildsys:
         rpms += DevBuildsys.__rpms__
         return rpms
 
+    @multicall_enabled
     def listTags(self, build: str, *args, **kw) -> typing.List[typing.Dict[str, object]]:
         """Emulate Koji's listTags."""
         if 'el5' in build or 'el6' in build:
@@ -735,18 +743,253 @@ def setup_buildsystem(settings: 'BodhiConfig', authenticate: bool = True):
         raise ValueError('Buildsys %s not known' % buildsys)
 
 
+class MulticallExecutor:
+    """
+    Run a batch of Koji calls as chunked multicalls on a small pool of sessions.
+
+    Calls are queued by calling Koji methods on the executor itself, as one would on a Koji
+    session in multicall mode, which means the executor can be handed to code that expects such a
+    session (e.g. :meth:`bodhi.server.models.Update.remove_tag`)::
+
+        executor = MulticallExecutor()
+        for nvr in nvrs:
+            executor.listTags(nvr)
+        results = executor.run()
+
+    :meth:`run` splits the queued calls into chunks, sends the chunks concurrently, and returns
+    the results in the order the calls were queued, in the format of Koji's ``multiCall()``: a
+    one element list holding the return value, or a fault dictionary if the call failed.
+
+    If a whole chunk fails, its calls are sent again one by one, so that a hiccup does not fail
+    the entire batch. When the multicall failed before reaching Koji (the connection could not be
+    established), the calls are simply sent again. Otherwise (e.g. the request timed out while
+    Koji was working on it), Koji may already have made some of the changes, so a fault saying
+    that a change is already made (see :attr:`already_applied`) counts as a success of the call
+    sent again.
+    """
+
+    # Faults of state-changing calls that mean the change was already made, by method name.
+    already_applied = {
+        'createTag': ('already exists', ),
+        'moveBuild': ('already tagged', 'not in tag'),
+        'tagBuild': ('already tagged', ),
+        'untagBuild': ('not in tag', ),
+    }  # type: typing.Dict[str, typing.Tuple[str, ...]]
+
+    def __init__(
+            self, chunk_size: typing.Optional[int] = None, workers: typing.Optional[int] = None,
+            session_factory: typing.Optional[typing.Callable[[], typing.Any]] = None):
+        """
+        Initialize the MulticallExecutor.
+
+        Args:
+            chunk_size: The maximum number of calls sent in one multicall. Defaults to the
+                koji_multicall_chunk_size setting.
+            workers: The maximum number of chunks sent at the same time, which is also the
+                maximum number of Koji sessions used. Defaults to the koji_multicall_workers
+                setting.
+            session_factory: A callable returning a new Koji session. Defaults to
+                :func:`get_session`.
+        """
+        self.chunk_size = max(chunk_size or config.get('koji_multicall_chunk_size'), 1)
+        self.workers = max(workers or config.get('koji_multicall_workers'), 1)
+        self._session_factory = session_factory or get_session
+        self._sessions = SimpleQueue()
+        self._calls = []  # type: typing.List[typing.Tuple[str, tuple, dict]]
+
+    def __getattr__(self, name: str) -> typing.Callable[..., None]:
+        """
+        Return a callable that queues a call to the Koji method with the given name.
+
+        Args:
+            name: The name of the Koji method.
+        Returns:
+            A callable that queues the call with the arguments it is given.
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def queue_call(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+        return queue_call
+
+    def run(
+            self, progress: typing.Optional[typing.Callable[[int, int], None]] = None
+    ) -> typing.List[typing.Any]:
+        """
+        Send all queued calls to Koji and clear the queue.
+
+        Args:
+            progress: If given, called with the number of calls done so far and the total number
+                of calls each time a chunk is done.
+        Returns:
+            A list with one result per queued call, in the format of Koji's ``multiCall()``.
+        """
+        calls, self._calls = self._calls, []
+        chunks = [calls[i:i + self.chunk_size] for i in range(0, len(calls), self.chunk_size)]
+        chunk_results = [None] * len(chunks)  # type: typing.List[typing.Any]
+        done = 0
+        if len(chunks) <= 1 or self.workers == 1:
+            for i, chunk in enumerate(chunks):
+                chunk_results[i] = self._run_chunk(chunk)
+                done += len(chunk)
+                if progress:
+                    progress(done, len(calls))
+        else:
+            log.debug('Sending %d Koji calls in %d chunks', len(calls), len(chunks))
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks))) as pool:
+                futures = {pool.submit(self._run_chunk, chunk): i for i, chunk in enumerate(chunks)}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    chunk_results[i] = future.result()
+                    done += len(chunks[i])
+                    if progress:
+                        progress(done, len(calls))
+        return [result for results in chunk_results for result in results]
+
+    def _run_chunk(self, chunk: typing.List[typing.Tuple[str, tuple, dict]]) -> typing.List:
+        """
+        Send one chunk of calls as a multicall, falling back to sending them one by one.
+
+        Args:
+            chunk: The calls to send, as (method, args, kwargs) tuples.
+        Returns:
+            A list with one result per call, in the format of Koji's ``multiCall()``.
+        """
+        try:
+            session = self._sessions.get_nowait()
+        except Empty:
+            session = self._session_factory()
+        try:
+            session.multicall = True
+            for method, args, kwargs in chunk:
+                getattr(session, method)(*args, **kwargs)
+            try:
+                return list(session.multiCall())
+            except Exception as e:
+                log.exception('Koji multicall of %d calls failed, retrying them one by one',
+                              len(chunk))
+                if self._not_sent(e):
+                    return [self._run_call(session, call) for call in chunk]
+                return [self._fold_already_applied(call, self._run_call(session, call))
+                        for call in chunk]
+        finally:
+            self._sessions.put(session)
+
+    @staticmethod
+    def _not_sent(exc: Exception) -> bool:
+        """
+        Return whether the given exception means the request never reached Koji.
+
+        Args:
+            exc: The exception raised by ``multiCall()``.
+        Returns:
+            ``True`` if the connection to Koji could not be established.
+        """
+        if isinstance(exc, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+            reason = getattr(exc.args[0], 'reason', exc.args[0])
+            return isinstance(reason, urllib3.exceptions.NewConnectionError)
+        return False
+
+    def _fold_already_applied(self, call: typing.Tuple[str, tuple, dict],
+                              result: typing.Any) -> typing.Any:
+        """
+        Turn a fault saying the change was already made into a successful result.
+
+        Args:
+            call: The call that was sent again, as a (method, args, kwargs) tuple.
+            result: The result of the call, in the format of Koji's ``multiCall()``.
+        Returns:
+            ``[None]`` if the result is such a fault, else the result.
+        """
+        if isinstance(result, dict):
+            fault = result.get('faultString', '')
+            if any(text in fault for text in self.already_applied.get(call[0], ())):
+                log.info('Koji call %s%r was already applied: %s', call[0], call[1], fault)
+                return [None]
+        return result
+
+    @staticmethod
+    def _run_call(session: typing.Any, call: typing.Tuple[str, tuple, dict]) -> typing.Any:
+        """
+        Send a single call to Koji.
+
+        Args:
+            session: The Koji session to use.
+            call: The call to send, as a (method, args, kwargs) tuple.
+        Returns:
+            A one element list holding the return value, or a fault dictionary.
+        """
+        method, args, kwargs = call
+        session.multicall = False
+        try:
+            return [getattr(session, method)(*args, **kwargs)]
+        except Exception as e:
+            log.error('Koji call %s%r failed: %s', method, args, e)
+            return {'faultCode': getattr(e, 'faultCode', 1000), 'faultString': str(e)}
+
+
+def tag_builds(
+        pairs: typing.List[typing.Tuple[str, str]],
+        retries: typing.Optional[int] = None,
+        retry_delay: typing.Optional[float] = None) -> typing.List[typing.Tuple[str, str, str]]:
+    """
+    Tag builds with chunked multicalls, and retry the calls that fail.
+
+    The result of each call is checked, and only the calls that failed are retried. A build that
+    is already in the tag counts as tagged, so that tagging the same builds again is harmless.
+
+    Args:
+        pairs: The (tag, nvr) pairs to tag.
+        retries: How many times the failed calls are retried. Defaults to the koji_tag_retries
+            setting.
+        retry_delay: How long to wait before the first retry, in seconds. The delay doubles with
+            each retry. Defaults to the koji_tag_retry_delay setting.
+    Returns:
+        The (tag, nvr, error) of the calls that still failed after the last retry.
+    """
+    retries = config.get('koji_tag_retries') if retries is None else retries
+    delay = config.get('koji_tag_retry_delay') if retry_delay is None else retry_delay
+
+    pending = list(pairs)
+    failures = []  # type: typing.List[typing.Tuple[str, str, str]]
+    for attempt in range(retries + 1):
+        if attempt:
+            log.info('Retrying %d failed tagBuild calls in %s seconds', len(pending), delay)
+            time.sleep(delay)
+            delay *= 2
+        executor = MulticallExecutor()
+        for tag, nvr in pending:
+            executor.tagBuild(tag, nvr)
+        failures = []
+        for (tag, nvr), result in zip(pending, executor.run()):
+            if isinstance(result, dict) and 'already tagged' not in result.get('faultString', ''):
+                failures.append((tag, nvr, result.get('faultString')))
+        pending = [(tag, nvr) for tag, nvr, error in failures]
+        if not pending:
+            break
+    return failures
+
+
 def wait_for_tasks(
         tasks: typing.List[typing.Any],
         session: typing.Union[koji.ClientSession, None] = None,
-        sleep: int = 300) -> typing.List[typing.Any]:
+        sleep: int = 300,
+        min_sleep: float = 1) -> typing.List[typing.Any]:
     """
     Wait for a list of koji tasks to complete.
 
+    Polling starts at min_sleep seconds, and the interval doubles for as long as a task is still
+    running, up to sleep seconds.
+
     Args:
         tasks: The return value of Koji's multiCall().
         session: A Koji client session to use. If not provided, the
             function will acquire its own session.
-        sleep: How long to sleep between polls on Koji when waiting for tasks to complete.
+        sleep: The longest to sleep between polls on Koji when waiting for tasks to complete.
+        min_sleep: How long to sleep before the first poll of a running task.
     Returns:
         A list of failed tasks. An empty list indicates that all tasks completed successfully.
     """
@@ -758,8 +1001,10 @@ def wait_for_tasks(
         if not task:
             log.debug("Skipping task: %s" % task)
             continue
+        interval = min(min_sleep, sleep)
         while not session.taskFinished(task):
-            time.sleep(sleep)
+            time.sleep(interval)
+            interval = min(interval * 2, sleep)
         task_info = session.getTaskInfo(task)
         if task_info['state'] != koji.TASK_STATES['CLOSED']:
             log.error("Koji task %d failed" % task)
@@ -0,0 +1,330 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+The dogpile cache regions shared by the whole process.
+
+The default region is configured from the ``dogpile.cache.`` settings. Each name listed in
+``dogpile.cache.regions`` gets its own region, configured from the ``dogpile.cache.<name>.``
+settings, so that different kinds of values can have their own backend and expiration time. Any
+region can keep the values it reads in a small in-process LRU in front of its backend, which saves
+a round trip to memcached or Redis for the hottest keys.
+
+Regions are created once per process by :func:`configure`, and every lookup is counted in the
+``cache_lookups`` counter.
+"""
+from collections import OrderedDict
+import threading
+import time
+import typing
+
+from dogpile.cache import make_region
+from dogpile.cache.api import NO_VALUE
+from dogpile.cache.proxy import ProxyBackend
+from prometheus_client import Counter
+
+from bodhi.server.config import config
+
+
+cache_lookups = Counter(
+    'cache_lookups',
+    'Lookups in the dogpile cache regions',
+    labelnames=['region', 'result'],
+)
+
+DEFAULT = 'default'
+
+_regions = {}  # type: typing.Dict[str, typing.Any]
+_lock = threading.Lock()
+
+
+class MetricsProxy(ProxyBackend):
+    """Count the hits and misses of a region."""
+
+    def __init__(self, region: str):
+        """
+        Initialize the MetricsProxy.
+
+        Args:
+            region: The name of the region, used as the label of the metrics.
+        """
+        super().__init__()
+        self.region = region
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, values: typing.Sequence[typing.Any]):
+        """
+        Count the given values as hits, or as misses if they are NO_VALUE.
+
+        Args:
+            values: The values returned by the backend.
+        """
+        misses = sum(1 for v in values if v is NO_VALUE)
+        hits = len(values) - misses
+        self.hits += hits
+        self.misses += misses
+        if hits:
+            cache_lookups.labels(region=self.region, result='hit').inc(hits)
+        if misses:
+            cache_lookups.labels(region=self.region, result='miss').inc(misses)
+
+    def get(self, key):
+        """Return the value of the key from the backend, and count the lookup."""
+        value = self.proxied.get(key)
+        self._count([value])
+        return value
+
+    def get_multi(self, keys):
+        """Return the values of the keys from the backend, and count the lookups."""
+        values = self.proxied.get_multi(keys)
+        self._count(values)
+        return values
+
+    def get_serialized(self, key):
+        """Return the serialized value of the key from the backend, and count the lookup."""
+        value = self.proxied.get_serialized(key)
+        self._count([value])
+        return value
+
+    def get_serialized_multi(self, keys):
+        """Return the serialized values of the keys from the backend, and count the lookups."""
+        values = self.proxied.get_serialized_multi(keys)
+        self._count(values)
+        return values
+
+
+class LocalLRUProxy(ProxyBackend):
+    """
+    Keep recently used values in process memory in front of a shared backend.
+
+    Values are kept for at most ``expiration_time`` seconds, so that values changed by other
+    processes are picked up eventually. Deleting a key or invalidating the region also apply
+    to the local copies in this process.
+    """
+
+    def __init__(self, size: int, expiration_time: float):
+        """
+        Initialize the LocalLRUProxy.
+
+        Args:
+            size: The maximum number of values kept in memory.
+            expiration_time: How long a value is kept in memory, in seconds.
+        """
+        super().__init__()
+        self.size = size
+        self.expiration_time = expiration_time
+        self._values = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    def _get_local(self, key):
+        """Return the local copy of the value of the key, or NO_VALUE."""
+        with self._lock:
+            if key not in self._values:
+                return NO_VALUE
+            stored_at, value = self._values[key]
+            if time.monotonic() - stored_at > self.expiration_time:
+                del self._values[key]
+                return NO_VALUE
+            self._values.move_to_end(key)
+            return value
+
+    def _set_local(self, key, value):
+        """Keep a local copy of the value of the key, evicting the least recently used one."""
+        if value is NO_VALUE:
+            return
+        with self._lock:
+            self._values[key] = (time.monotonic(), value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.size:
+                self._values.popitem(last=False)
+
+    def _delete_local(self, keys):
+        """Forget the local copies of the values of the keys."""
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+
+    def clear(self):
+        """Forget all the local copies."""
+        with self._lock:
+            self._values.clear()
+
+    def get(self, key):
+        """Return the value of the key, from memory if possible."""
+        value = self._get_local(key)
+        if value is NO_VALUE:
+            value = self.proxied.get(key)
+            self._set_local(key, value)
+        return value
+
+    def get_serialized(self, key):
+        """Return the serialized value of the key, from memory if possible."""
+        value = self._get_local(key)
+        if value is NO_VALUE:
+            value = self.proxied.get_serialized(key)
+            self._set_local(key, value)
+        return value
+
+    def set(self, key, value):
+        """Set the value of the key in the backend and in memory."""
+        self.proxied.set(key, value)
+        self._set_local(key, value)
+
+    def set_serialized(self, key, value):
+        """Set the serialized value of the key in the backend and in memory."""
+        self.proxied.set_serialized(key, value)
+        self._set_local(key, value)
+
+    def set_multi(self, mapping):
+        """Set the values of the keys in the backend and in memory."""
+        self.proxied.set_multi(mapping)
+        for key, value in mapping.items():
+            self._set_local(key, value)
+
+    def set_serialized_multi(self, mapping):
+        """Set the serialized values of the keys in the backend and in memory."""
+        self.proxied.set_serialized_multi(mapping)
+        for key, value in mapping.items():
+            self._set_local(key, value)
+
+    def delete(self, key):
+        """Delete the key from the backend and from memory."""
+        self._delete_local([key])
+        self.proxied.delete(key)
+
+    def delete_multi(self, keys):
+        """Delete the keys from the backend and from memory."""
+        keys = list(keys)
+        self._delete_local(keys)
+        self.proxied.delete_multi(keys)
+
+
+def _make_region(name: str, settings: typing.Mapping[str, typing.Any], prefix: str):
+    """
+    Create a region from the settings with the given prefix.
+
+    Args:
+        name: The name of the region.
+        settings: Bodhi's settings.
+        prefix: The prefix of the settings of the region, e.g. ``dogpile.cache.``.
+    Returns:
+        dogpile.cache.region.CacheRegion: The configured region.
+    """
+    wrap = [MetricsProxy(name)]
+    lru_size = int(settings.get(f'{prefix}local_lru_size', 0))
+    if lru_size:
+        wrap.append(LocalLRUProxy(
+            lru_size, float(settings.get(f'{prefix}local_expiration_time', 60))))
+    settings = {k: v for k, v in settings.items()
+                if k.startswith(prefix) and not k.startswith(f'{prefix}local_')}
+    region = make_region(name=name)
+    region.configure_from_config(settings, prefix)
+    # configure_from_config() doesn't pass wrap objects through, so wrap the backend ourselves.
+    for proxy in reversed(wrap):
+        region.wrap(proxy)
+    return region
+
+
+def configure(settings: typing.Optional[typing.Mapping[str, typing.Any]] = None):
+    """
+    Create the regions of this process from the given settings, unless they already exist.
+
+    Args:
+        settings: Bodhi's settings. Defaults to :data:`bodhi.server.config.config`.
+    """
+    settings = config if settings is None else settings
+    with _lock:
+        if _regions:
+            return
+        _regions[DEFAULT] = _make_region(DEFAULT, settings, 'dogpile.cache.')
+        for name in settings.get('dogpile.cache.regions', []):
+            _regions[name] = _make_region(name, settings, f'dogpile.cache.{name}.')
+
+
+def get_region(name: str = DEFAULT):
+    """
+    Return the region with the given name.
+
+    Args:
+        name: The name of the region. Names that are not listed in ``dogpile.cache.regions`` get
+            the default region.
+    Returns:
+        dogpile.cache.region.CacheRegion: The region.
+    """
+    if not _regions:
+        configure()
+    return _regions.get(name, _regions[DEFAULT])
+
+
+def _proxy(region, proxy_class: type):
+    """Return the proxy of the given class wrapping the backend of the region, if any."""
+    backend = region.backend
+    while isinstance(backend, ProxyBackend):
+        if isinstance(backend, proxy_class):
+            return backend
+        backend = backend.proxied
+    return None
+
+
+def stats() -> typing.Dict[str, typing.Dict[str, int]]:
+    """
+    Return how many lookups hit and missed in each region since this process started.
+
+    Returns:
+        A dictionary mapping the name of each region to its ``hits`` and ``misses``.
+    """
+    if not _regions:
+        configure()
+    result = {}
+    for name, region in _regions.items():
+        metrics = _proxy(region, MetricsProxy)
+        result[name] = {'hits': metrics.hits, 'misses': metrics.misses}
+    return result
+
+
+def invalidate(name: typing.Optional[str] = None) -> typing.List[str]:
+    """
+    Invalidate the values cached in the given region, or in all regions.
+
+    The invalidation applies to the regions of this process. It also makes this process ignore
+    the values other processes cached in a shared backend before now, but other processes keep
+    using the values they have in memory until they expire.
+
+    Args:
+        name: The name of the region to invalidate, or None to invalidate them all.
+    Returns:
+        The names of the invalidated regions.
+    Raises:
+        KeyError: If there is no region with the given name.
+    """
+    if not _regions:
+        configure()
+    names = list(_regions) if name is None else [name]
+    for region_name in names:
+        region = _regions[region_name]
+        region.invalidate()
+        lru = _proxy(region, LocalLRUProxy)
+        if lru is not None:
+            lru.clear()
+    return names
+
+
+def reset():
+    """Forget the regions, so that they get created again from the current settings."""
+    with _lock:
+        _regions.clear()
@@ -271,6 +271,12 @@ class BodhiConfig(dict):
             # Defined in and tied to the Fedora Account System (limited to 16 characters)
             'value': ['provenpackager', 'releng', 'security_respons'],
             'validator': _generate_list_validator()},
+        'approve_testing.chunk_size': {
+            'value': 50,
+            'validator': int},
+        'authtkt.identity_cache_ttl': {
+            'value': 60,
+            'validator': int},
         'authtkt.secret': {
             'value': 'CHANGEME',
             'validator': _validate_secret},
@@ -330,12 +336,27 @@ class BodhiConfig(dict):
         'celery_config': {
             'value': '/etc/bodhi/celeryconfig.py',
             'validator': str},
+        'check_signed_builds_chunk_size': {
+            'value': 100,
+            'validator': int},
         'check_signed_builds_delay': {
             'value': 2,
             'validator': int},
+        'check_signed_builds_time_budget': {
+            'value': 0,
+            'validator': int},
         'clean_old_composes': {
             'value': True,
             'validator': _validate_bool},
+        'clean_old_composes_unlink_rate': {
+            'value': 0,
+            'validator': int},
+        'clean_old_composes_workers': {
+            'value': 4,
+            'validator': int},
+        'consumer.tag_index_ttl': {
+            'value': 60,
+            'validator': int},
         'container.destination_registry': {
             'value': 'registry.fedoraproject.org',
             'validator': str},
@@ -389,9 +410,21 @@ class BodhiConfig(dict):
         'dogpile.cache.expiration_time': {
             'value': 100,
             'validator': int},
+        'dogpile.cache.local_expiration_time': {
+            'value': 60,
+            'validator': int},
+        'dogpile.cache.local_lru_size': {
+            'value': 0,
+            'validator': int},
+        'dogpile.cache.regions': {
+            'value': [],
+            'validator': _generate_list_validator()},
         'exclude_mail': {
             'value': ['autoqa', 'taskotron'],
             'validator': _generate_list_validator()},
+        'expire_overrides_chunk_size': {
+            'value': 100,
+            'validator': int},
         'file_url': {
             'value': 'https://download.fedoraproject.org/pub/fedora/linux/updates',
             'validator': str},
@@ -421,9 +454,45 @@ class BodhiConfig(dict):
         'koji_web_url': {
             'value': 'https://koji.fedoraproject.org/koji/',
             'validator': _validate_tls_url},
+        'http.backoff_base': {
+            'value': 1.0,
+            'validator': float},
+        'http.backoff_max': {
+            'value': 30.0,
+            'validator': float},
+        'http.circuit_breaker_failures': {
+            'value': 5,
+            'validator': int},
+        'http.circuit_breaker_reset': {
+            'value': 60.0,
+            'validator': float},
+        'http.pool_size': {
+            'value': 10,
+            'validator': int},
+        'http.pool_sizes': {
+            'value': '',
+            'validator': _generate_dict_validator},
+        'http.timeout': {
+            'value': 60,
+            'validator': int},
+        'http.timeouts': {
+            'value': '',
+            'validator': _generate_dict_validator},
         'koji_hub': {
             'value': 'https://koji.stg.fedoraproject.org/kojihub',
             'validator': str},
+        'koji_multicall_chunk_size': {
+            'value': 1000,
+            'validator': int},
+        'koji_multicall_workers': {
+            'value': 4,
+            'validator': int},
+        'koji_tag_retries': {
+            'value': 2,
+            'validator': int},
+        'koji_tag_retry_delay': {
+            'value': 5.0,
+            'validator': float},
         'krb_ccache': {
             'value': None,
             'validator': _validate_none_or(str)},
@@ -505,6 +574,15 @@ class BodhiConfig(dict):
         'oidc.fedora.server_metadata_url': {
             'value': 'https://id.fedoraproject.org/openidc/.well-known/openid-configuration',
             'validator': str},
+        'pagure_acl_cache_negative_ttl': {
+            'value': 60,
+            'validator': int},
+        'pagure_acl_cache_ttl': {
+            'value': 300,
+            'validator': int},
+        'pagure_acl_workers': {
+            'value': 4,
+            'validator': int},
         'pagure_namespaces': {
             'value': ('rpm:rpms, module:modules, container:container, flatpak:flatpaks'),
             'validator': _generate_dict_validator},
@@ -547,6 +625,9 @@ class BodhiConfig(dict):
         'resultsdb_api_url': {
             'value': 'https://taskotron.fedoraproject.org/resultsdb_api/',
             'validator': str},
+        'resultsdb_workers': {
+            'value': 4,
+            'validator': int},
         'session.secret': {
             'value': 'CHANGEME',
             'validator': _validate_secret},
@@ -602,6 +683,9 @@ class BodhiConfig(dict):
         'top_testers_timeframe': {
             'value': 7,
             'validator': int},
+        'test_gating.refresh_window': {
+            'value': 0,
+            'validator': int},
         'test_gating.required': {
             'value': False,
             'validator': _validate_bool},
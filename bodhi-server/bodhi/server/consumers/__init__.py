@@ -23,7 +23,10 @@ It has the role to inspect the topics of the message and call the correct handle
 """
 from collections import namedtuple
 import logging
+import time
+import typing
 
+from prometheus_client import Gauge, Histogram
 import fedora_messaging
 
 from bodhi.server import bugs, buildsys, initialize_db
@@ -32,12 +35,26 @@ from bodhi.server.consumers.automatic_updates import AutomaticUpdateHandler
 from bodhi.server.consumers.signed import SignedHandler
 from bodhi.server.consumers.ci import CIHandler
 from bodhi.server.consumers.resultsdb import ResultsdbHandler
+from bodhi.server.consumers.util import TagIndex
 from bodhi.server.consumers.waiverdb import WaiverdbHandler
 
 
 log = logging.getLogger('bodhi')
 
 
+consumer_queue_depth = Gauge(
+    'consumer_queue_depth',
+    'Messages passed to a handler that it has not finished processing yet',
+    labelnames=['handler'],
+)
+
+consumer_handler_duration = Histogram(
+    'consumer_handler_duration',
+    'Time a handler spent processing a message',
+    labelnames=['handler', 'outcome'],
+)
+
+
 HandlerInfo = namedtuple('HandlerInfo', ['topic_suffix', 'name', 'handler'])
 
 
@@ -51,20 +68,64 @@ class Consumer:
         buildsys.setup_buildsystem(config)
         bugs.set_bugtracker()
 
+        # Koji tag messages are filtered against the same tags by both of their handlers
+        tag_index = TagIndex()
         self.handler_infos = [
-            HandlerInfo('.buildsys.tag', "Signed", SignedHandler()),
-            HandlerInfo('.buildsys.tag', 'Automatic Update', AutomaticUpdateHandler()),
+            HandlerInfo('.buildsys.tag', "Signed", SignedHandler(tag_index=tag_index)),
+            HandlerInfo('.buildsys.tag', 'Automatic Update',
+                        AutomaticUpdateHandler(tag_index=tag_index)),
             HandlerInfo('.ci.koji-build.test.running', 'CI', CIHandler()),
             HandlerInfo('.waiverdb.waiver.new', 'WaiverDB', WaiverdbHandler()),
             HandlerInfo('.resultsdb.result.new', 'ResultsDB', ResultsdbHandler()),
         ]
 
+        self._topic_index = {}  # type: typing.Dict[str, typing.Tuple[HandlerInfo, ...]]
+        self._indexed_infos = self.handler_infos
+
+    def handlers_for(self, topic: str) -> typing.Tuple[HandlerInfo, ...]:
+        """
+        Return the handlers of the messages with the given topic.
+
+        Args:
+            topic: The topic of a message.
+        Returns:
+            The handlers whose topic suffix matches, in the order of handler_infos.
+        """
+        if self._indexed_infos is not self.handler_infos:
+            self._topic_index = {}
+            self._indexed_infos = self.handler_infos
+        if topic not in self._topic_index:
+            self._topic_index[topic] = tuple(
+                hi for hi in self.handler_infos if topic.endswith(hi.topic_suffix))
+        return self._topic_index[topic]
+
+    def _run_handler(self, handler_info: HandlerInfo, msg: fedora_messaging.api.Message):
+        """
+        Pass the message to the handler, and record how long it took.
+
+        Args:
+            handler_info: The handler to run.
+            msg: The message received from the broker.
+        """
+        try:
+            log.debug(f'Passing message to the {handler_info.name} handler')
+            start = time.monotonic()
+            outcome = 'error'
+            try:
+                handler_info.handler(msg)
+                outcome = 'success'
+            finally:
+                consumer_handler_duration.labels(
+                    handler=handler_info.name, outcome=outcome,
+                ).observe(time.monotonic() - start)
+        finally:
+            consumer_queue_depth.labels(handler=handler_info.name).dec()
+
     def __call__(self, msg: fedora_messaging.api.Message):  # noqa: D401
         """
         Callback method called by fedora-messaging consume.
 
-        Redirect messages to the correct handler using the
-        message topic.
+        Redirect messages to the correct handlers using the message topic.
 
         Args:
             msg: The message received from the broker.
@@ -73,15 +134,16 @@ class Consumer:
 
         error_handlers_msgs = []
 
-        for handler_info in self.handler_infos:
-            if not msg.topic.endswith(handler_info.topic_suffix):
-                continue
-            log.debug(f'Passing message to the {handler_info.name} handler')
+        handler_infos = self.handlers_for(msg.topic)
+        for handler_info in handler_infos:
+            consumer_queue_depth.labels(handler=handler_info.name).inc()
+
+        for handler_info in handler_infos:
             try:
-                handler_info.handler(msg)
+                self._run_handler(handler_info, msg)
             except Exception as e:
-                log.exception(f'{str(e)}: Unable to handle message in {handler_info.name} handler: '
-                              f'{msg}')
+                log.exception(f'{str(e)}: Unable to handle message in {handler_info.name} '
+                              f'handler: {msg}')
                 error_handlers_msgs.append((handler_info.name, str(e)))
 
         if error_handlers_msgs:
@@ -22,17 +22,16 @@ This module is responsible for the process of creating updates when builds are
 tagged with certain tags.
 """
 
-from time import sleep
 import logging
-import re
 
 import fedora_messaging
 
 from bodhi.server import buildsys
 from bodhi.server.config import config
+from bodhi.server.consumers.util import TagIndex
 from bodhi.server.models import (
-    Bug, Build, ContentType, Package, Release, Update, UpdateStatus, UpdateType, User)
-from bodhi.server.tasks import work_on_bugs_task
+    Build, ContentType, Package, Release, Update, UpdateStatus, UpdateType, User)
+from bodhi.server.tasks import fill_changelog_task
 from bodhi.server.util import transactional_session_maker
 
 log = logging.getLogger('bodhi')
@@ -46,7 +45,8 @@ class AutomaticUpdateHandler:
     updates from them.
     """
 
-    def __init__(self, db_factory: transactional_session_maker = None):
+    def __init__(self, db_factory: transactional_session_maker = None,
+                 tag_index: TagIndex = None):
         """
         Initialize the Automatic Update Handler.
 
@@ -54,11 +54,15 @@ class AutomaticUpdateHandler:
             db_factory: If given, used as the db_factory for this handler. If
             None (the default), a new TransactionalSessionMaker is created and
             used.
+            tag_index: If given, the index of relevant tags shared with the
+            other tag message handlers. If None (the default), a new TagIndex
+            is created and used.
         """
         if not db_factory:
             self.db_factory = transactional_session_maker()
         else:
             self.db_factory = db_factory
+        self.tag_index = tag_index or TagIndex()
 
     def __call__(self, message: fedora_messaging.api.Message) -> None:
         """Create updates from appropriately tagged builds.
@@ -79,6 +83,11 @@ class AutomaticUpdateHandler:
         btag = body['tag']
         bnvr = '{name}-{version}-{release}'.format(**body)
 
+        if not self.tag_index.is_automatic_update_tag(btag, self.db_factory):
+            log.debug(f"Ignoring build being tagged into {btag!r}, no release configured for "
+                      "automatic updates for it found.")
+            return
+
         koji = buildsys.get_session()
 
         kbuildinfo = koji.getBuild(bnvr)
@@ -147,44 +156,9 @@ class AutomaticUpdateHandler:
                 dbsession.add(user)
 
             log.debug(f"Creating new update for {bnvr}.")
-            try:
-                changelog = build.get_changelog(lastupdate=True)
-            except ValueError as e:
-                # Often due to bot-generated builds
-                # https://pagure.io/koji/issue/3178
-                log.warning(str(e))
-                sleep(5)
-                # Re-raise exception, so that the message can be re-queued
-                raise
-            except Exception:
-                # Re-raise exception, so that the message can be re-queued
-                raise
-            closing_bugs = []
-            if changelog:
-                log.debug("Adding changelog to update notes.")
-                notes = f"""Automatic update for {bnvr}.
-
-##### **Changelog**
-
-```
-{{}}
-```"""
-                if len(changelog) > config.get('update_notes_maxlength') - len(notes):
-                    changelog = '[CHANGELOG OMITTED BECAUSE TOO LONG]'
-                notes = notes.format(changelog)
-                if rel.name not in config.get('bz_exclude_rels'):
-                    for b in re.finditer(config.get('bz_regex'), changelog, re.IGNORECASE):
-                        idx = int(b.group(1))
-                        log.debug(f'Adding bug #{idx} to the update.')
-                        bug = Bug.get(idx)
-                        if bug is None:
-                            bug = Bug(bug_id=idx)
-                            dbsession.add(bug)
-                            dbsession.flush()
-                        if bug not in closing_bugs:
-                            closing_bugs.append(bug)
-            else:
-                notes = f"Automatic update for {bnvr}."
+            # The changelog and the bugs it closes are added by fill_changelog_task, reading
+            # the changelog from Koji can take a while.
+            notes = f"Automatic update for {bnvr}."
             try:
                 critpath_groups = Update.get_critpath_groups([build], rel.branch)
                 critpath = bool(critpath_groups)
@@ -194,7 +168,6 @@ class AutomaticUpdateHandler:
             update = Update(
                 release=rel,
                 builds=[build],
-                bugs=closing_bugs,
                 notes=notes,
                 type=utype,
                 stable_karma=3,
@@ -228,7 +201,6 @@ class AutomaticUpdateHandler:
                 log.error(f'Problem obsoleting older updates: {e}')
 
             alias = update.alias
-            buglist = [b.bug_id for b in update.bugs]
 
         # This must be run after dbsession is closed so changes are committed to db
-        work_on_bugs_task.delay(alias, buglist)
+        fill_changelog_task.delay(alias)
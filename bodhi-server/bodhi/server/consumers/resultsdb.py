@@ -27,7 +27,11 @@ import logging
 
 import fedora_messaging
 
-from bodhi.server.consumers.util import update_from_db_message
+from bodhi.server.consumers.util import (
+    refresh_test_gating_status,
+    schedule_test_gating_refresh,
+    update_from_db_message,
+)
 from bodhi.server.models import TestGatingStatus
 from bodhi.server.util import transactional_session_maker
 
@@ -75,5 +79,8 @@ class ResultsdbHandler:
             ):
                 log.debug("Not updating test_gating_status as no chance of a change")
                 return
-            log.info(f"Updating the test_gating_status for: {update.alias}")
-            update.update_test_gating_status()
+            alias = refresh_test_gating_status(update)
+
+        # This must be run after the session is closed so the flag is committed
+        if alias:
+            schedule_test_gating_refresh(alias)
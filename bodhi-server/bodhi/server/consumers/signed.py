@@ -28,6 +28,7 @@ import fedora_messaging
 from sqlalchemy import func
 
 from bodhi.server.config import config
+from bodhi.server.consumers.util import TagIndex
 from bodhi.server.models import Build, UpdateRequest, UpdateStatus, TestGatingStatus
 from bodhi.server.util import transactional_session_maker
 
@@ -41,9 +42,16 @@ class SignedHandler(object):
     A fedora-messaging listener waiting for messages from koji about builds being tagged.
     """
 
-    def __init__(self):
-        """Initialize the SignedHandler."""
+    def __init__(self, tag_index: TagIndex = None):
+        """
+        Initialize the SignedHandler.
+
+        Args:
+            tag_index: If given, the index of relevant tags shared with the other tag message
+                handlers. If None (the default), a new TagIndex is created and used.
+        """
         self.db_factory = transactional_session_maker()
+        self.tag_index = tag_index or TagIndex()
 
     def __call__(self, message: fedora_messaging.api.Message):
         """
@@ -79,6 +87,10 @@ class SignedHandler(object):
 
         log.info("%s tagged into %s" % (build_nvr, tag))
 
+        if not self.tag_index.is_signed_tag(tag, self.db_factory):
+            log.info("Tag is not a pending_testing tag of any release, skipping")
+            return
+
         with self.db_factory() as dbsession:
             build = Build.get(build_nvr)
             if not build:
@@ -18,12 +18,98 @@
 """Utility functions for message consumers."""
 
 import logging
+import threading
+import time
+import typing
 
-from bodhi.server.models import Build, Update
+from bodhi.server.config import config
+from bodhi.server.models import Build, Release, Update
+from bodhi.server.tasks import refresh_test_gating_status_task
+from bodhi.server.util import TransactionalSessionMaker
 
 log = logging.getLogger(__name__)
 
 
+class TagIndex:
+    """
+    An in-memory index of the Koji tags the tag message handlers act on.
+
+    Koji tag messages go to both the Signed and the Automatic Update handlers, and most of them
+    are about tags neither of them cares about. The index lets them drop those messages before
+    making any Koji or database call. It is loaded from the releases, and loaded again once it is
+    older than consumer.tag_index_ttl seconds, so a new or edited release is picked up after at
+    most that long.
+    """
+
+    def __init__(self):
+        """Initialize the TagIndex."""
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self.pending_testing_tags = frozenset()  # type: typing.FrozenSet[str]
+        self.testing_side_tag_suffixes = ()  # type: typing.Tuple[str, ...]
+        self.automatic_update_tags = frozenset()  # type: typing.FrozenSet[str]
+
+    def refresh(self, db_factory: TransactionalSessionMaker):
+        """
+        Load the tags from the releases.
+
+        Args:
+            db_factory: Used to get a database session.
+        """
+        with db_factory():
+            releases = Release.query.all()
+            pending_testing_tags = frozenset(r.pending_testing_tag for r in releases)
+            testing_side_tag_suffixes = tuple(sorted(
+                {r.get_pending_testing_side_tag('') for r in releases}))
+            automatic_update_tags = frozenset(
+                r.candidate_tag for r in releases if r.create_automatic_updates)
+
+        self.pending_testing_tags = pending_testing_tags
+        self.testing_side_tag_suffixes = testing_side_tag_suffixes
+        self.automatic_update_tags = automatic_update_tags
+        self._loaded_at = time.monotonic()
+        log.debug(f"Loaded {len(pending_testing_tags)} pending testing tags and "
+                  f"{len(automatic_update_tags)} automatic update tags")
+
+    def _ensure_loaded(self, db_factory: TransactionalSessionMaker):
+        """
+        Load the tags if they were never loaded, or if they are too old.
+
+        Args:
+            db_factory: Used to get a database session.
+        """
+        with self._lock:
+            if self._loaded_at is None \
+                    or time.monotonic() - self._loaded_at >= config.get('consumer.tag_index_ttl'):
+                self.refresh(db_factory)
+
+    def is_signed_tag(self, tag: str, db_factory: TransactionalSessionMaker) -> bool:
+        """
+        Return whether builds tagged into the given tag may have just been signed.
+
+        Args:
+            tag: The tag from the message.
+            db_factory: Used to get a database session if the index must be loaded.
+        Returns:
+            True if the tag is the pending testing tag of a release, or a testing side tag.
+        """
+        self._ensure_loaded(db_factory)
+        return tag in self.pending_testing_tags or tag.endswith(self.testing_side_tag_suffixes)
+
+    def is_automatic_update_tag(self, tag: str, db_factory: TransactionalSessionMaker) -> bool:
+        """
+        Return whether builds tagged into the given tag may get an automatic update.
+
+        Args:
+            tag: The tag from the message.
+            db_factory: Used to get a database session if the index must be loaded.
+        Returns:
+            True if the tag is the candidate tag of a release with automatic updates.
+        """
+        self._ensure_loaded(db_factory)
+        return tag in self.automatic_update_tags
+
+
 def update_from_db_message(msgid: str, itemdict: dict):
     """
     Find and return update for waiverdb or resultsdb message.
@@ -76,3 +162,39 @@ def update_from_db_message(msgid: str, itemdict: dict):
         update = build.update
 
     return update
+
+
+def refresh_test_gating_status(update: Update) -> typing.Optional[str]:
+    """
+    Refresh the test_gating_status of the given update, or flag it for a later refresh.
+
+    Used by the resultsdb and waiverdb consumers. If test_gating.refresh_window is set, the update
+    is only flagged, and the caller must pass the returned alias to schedule_test_gating_refresh()
+    once its session is committed.
+
+    Args:
+        update: The update whose gating status may have changed.
+    Returns:
+        The alias of the update if a refresh must be scheduled, None otherwise.
+    """
+    window = config.get('test_gating.refresh_window')
+    if not window:
+        log.info(f"Updating the test_gating_status for: {update.alias}")
+        update.update_test_gating_status()
+        return None
+    if not update.mark_test_gating_dirty(window):
+        log.debug(f"A test_gating_status refresh is already scheduled for {update.alias}")
+        return None
+    return update.alias
+
+
+def schedule_test_gating_refresh(alias: str):
+    """
+    Schedule the refresh of the test_gating_status of an update flagged for it.
+
+    Args:
+        alias: The alias returned by refresh_test_gating_status().
+    """
+    window = config.get('test_gating.refresh_window')
+    log.info(f"Refreshing the test_gating_status of {alias} in {window} seconds")
+    refresh_test_gating_status_task.apply_async((alias,), countdown=window)
@@ -26,7 +26,11 @@ import logging
 
 import fedora_messaging
 
-from bodhi.server.consumers.util import update_from_db_message
+from bodhi.server.consumers.util import (
+    refresh_test_gating_status,
+    schedule_test_gating_refresh,
+    update_from_db_message,
+)
 from bodhi.server.models import TestGatingStatus
 from bodhi.server.util import transactional_session_maker
 
@@ -57,6 +61,7 @@ class WaiverdbHandler:
             log.error(f"Couldn't find subject in WaiverDB message {message.id}")
             return
 
+        alias = None
         with self.db_factory():
             # find the update
             update = update_from_db_message(message.id, subject)
@@ -66,5 +71,8 @@ class WaiverdbHandler:
                 # "ignored" (that's not going to change either)
                 updtgs = update.test_gating_status
                 if updtgs not in (TestGatingStatus.passed, TestGatingStatus.ignored):
-                    log.info(f"Updating the test_gating_status for: {update.alias}")
-                    update.update_test_gating_status()
+                    alias = refresh_test_gating_status(update)
+
+        # This must be run after the session is closed so the flag is committed
+        if alias:
+            schedule_test_gating_refresh(alias)
@@ -0,0 +1,339 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Outbound HTTP requests to the services Bodhi talks to.
+
+Each service (Greenwave, WaiverDB, ResultsDB, Pagure, the wiki...) gets its own
+:class:`ServiceClient`, with its own connection pool, timeout and circuit breaker. Every request
+sent through a service's adapter is timed in the ``outbound_http_request`` histogram.
+"""
+from json import dumps
+import logging
+import random
+import threading
+import time
+import typing
+
+from prometheus_client import Gauge, Histogram
+import mediawiki
+import requests
+import requests.adapters
+
+from bodhi.server.config import config
+
+
+log = logging.getLogger(__name__)
+
+
+outbound_http_request = Histogram(
+    'outbound_http_request',
+    'HTTP requests sent to other services',
+    labelnames=['service', 'method', 'status'],
+)
+
+outbound_http_circuit_open = Gauge(
+    'outbound_http_circuit_open',
+    'Whether requests to a service are currently refused by its circuit breaker',
+    labelnames=['service'],
+)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request to a service that keeps failing."""
+
+
+class CircuitBreaker(object):
+    """
+    Stop sending requests to a service after too many consecutive failures.
+
+    Once open, the circuit refuses requests until reset_timeout seconds have passed. The circuit is
+    then half-open: the next request is let through alone, and the others are refused until its
+    outcome is recorded. If it succeeds the circuit closes again, and if it fails the circuit opens
+    for another reset_timeout seconds.
+    """
+
+    def __init__(self, service: str, failures: int, reset_timeout: float):
+        """
+        Initialize the CircuitBreaker.
+
+        Args:
+            service: The name of the service, used in logs and metrics.
+            failures: The number of consecutive failures that opens the circuit. ``0`` disables
+                the circuit breaker.
+            reset_timeout: How long the circuit stays open, in seconds.
+        """
+        self.service = service
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._half_open = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        """
+        Raise if requests to the service are currently refused.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or if it is half-open and another request
+                is already being let through.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._half_open or time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(
+                    f'Not contacting {self.service}, it failed {self._consecutive_failures} times '
+                    'in a row')
+            self._half_open = True
+
+    def record(self, success: bool):
+        """
+        Record the outcome of a request.
+
+        Args:
+            success: Whether the request succeeded.
+        """
+        with self._lock:
+            self._half_open = False
+            if success:
+                if self._opened_at is not None:
+                    log.info('Closing the circuit breaker of %s', self.service)
+                    outbound_http_circuit_open.labels(service=self.service).set(0)
+                self._consecutive_failures = 0
+                self._opened_at = None
+                return
+
+            self._consecutive_failures += 1
+            if self.failures and self._consecutive_failures >= self.failures:
+                if self._opened_at is None:
+                    log.warning('Opening the circuit breaker of %s after %d failures',
+                                self.service, self._consecutive_failures)
+                    outbound_http_circuit_open.labels(service=self.service).set(1)
+                self._opened_at = time.monotonic()
+
+
+class FakeTransport(object):
+    """
+    Answer requests with canned responses instead of sending them, for offline tests.
+
+    Install it with :func:`install_fake_transport`. Responses are registered per method and URL
+    with :meth:`add`, and the requests that were sent are kept in :attr:`requests`.
+    """
+
+    def __init__(self):
+        """Initialize the FakeTransport."""
+        self.requests = []
+        self._responses = {}
+
+    def add(self, method: str, url: str, status: int = 200, json: typing.Any = None,
+            body: bytes = b'', exception: typing.Optional[Exception] = None):
+        """
+        Register a response.
+
+        Responses registered for the same method and URL are returned in turn, and the last one
+        is repeated.
+
+        Args:
+            method: The HTTP method.
+            url: The full URL, including the query string.
+            status: The status code of the response.
+            json: If not None, serialized as the body of the response.
+            body: The body of the response, if json is None.
+            exception: If given, raised instead of returning a response.
+        """
+        if json is not None:
+            body = dumps(json).encode('utf-8')
+        self._responses.setdefault((method.upper(), url), []).append((status, body, exception))
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """
+        Return the response registered for the given request.
+
+        Args:
+            request: The request to answer.
+            kwargs: The other arguments of :meth:`requests.adapters.HTTPAdapter.send`.
+        Returns:
+            The registered response, or a 404 response if none was registered.
+        """
+        self.requests.append(request)
+        responses = self._responses.get((request.method, request.url))
+        if not responses:
+            status, body, exception = 404, b'', None
+        elif len(responses) > 1:
+            status, body, exception = responses.pop(0)
+        else:
+            status, body, exception = responses[0]
+        if exception is not None:
+            raise exception
+        response = requests.Response()
+        response.status_code = status
+        response._content = body
+        response.url = request.url
+        response.request = request
+        return response
+
+
+class ServiceAdapter(requests.adapters.HTTPAdapter):
+    """A pooled transport adapter that times requests and feeds a service's circuit breaker."""
+
+    transport = None  # type: typing.Optional[FakeTransport]
+
+    def __init__(self, service: str, breaker: CircuitBreaker, pool_size: int):
+        """
+        Initialize the ServiceAdapter.
+
+        Args:
+            service: The name of the service, used in metrics.
+            breaker: The circuit breaker of the service.
+            pool_size: The maximum number of connections kept open to the service.
+        """
+        self.service = service
+        self.breaker = breaker
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """
+        Send the request, unless the circuit breaker refuses it.
+
+        Args:
+            request: The request to send.
+            kwargs: The other arguments of :meth:`requests.adapters.HTTPAdapter.send`.
+        Returns:
+            The response.
+        """
+        self.breaker.check()
+        start = time.monotonic()
+        status = 'error'
+        try:
+            if self.transport is not None:
+                response = self.transport.send(request, **kwargs)
+            else:
+                response = super().send(request, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            outbound_http_request.labels(
+                service=self.service, method=request.method, status=status,
+            ).observe(time.monotonic() - start)
+            # Server errors mean the service is unwell, client errors mean we asked for something
+            # it does not have.
+            self.breaker.record(status != 'error' and not status.startswith('5'))
+
+
+class ServiceClient(object):
+    """The connection pool, timeout, backoff and circuit breaker used to talk to one service."""
+
+    def __init__(self, service: str):
+        """
+        Initialize the ServiceClient from Bodhi's settings.
+
+        Args:
+            service: The name of the service, e.g. ``greenwave``.
+        """
+        self.service = service
+        self.timeout = int(config.get('http.timeouts').get(service, config.get('http.timeout')))
+        self.pool_size = int(config.get('http.pool_sizes').get(service,
+                                                               config.get('http.pool_size')))
+        self.backoff_base = config.get('http.backoff_base')
+        self.backoff_max = config.get('http.backoff_max')
+        self.breaker = CircuitBreaker(service, config.get('http.circuit_breaker_failures'),
+                                      config.get('http.circuit_breaker_reset'))
+        self.adapter = ServiceAdapter(service, self.breaker, self.pool_size)
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """Return the pooled session used to talk to the service, creating it if needed."""
+        with self._lock:
+            if self._session is None:
+                self._session = self.mount(requests.Session())
+            return self._session
+
+    def mount(self, session: requests.Session) -> requests.Session:
+        """
+        Route all the requests of the given session through this service's adapter.
+
+        Args:
+            session: The session to change.
+        Returns:
+            The given session.
+        """
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        return session
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Return how long to wait before retrying a failed request.
+
+        Args:
+            attempt: How many times the request was already retried.
+        Returns:
+            A random delay up to an exponentially growing cap, in seconds.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+_clients = {}  # type: typing.Dict[str, ServiceClient]
+_clients_lock = threading.Lock()
+
+
+def get_client(service: str) -> ServiceClient:
+    """
+    Return the client of the given service, creating it on first use.
+
+    Args:
+        service: The name of the service. It is lowercased, so ``Greenwave`` and ``greenwave`` are
+            the same service.
+    Returns:
+        The client of the service.
+    """
+    service = service.lower()
+    with _clients_lock:
+        if service not in _clients:
+            _clients[service] = ServiceClient(service)
+        return _clients[service]
+
+
+def install_fake_transport(transport: typing.Optional[FakeTransport]):
+    """
+    Answer all outbound requests with the given fake transport, or send them again if None.
+
+    Args:
+        transport: The fake transport to use, or None.
+    """
+    ServiceAdapter.transport = transport
+
+
+def reset():
+    """Forget all the clients, so they get created again from the current settings."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.adapter.close()
+        _clients.clear()
+
+
+class MediaWiki(mediawiki.MediaWiki):
+    """A MediaWiki client that talks to the wiki through the ``wiki`` service client."""
+
+    def _reset_session(self):
+        """Recreate the session like the parent class does, and route it through our adapter."""
+        super()._reset_session()
+        get_client('wiki').mount(self._session)
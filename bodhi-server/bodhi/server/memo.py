@@ -0,0 +1,154 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Memoize derived properties of the models for the duration of a request or a compose.
+
+Properties decorated with :class:`memoized_property` are computed once per scope and per
+instance. Scopes are opened around each web request and each compose with :func:`scope`, and
+outside of a scope the properties are computed on every access, like plain properties.
+
+Any change to the database objects during a scope (setting an attribute, appending to or removing
+from a relationship, flushing, committing, rolling back, refreshing or expiring an instance)
+calls :func:`invalidate`, which drops all the values memoized in the scope. Changes are rare
+compared to reads while rendering an update, so there's no need to track which values depend on
+which attributes.
+
+Every lookup in a scope is counted in the ``memoized_property_lookups`` counter, and in the
+:attr:`Scope.lookups` of the scope, which can be logged to profile a request.
+"""
+from collections import defaultdict
+import contextlib
+import contextvars
+import functools
+import typing
+
+from prometheus_client import Counter
+
+
+memoized_property_lookups = Counter(
+    'memoized_property_lookups',
+    'Lookups of the memoized properties of the models',
+    labelnames=['property', 'result'],
+)
+
+_MEMO = '_memoized_properties'
+
+
+class Scope(object):
+    """The memoized values of a request or a compose, and how often they were looked up."""
+
+    def __init__(self):
+        """Initialize the Scope."""
+        self.generation = 0
+        self.lookups = defaultdict(
+            lambda: {'hits': 0, 'misses': 0})  # type: typing.Dict[str, typing.Dict[str, int]]
+
+    def invalidate(self):
+        """Drop all the values memoized in this scope."""
+        self.generation += 1
+
+
+_scope = contextvars.ContextVar('memo_scope', default=None)  # type: contextvars.ContextVar
+
+
+@contextlib.contextmanager
+def scope() -> typing.Iterator[Scope]:
+    """
+    Memoize the properties looked up in the body of the with statement.
+
+    Yields:
+        The new scope.
+    """
+    token = _scope.set(Scope())
+    try:
+        yield _scope.get()
+    finally:
+        _scope.reset(token)
+
+
+def current_scope() -> typing.Optional[Scope]:
+    """
+    Return the current scope.
+
+    Returns:
+        The current scope, or None if the properties are not memoized.
+    """
+    return _scope.get()
+
+
+def invalidate(*args, **kwargs):
+    """
+    Drop all the values memoized in the current scope, if any.
+
+    This can be used as a listener of any SQLAlchemy event, so it ignores its arguments.
+    """
+    current = _scope.get()
+    if current is not None:
+        current.invalidate()
+
+
+class memoized_property(object):
+    """A property whose value is computed once per scope, see :func:`scope`."""
+
+    def __init__(self, func: typing.Callable[[typing.Any], typing.Any]):
+        """
+        Initialize the memoized_property.
+
+        Args:
+            func: The getter of the property.
+        """
+        self.func = func
+        self.name = func.__name__
+        functools.update_wrapper(self, func)
+
+    def __get__(self, obj, objtype=None):
+        """
+        Return the memoized value of the property, computing it if needed.
+
+        Args:
+            obj (object): The instance the property is looked up on, or None if looked up on the
+                class.
+            objtype (type): The class of the instance.
+        Returns:
+            object: The value of the property, or this memoized_property if looked up on the
+                class.
+        """
+        if obj is None:
+            return self
+        current = _scope.get()
+        if current is None:
+            return self.func(obj)
+
+        memo = obj.__dict__.get(_MEMO)
+        if memo is None or memo[0] is not current or memo[1] != current.generation:
+            memo = (current, current.generation, {})
+            obj.__dict__[_MEMO] = memo
+        values = memo[2]
+        if self.name in values:
+            current.lookups[self.name]['hits'] += 1
+            memoized_property_lookups.labels(property=self.name, result='hit').inc()
+            return values[self.name]
+
+        current.lookups[self.name]['misses'] += 1
+        memoized_property_lookups.labels(property=self.name, result='miss').inc()
+        value = self.func(obj)
+        # Computing the value may have changed the database objects, which drops what was
+        # memoized until now, including this value.
+        if memo[1] == current.generation:
+            values[self.name] = value
+        return value
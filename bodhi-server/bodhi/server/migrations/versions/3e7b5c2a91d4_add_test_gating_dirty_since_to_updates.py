@@ -0,0 +1,44 @@
+# Copyright (c) 2024 Red Hat, Inc.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Add test_gating_dirty_since to updates.
+
+Revision ID: 3e7b5c2a91d4
+Revises: f660455231d4
+Create Date: 2024-05-13 10:12:41.538217
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e7b5c2a91d4'
+down_revision = 'f660455231d4'
+
+
+def upgrade():
+    """Add the test_gating_dirty_since column."""
+    op.add_column(
+        'updates',
+        sa.Column('test_gating_dirty_since', sa.DateTime, nullable=True),
+    )
+
+
+def downgrade():
+    """Drop the test_gating_dirty_since column."""
+    op.drop_column('updates', 'test_gating_dirty_since')
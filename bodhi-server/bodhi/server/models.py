@@ -28,7 +28,6 @@ import time
 import typing
 import uuid
 
-from mediawiki import MediaWiki
 from packaging.version import parse as parse_version
 from sqlalchemy import __version__ as sqlalchemy_version
 from sqlalchemy import (
@@ -49,6 +48,7 @@ from sqlalchemy import (
 )
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import class_mapper, declarative_base, relationship, validates
+from sqlalchemy.orm import Session as ORMSession
 from sqlalchemy.orm.base import NEVER_SET
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.properties import RelationshipProperty
@@ -59,13 +59,15 @@ import rpm
 from bodhi.messages.schemas import buildroot_override as override_schemas
 from bodhi.messages.schemas import errata as errata_schemas
 from bodhi.messages.schemas import update as update_schemas
-from bodhi.server import bugs, buildsys, log, mail, notifications, Session, util
+from bodhi.server import (
+    bugs, buildsys, http_client, log, mail, memo, notifications, Session, util)
 from bodhi.server.config import config
 from bodhi.server.exceptions import (
     BodhiException,
     ExternalCallException,
     LockedUpdateException,
 )
+from bodhi.server.http_client import MediaWiki
 from bodhi.server.tasks import (
     fetch_test_cases_task,
     tag_update_builds_task,
@@ -74,7 +76,7 @@ from bodhi.server.tasks import (
 from bodhi.server.util import avatar as get_avatar
 from bodhi.server.util import (
     build_evr,
-    get_critpath_components,
+    contains_critpath_component,
     get_grouped_critpath_components,
     get_rpm_header,
     header,
@@ -1599,7 +1601,8 @@ class Build(Base):
         log.debug(f'Querying the wiki for test cases of {self.nvr}')
         try:
             wiki = MediaWiki(config.get('wiki_url'),
-                             user_agent=config.get('wiki_user_agent'))
+                             user_agent=config.get('wiki_user_agent'),
+                             timeout=http_client.get_client('wiki').timeout)
         except Exception as ex:
             raise ExternalCallException(f'Failed to connect to Fedora Wiki: {ex}')
         cat_page = f'Package {self.package.external_name} test cases'
@@ -1916,7 +1919,7 @@ class Update(Base):
     """
 
     __tablename__ = 'updates'
-    __exclude_columns__ = ('id', 'user_id', 'release_id', 'compose')
+    __exclude_columns__ = ('id', 'user_id', 'release_id', 'compose', 'test_gating_dirty_since')
     __include_extras__ = ('date_pushed', 'meets_testing_requirements', 'url', 'title',
                           'version_hash')
     __get_by__ = ('alias',)
@@ -1989,6 +1992,8 @@ class Update(Base):
 
     # Greenwave
     test_gating_status = Column(TestGatingStatus.db_type(), default=None, nullable=True)
+    # Set when a refresh of test_gating_status has been scheduled, see mark_test_gating_dirty().
+    test_gating_dirty_since = Column(DateTime, default=None, nullable=True)
 
     # Koji tag, if any, from which the list of builds was populated initially.
     from_tag = Column(UnicodeText, nullable=True)
@@ -2094,7 +2099,7 @@ class Update(Base):
         else:
             return None
 
-    @property
+    @memo.memoized_property
     def mandatory_days_in_testing(self):
         """
         Calculate and return how many days an update should be in testing before becoming stable.
@@ -2107,7 +2112,7 @@ class Update(Base):
         else:
             return self.release.mandatory_days_in_testing
 
-    @property
+    @memo.memoized_property
     def karma(self):
         """
         Calculate and return the karma for the Update.
@@ -2211,7 +2216,7 @@ class Update(Base):
         components = build_names_by_type(builds)
 
         for ptype in components:
-            if get_critpath_components(release_branch, ptype, frozenset(components[ptype])):
+            if contains_critpath_component(release_branch, ptype, frozenset(components[ptype])):
                 return True
 
         return False
@@ -2442,6 +2447,28 @@ class Update(Base):
             # consumer.
             self.test_gating_status = TestGatingStatus.waiting
 
+    def mark_test_gating_dirty(self, window: int) -> bool:
+        """
+        Flag the test_gating_status as needing a refresh in window seconds.
+
+        The flag is set with a conditional UPDATE, so that when several consumers receive results
+        for the same update at once only one of them schedules the refresh. A flag older than
+        twice the window belongs to a refresh that never ran, and is set again.
+
+        Args:
+            window: How long the refresh is delayed, in seconds.
+        Returns:
+            True if the update was not flagged yet and the caller must schedule the refresh.
+        """
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=2 * window)
+        flagged = Update.query.filter(
+            Update.id == self.id,
+            or_(Update.test_gating_dirty_since.is_(None),
+                Update.test_gating_dirty_since < stale),
+        ).update({'test_gating_dirty_since': now}, synchronize_session='fetch')
+        return flagged == 1
+
     @classmethod
     def new(cls, request, data):
         """
@@ -2749,7 +2776,7 @@ class Update(Base):
         log.info(f"Done editing {up.alias}")
         return up, caveats
 
-    @property
+    @memo.memoized_property
     def signed(self):
         """
         Return whether the update is considered signed or not.
@@ -2767,7 +2794,7 @@ class Update(Base):
             return True
         return all(build.signed for build in self.builds)
 
-    @property
+    @memo.memoized_property
     def content_type(self):
         """
         Return the ContentType associated with this update.
@@ -3275,25 +3302,34 @@ class Update(Base):
 
         self.test_gating_status = TestGatingStatus.waiting
 
-    def add_tag(self, tag):
+    def add_tag(self, tag, koji=None):
         """
         Add the given koji tag to all :class:`Builds <Build>` in this update.
 
         Args:
             tag (str): The tag to be added to the builds.
+            koji (koji.ClientSession or None): A koji client to use to perform the action. If None
+                (the default), this method will use :func:`buildsys.get_session` to get one and
+                multicall will be used.
+        Returns:
+            list or None: If a koji client was provided, ``None`` is returned. Else, a list of tasks
+                from ``koji.multiCall()`` are returned.
         """
         log.debug('Adding tag %s to %s', tag, self.get_title())
         if not tag:
             log.warning("Not adding builds of %s to empty tag", self.title)
             return []  # An empty iterator in place of koji multicall
 
-        koji = buildsys.get_session()
-        koji.multicall = True
+        return_multicall = not koji
+        if not koji:
+            koji = buildsys.get_session()
+            koji.multicall = True
         for build in self.builds:
             koji.tagBuild(tag, build.nvr, force=True)
-        return koji.multiCall()
+        if return_multicall:
+            return koji.multiCall()
 
-    def remove_tag(self, tag, koji=None):
+    def remove_tag(self, tag, koji=None, build_tags=None):
         """
         Remove the given koji tag from all builds in this update.
 
@@ -3302,6 +3338,8 @@ class Update(Base):
             koji (koji.ClientSession or None): A koji client to use to perform the action. If None
                 (the default), this method will use :func:`buildsys.get_session` to get one and
                 multicall will be used.
+            build_tags (dict or None): An optional mapping of build NVRs to lists of their known
+                Koji tags. Builds that appear in it without the given tag are not untagged.
         Returns:
             list or None: If a koji client was provided, ``None`` is returned. Else, a list of tasks
                 from ``koji.multiCall()`` are returned.
@@ -3316,6 +3354,9 @@ class Update(Base):
             koji = buildsys.get_session()
             koji.multicall = True
         for build in self.builds:
+            if build_tags and build.nvr in build_tags and tag not in build_tags[build.nvr]:
+                log.debug('%s is not tagged with %s, skipping', build.nvr, tag)
+                continue
             koji.untagBuild(tag, build.nvr, force=True)
         if return_multicall:
             return koji.multiCall()
@@ -3781,13 +3822,16 @@ class Update(Base):
         """
         return self.release.long_name.lower().replace(' ', '-')
 
-    def check_requirements(self, session, settings):
+    def check_requirements(self, session, settings, resultsdb=None):
         """
         Check that an update meets its self-prescribed policy to be pushed.
 
         Args:
             session (sqlalchemy.orm.session.Session): A database session. Unused.
             settings (bodhi.server.config.BodhiConfig): Bodhi's settings.
+            resultsdb (bodhi.server.util.ResultsDBClient or None): The client to query ResultsDB
+                with. Passing the same client when checking many updates lets them share its
+                cache. If None (the default), a new client is used.
         Returns:
             tuple: A tuple containing (result, reason) where result is a bool
                 and reason is a str.
@@ -3809,11 +3853,13 @@ class Update(Base):
                           self.last_modified, str(e))
             return False, "Failed to determine last_modified: %r" % str(e)
 
+        if resultsdb is None:
+            resultsdb = util.ResultsDBClient(settings)
+        testcases = ','.join(requirements)
+
         try:
             # query results for this update
-            query = dict(type='bodhi_update', item=self.alias, since=since,
-                         testcases=','.join(requirements))
-            results = list(util.taskotron_results(settings, **query))
+            queries = [('bodhi_update', self.alias, since, testcases)]
 
             # query results for each build
             # retrieve timestamp for each build so that queries can be optimized
@@ -3835,10 +3881,10 @@ class Update(Base):
                 buildinfo = multicall_response[0]
                 ts = datetime.utcfromtimestamp(buildinfo['completion_ts']).isoformat()
 
-                query = dict(type='koji_build', item=build.nvr, since=ts,
-                             testcases=','.join(requirements))
-                build_results = list(util.taskotron_results(settings, **query))
-                results.extend(build_results)
+                queries.append(('koji_build', build.nvr, ts, testcases))
+
+            results = [result for query_results in resultsdb.latest_results(queries)
+                       for result in query_results]
 
         except Exception as e:
             log.exception("Failed retrieving requirements results: %r", str(e))
@@ -3969,7 +4015,7 @@ class Update(Base):
         possibilities.sort()  # Sort smallest to largest (oldest to newest)
         return possibilities[-1]  # Return the last one
 
-    @property
+    @memo.memoized_property
     def critpath_approved(self):
         """
         Return whether or not this critpath update has been approved.
@@ -3991,7 +4037,7 @@ class Update(Base):
         return self.num_admin_approvals >= config.get('critpath.num_admin_approvals') and \
             self.karma >= min_karma
 
-    @property
+    @memo.memoized_property
     def meets_testing_requirements(self):
         """
         Return whether or not this update meets its release's testing requirements.
@@ -4065,7 +4111,7 @@ class Update(Base):
                 return num_days
         return 0
 
-    @property
+    @memo.memoized_property
     def days_in_testing(self):
         """
         Return the number of days that this update has been in testing.
@@ -4097,7 +4143,7 @@ class Update(Base):
                     break
         return approvals
 
-    @property
+    @memo.memoized_property
     def test_cases(self):
         """
         Return a list of all TestCase names associated with all packages in this update.
@@ -4519,6 +4565,8 @@ class Compose(Base):
         """
         Return ``True`` if this compose has a higher priority than the other.
 
+        Security composes go first, then stable composes, and then the smaller compose.
+
         Args:
             other (Compose): Another compose we are comparing this compose to for sorting.
         Return:
@@ -4530,7 +4578,9 @@ class Compose(Base):
             return False
         if self.request == UpdateRequest.stable and other.request != UpdateRequest.stable:
             return True
-        return False
+        if other.request == UpdateRequest.stable and self.request != UpdateRequest.stable:
+            return False
+        return len(self.updates) < len(other.updates)
 
     def __str__(self):
         """
@@ -5106,3 +5156,43 @@ class BuildrootOverride(Base):
 
         notifications.publish(override_schemas.BuildrootOverrideUntagV1.from_dict(
             {'override': self}))
+
+
+@event.listens_for(Base, 'mapper_configured', propagate=True)
+def _invalidate_memoized_properties_on_change(mapper, class_):
+    """
+    Drop the memoized properties whenever an attribute of an instance of the class changes.
+
+    Args:
+        mapper (sqlalchemy.orm.Mapper): The mapper of the class.
+        class_ (type): The mapped class.
+    """
+    for prop in mapper.iterate_properties:
+        if prop.parent is not mapper:
+            # Inherited from the parent class, which already listens for changes.
+            continue
+        attr = getattr(class_, prop.key)
+        event.listen(attr, 'set', memo.invalidate, propagate=True)
+        if isinstance(prop, RelationshipProperty) and prop.uselist:
+            event.listen(attr, 'append', memo.invalidate, propagate=True)
+            event.listen(attr, 'remove', memo.invalidate, propagate=True)
+
+
+event.listen(Base, 'refresh', memo.invalidate, propagate=True)
+event.listen(Base, 'expire', memo.invalidate, propagate=True)
+# Flushes insert new comments and delete objects, which changes what the relationships load.
+event.listen(ORMSession, 'after_flush', memo.invalidate)
+event.listen(ORMSession, 'after_commit', memo.invalidate)
+event.listen(ORMSession, 'after_rollback', memo.invalidate)
+
+
+@event.listens_for(ORMSession, 'do_orm_execute')
+def _invalidate_memoized_properties_on_bulk_change(orm_execute_state):
+    """
+    Drop the memoized properties when rows are updated or deleted in bulk.
+
+    Args:
+        orm_execute_state (sqlalchemy.orm.ORMExecuteState): The statement being executed.
+    """
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        memo.invalidate()
@@ -32,8 +32,15 @@ from bodhi.server.tasks import compose as compose_task
 _koji = None
 
 
-def update_sig_status(update):
-    """Update build signature status for builds in update."""
+def update_sig_status(updates):
+    """
+    Update build signature status for the unsigned builds in updates.
+
+    The tags of all the unsigned builds are fetched at once, with chunked Koji multicalls.
+
+    Args:
+        updates (list): The Updates whose builds should be refreshed.
+    """
     global _koji
     if _koji is None:
         # We don't want to authenticate to the buildsystem, because this script is often mistakenly
@@ -41,14 +48,29 @@ def update_sig_status(update):
         # which will cause the compose to fail when it tries to use it to authenticate to Koji.
         buildsys.setup_buildsystem(config, authenticate=False)
         _koji = get_koji(None)
-    for build in update.builds:
-        if not build.signed:
-            build_tags = build.get_tags()
-            if update.release.pending_signing_tag not in build_tags:
-                click.echo('Build %s was refreshed as signed' % build.nvr)
-                build.signed = True
-            else:
-                click.echo('Build %s still unsigned' % build.nvr)
+    builds = [(update, build) for update in updates for build in update.builds
+              if not build.signed]
+    if not builds:
+        return
+
+    click.echo('Refreshing the signature status of %d builds' % len(builds))
+    koji = buildsys.MulticallExecutor()
+    for update, build in builds:
+        koji.listTags(build.nvr)
+    results = koji.run(
+        progress=lambda done, total: click.echo('Checked %d of %d builds' % (done, total)))
+
+    for (update, build), result in zip(builds, results):
+        if isinstance(result, dict):
+            click.echo('Unable to get the tags of build %s: %s' % (
+                build.nvr, result['faultString']), err=True)
+            continue
+        build_tags = [tag['name'] for tag in result[0]]
+        if update.release.pending_signing_tag not in build_tags:
+            click.echo('Build %s was refreshed as signed' % build.nvr)
+            build.signed = True
+        else:
+            click.echo('Build %s still unsigned' % build.nvr)
 
 
 def check_if_updates_and_builds_set(
@@ -175,10 +197,12 @@ def push(username, yes, **kwargs):
             if kwargs.get('updates'):
                 query = query.filter(Update.alias.in_(kwargs['updates'].split(',')))
 
-            for update in query.all():
-                # Skip unsigned updates (this checks that all builds in the update are signed)
-                update_sig_status(update)
+            candidates = query.all()
+            update_sig_status(candidates)
+            session.flush()
 
+            for update in candidates:
+                # Skip unsigned updates (this checks that all builds in the update are signed)
                 if not update.signed:
                     click.echo(
                         f'Warning: {update.get_title()} has unsigned builds and has been skipped',
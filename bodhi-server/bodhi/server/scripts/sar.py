@@ -15,23 +15,118 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
-"""This script will print out SAR data for a FAS account."""
+"""
+This script will print out SAR data for a FAS account.
+
+The comments and updates of the account are read in batches of ``BATCH_SIZE`` rows and written
+out as they are read, so that accounts with a long history are exported in bounded memory.
+"""
 
 import json
 import sys
+import types
+import typing
 
+from sqlalchemy.orm import joinedload, lazyload, selectinload
 import click
 import sqlalchemy
 
 from bodhi.server import config, initialize_db, models
 
 
+# The number of rows fetched from the database at once
+BATCH_SIZE = 500
+
+
+def _comments(user: models.User) -> typing.Iterator[dict]:
+    """
+    Yield the comments of the given user, reading them in batches.
+
+    Args:
+        user: The user whose comments should be yielded.
+    Yields:
+        A dictionary describing each comment.
+    """
+    rows = models.Comment.query.with_entities(
+        models.Comment.karma, models.Comment.karma_critpath, models.Comment.text,
+        models.Comment.timestamp, models.Update.alias,
+    ).join(
+        models.Update, models.Comment.update_id == models.Update.id
+    ).filter(
+        models.Comment.user_id == user.id
+    ).order_by(models.Comment.id).yield_per(BATCH_SIZE)
+    for karma, karma_critpath, text, timestamp, alias in rows:
+        yield {'karma': karma, 'karma_critpath': karma_critpath, 'text': text,
+               'timestamp': timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+               'update_alias': alias, 'username': user.name}
+
+
+def _updates(user: models.User) -> typing.Iterator[dict]:
+    """
+    Yield the updates of the given user, reading them in batches with their builds and bugs.
+
+    Args:
+        user: The user whose updates should be yielded.
+    Yields:
+        A dictionary describing each update.
+    """
+    # The comments of the updates are not needed, and joined eager loading of collections can't
+    # be combined with yield_per().
+    updates = models.Update.query.options(
+        lazyload(models.Update.comments),
+        joinedload(models.Update.release),
+        selectinload(models.Update.builds),
+        selectinload(models.Update.bugs),
+    ).filter(
+        models.Update.user_id == user.id
+    ).order_by(models.Update.id).yield_per(BATCH_SIZE)
+    for u in updates:
+        yield {'autokarma': u.autokarma, 'stable_karma': u.stable_karma,
+               'unstable_karma': u.unstable_karma, 'requirements': u.requirements,
+               'require_bugs': u.require_bugs, 'require_testcases': u.require_testcases,
+               'notes': u.notes, 'type': str(u.type), 'severity': str(u.severity),
+               'suggest': str(u.suggest), 'close_bugs': u.close_bugs, 'alias': u.alias,
+               'builds': [b.nvr for b in u.builds], 'release_name': u.release.name,
+               'bugs': [b.bug_id for b in u.bugs], 'user': user.name,
+               'date_submitted': u.date_submitted.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def _json_chunks(value: typing.Any) -> typing.Iterator[str]:
+    """
+    Serialize the given value to JSON piece by piece.
+
+    Dictionaries are serialized key by key, and generators item by item as JSON arrays, so that
+    they never need to be held in memory at once. The result is the same as ``json.dumps(value,
+    sort_keys=True)`` with the generators turned into lists.
+
+    Args:
+        value: The value to serialize.
+    Yields:
+        The pieces of the JSON document.
+    """
+    if isinstance(value, dict):
+        yield '{'
+        for i, key in enumerate(sorted(value)):
+            yield '{}{}: '.format(', ' if i else '', json.dumps(key))
+            yield from _json_chunks(value[key])
+        yield '}'
+    elif isinstance(value, types.GeneratorType):
+        yield '['
+        for i, item in enumerate(value):
+            if i:
+                yield ', '
+            yield from _json_chunks(item)
+        yield ']'
+    else:
+        yield json.dumps(value, sort_keys=True)
+
+
 def print_human_readable_format(sar_data):
     """
     Print user data in human readable format.
 
     Args:
-        sar_data (dict): User data to be printed.
+        sar_data (dict): User data to be printed. The comments and updates may be iterators.
     """
     header_start = "==========>"
     header_stop = "<=========="
@@ -80,29 +175,18 @@ def get_user_data(username, human_readable):
         sys.exit(0)
 
     sar_data[user.name] = {}
-    sar_data[user.name]['comments'] = [
-        {'karma': c.karma, 'karma_critpath': c.karma_critpath, 'text': c.text,
-         'timestamp': c.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-         'update_alias': c.update.alias, 'username': c.user.name}
-        for c in user.comments]
+    sar_data[user.name]['comments'] = _comments(user)
     sar_data[user.name]['email'] = user.email
     sar_data[user.name]['groups'] = [g.name for g in user.groups]
     sar_data[user.name]['name'] = user.name
-    sar_data[user.name]['updates'] = [
-        {'autokarma': u.autokarma, 'stable_karma': u.stable_karma,
-         'unstable_karma': u.unstable_karma, 'requirements': u.requirements,
-         'require_bugs': u.require_bugs, 'require_testcases': u.require_testcases,
-         'notes': u.notes, 'type': str(u.type), 'severity': str(u.severity),
-         'suggest': str(u.suggest), 'close_bugs': u.close_bugs, 'alias': u.alias,
-         'builds': [b.nvr for b in u.builds], 'release_name': u.release.name,
-         'bugs': [b.bug_id for b in u.bugs], 'user': u.user.name,
-         'date_submitted': u.date_submitted.strftime('%Y-%m-%d %H:%M:%S')}
-        for u in user.updates]
+    sar_data[user.name]['updates'] = _updates(user)
 
     if human_readable:
         print_human_readable_format(sar_data)
     else:
-        click.echo(json.dumps(sar_data, sort_keys=True))
+        for chunk in _json_chunks(sar_data):
+            click.echo(chunk, nl=False)
+        click.echo()
 
 
 if __name__ == '__main__':
@@ -18,22 +18,21 @@
 """
 Used to remove the pending and testing tags from updates in a branched release.
 
-Since a separate task composes the branched stable repos, this will leave
-those stable updates with the testing tags for 1 day before untagging.
+This runs :mod:`bodhi.server.tasks.untag_branched` in the foreground, which is also run
+periodically by Celery as the ``untag_branched`` task. Pass ``--dry-run`` to only log the tags
+that would be removed.
 
 https://github.com/fedora-infra/bodhi/issues/576
 """
 
-from datetime import datetime, timedelta
 import os
 import sys
 import logging
 
 from pyramid.paster import get_appsettings
 
-from bodhi.server import buildsys, Session, initialize_db
+from bodhi.server import initialize_db
 from bodhi.server.logging import setup as setup_logging
-from ..models import Release, ReleaseState, Update, UpdateStatus
 
 
 def usage(argv):
@@ -44,7 +43,7 @@ def usage(argv):
         argv (list): The arguments passed to the script.
     """
     cmd = os.path.basename(argv[0])
-    print('usage: %s <config_uri>\n'
+    print('usage: %s [--dry-run] <config_uri>\n'
           '(example: "%s development.ini")' % (cmd, cmd))
     sys.exit(1)
 
@@ -56,49 +55,25 @@ def main(argv=sys.argv):
     Args:
         argv (list): The arguments passed to the script. Defaults to sys.argv.
     """
-    if len(argv) != 2:
+    args = argv[1:]
+    dry_run = '--dry-run' in args
+    if dry_run:
+        args.remove('--dry-run')
+    if len(args) != 1:
         usage(argv)
 
-    config_uri = argv[1]
+    config_uri = args[0]
 
     setup_logging()
     log = logging.getLogger(__name__)
 
     settings = get_appsettings(config_uri)
     initialize_db(settings)
-    db = Session()
-    koji = buildsys.get_session()
-    one_day = timedelta(days=1)
-    now = datetime.utcnow()
+    # Import here or the config will be loaded too early.
+    from bodhi.server.tasks import untag_branched
 
     try:
-        for release in db.query(Release).filter_by(
-                state=ReleaseState.pending).all():
-            log.info(release.name)
-            for update in db.query(Update).filter_by(
-                    release=release, status=UpdateStatus.stable).all():
-                if now - update.date_stable > one_day:
-                    for build in update.builds:
-                        tags = build.get_tags()
-                        stable_tag = release.dist_tag
-                        testing_tag = release.testing_tag
-                        pending_signing_tag = release.pending_signing_tag
-                        pending_testing_tag = release.pending_testing_tag
-                        if stable_tag not in tags:
-                            log.error('%s not tagged as stable %s' % (build.nvr, tags))
-                            continue
-                        if testing_tag in tags:
-                            log.info('Removing %s from %s' % (testing_tag, build.nvr))
-                            koji.untagBuild(testing_tag, build.nvr)
-                        if pending_signing_tag in tags:
-                            log.info('Removing %s from %s' % (pending_signing_tag, build.nvr))
-                            koji.untagBuild(pending_signing_tag, build.nvr)
-                        if pending_testing_tag in tags:
-                            log.info('Removing %s from %s' % (pending_testing_tag, build.nvr))
-                            koji.untagBuild(pending_testing_tag, build.nvr)
-        db.commit()
+        untag_branched.main(dry_run=dry_run)
     except Exception as e:
         log.error(e)
-        db.rollback()
-        Session.remove()
         sys.exit(1)
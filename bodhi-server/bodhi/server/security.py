@@ -16,6 +16,8 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """A collection of authentication and authorization functions and classes."""
+import threading
+import time
 import typing
 
 from cornice.errors import Errors
@@ -27,10 +29,119 @@ from pyramid.authorization import (
 from pyramid.request import RequestLocalCache
 from pyramid.threadlocal import get_current_registry
 
+from bodhi.server.config import config
+
 if typing.TYPE_CHECKING:  # pragma: no cover
     import pyramid.request.Request  # noqa: 401
 
 
+class IdentityCache:
+    """
+    Remember the identity of each auth ticket for a little while.
+
+    This saves querying the user and their groups on every authenticated request. The identities
+    are kept for ``authtkt.identity_cache_ttl`` seconds, so group changes made by another process
+    are noticed within that delay. :func:`bodhi.server.auth.utils.create_or_update_user` forgets
+    the identities of the users it changes right away.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        """
+        Initialize the IdentityCache.
+
+        Args:
+            max_size: The maximum number of identities kept. Expired identities are dropped when
+                this is reached, and all of them if that's not enough.
+        """
+        self.max_size = max_size
+        self._identities = {}  # type: typing.Dict[str, typing.Tuple[float, typing.Any]]
+        self._lock = threading.Lock()
+
+    def get(self, ticket: str) -> typing.Any:
+        """
+        Return the identity of the given ticket, or None if it is not known or expired.
+
+        Args:
+            ticket: The auth ticket.
+        Returns:
+            The cached identity, or None.
+        """
+        with self._lock:
+            expires, identity = self._identities.get(ticket, (0, None))
+            if expires < time.monotonic():
+                self._identities.pop(ticket, None)
+                return None
+            return identity
+
+    def set(self, ticket: str, identity: typing.Any):
+        """
+        Remember the identity of the given ticket.
+
+        Args:
+            ticket: The auth ticket.
+            identity: The identity of the user the ticket belongs to.
+        """
+        ttl = config.get('authtkt.identity_cache_ttl')
+        if ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._identities) >= self.max_size:
+                self._identities = {
+                    t: v for t, v in self._identities.items() if v[0] >= now}
+                if len(self._identities) >= self.max_size:
+                    self._identities.clear()
+            self._identities[ticket] = (now + ttl, identity)
+
+    def invalidate(self, username: str):
+        """
+        Forget the identities of the given user.
+
+        Args:
+            username: The name of the user.
+        """
+        with self._lock:
+            self._identities = {
+                t: v for t, v in self._identities.items() if v[1].name != username}
+
+    def clear(self):
+        """Forget all identities."""
+        with self._lock:
+            self._identities.clear()
+
+
+#: The identities of the auth tickets seen by this process.
+identity_cache = IdentityCache()
+
+
+def load_identity(request: 'pyramid.request.Request', username: str) -> typing.Any:
+    """
+    Load the lightweight identity of the given user from the database.
+
+    Args:
+        request: The current request.
+        username: The name of the user.
+    Returns:
+        munch.Munch: The name, email, openid and groups of the user, plus the names of the groups
+            in ``group_names``. None if the user doesn't exist.
+    """
+    from bodhi.server.models import Group, User
+    rows = request.db.query(User.email, Group.name).outerjoin(User.groups).filter(
+        User.name == username).all()
+    if not rows:
+        return None
+    group_names = sorted(group for email, group in rows if group is not None)
+    template = request.registry.settings.get('openid_template')
+    # Why munch?  https://github.com/fedora-infra/bodhi/issues/473
+    return munchify({
+        'name': username,
+        'email': rows[0][0],
+        'openid': template.format(username=username),
+        'groups': [{'name': group} for group in group_names],
+        'group_names': group_names,
+    })
+
+
 class BodhiSecurityPolicy:  # pragma: no cover
     """Define a custom Pyramid security policy."""
 
@@ -41,16 +152,19 @@ class BodhiSecurityPolicy:  # pragma: no cover
         self.acl = ACLHelper()
 
     def load_identity(self, request):
-        """Load authenticated user from database and returns a munch."""
-        from bodhi.server.models import User
+        """Return the identity of the authenticated user, from the cache if possible."""
         identity = self.helper.identify(request)
         if identity is None:
             return None
-        user = request.db.query(User).filter_by(name=str(identity['userid'])).first()
-        if user is None:
-            return None
-        # Why munch?  https://github.com/fedora-infra/bodhi/issues/473
-        return munchify(user.__json__(request=request))
+        username = str(identity['userid'])
+        ticket = request.cookies.get(self.helper.cookie_name)
+        user = identity_cache.get(ticket)
+        if user is not None and user.name == username:
+            return user
+        user = load_identity(request, username)
+        if user is not None:
+            identity_cache.set(ticket, user)
+        return user
 
     def identity(self, request):
         """Load identity from cache if already loaded."""
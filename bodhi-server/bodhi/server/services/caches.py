@@ -0,0 +1,74 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""Define the admin-only API endpoints of the cache regions."""
+
+from cornice import Service
+from cornice.validators import colander_body_validator
+from pyramid.exceptions import HTTPNotFound
+
+from bodhi.server import cache, log, security
+import bodhi.server.schemas
+import bodhi.server.services.errors
+
+
+caches = Service(name='caches', path='/admin/caches/',
+                 description='Cache regions',
+                 factory=security.AdminACLFactory,
+                 cors_origins=bodhi.server.security.cors_origins_rw)
+cache_region = Service(name='cache_region', path='/admin/caches/{name}',
+                       description='Cache region',
+                       factory=security.AdminACLFactory,
+                       cors_origins=bodhi.server.security.cors_origins_rw)
+
+
+@caches.get(permission='admin', renderer='json',
+            error_handler=bodhi.server.services.errors.json_handler)
+def query_caches(request):
+    """
+    Return the cache regions of the process serving the request, with their hits and misses.
+
+    Args:
+        request (pyramid.request): The current request.
+    Returns:
+        dict: A dictionary mapping the name of each region to its hits and misses.
+    """
+    return dict(caches=cache.stats())
+
+
+@cache_region.post(schema=bodhi.server.schemas.CSRFProtectedSchema(),
+                   permission='admin', renderer='json',
+                   error_handler=bodhi.server.services.errors.json_handler,
+                   validators=(colander_body_validator, ))
+def invalidate_cache(request):
+    """
+    Invalidate the values cached in a region, or in all of them if the name is ``all``.
+
+    Args:
+        request (pyramid.request): The current request.
+    Returns:
+        dict: A dictionary with the names of the invalidated regions.
+    """
+    name = request.matchdict.get('name')
+    try:
+        names = cache.invalidate(None if name == 'all' else name)
+    except KeyError:
+        request.errors.add('url', 'name', 'No such cache region')
+        request.errors.status = HTTPNotFound.code
+        return
+    log.info(f'{request.identity.name} invalidated the cache regions {", ".join(names)}')
+    return dict(invalidated=names)
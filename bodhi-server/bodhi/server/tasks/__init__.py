@@ -106,12 +106,21 @@ def check_policies_task(**kwargs):
 
 
 @app.task(name="check_signed_builds")
-def check_signed_builds_task(**kwargs):
-    """Trigger the check signed builds job. This is a periodic task."""
+def check_signed_builds_task(resume_after: int = 0, **kwargs):
+    """
+    Trigger the check signed builds job. This is a periodic task.
+
+    If the job runs out of time, another one is queued to carry on after the last update checked.
+
+    Args:
+        resume_after: Only check the updates with a greater id.
+    """
     from .check_signed_builds import main
     log.info("Received a check signed builds order")
     _do_init()
-    main()
+    resume_after = main(resume_after)
+    if resume_after is not None:
+        check_signed_builds_task.delay(resume_after=resume_after)
 
 
 @app.task(name="clean_old_composes")
@@ -146,6 +155,15 @@ def handle_side_and_related_tags_task(
     main(builds, pending_signing_tag, from_tag, pending_testing_tag, candidate_tag)
 
 
+@app.task(name="refresh_test_gating_status", ignore_result=True)
+def refresh_test_gating_status_task(alias: str):
+    """Refresh the test gating status of an update flagged by the ResultsDB or WaiverDB handler."""
+    from .refresh_test_gating_status import main
+    log.info("Received an order to refresh the test gating status of an update")
+    _do_init()
+    main(alias)
+
+
 @app.task(name="tag_update_builds", ignore_result=True)
 def tag_update_builds_task(tag: str, builds: typing.List[str]):
     """Handle tagging builds for an update in Koji."""
@@ -155,6 +173,15 @@ def tag_update_builds_task(tag: str, builds: typing.List[str]):
     main(tag, builds)
 
 
+@app.task(name="untag_branched")
+def untag_branched_task(dry_run: bool = False, **kwargs):
+    """Trigger the untag branched job. This is a periodic task."""
+    from .untag_branched import main
+    log.info("Received an untag branched order")
+    _do_init()
+    main(dry_run=dry_run)
+
+
 @app.task(name="bodhi.server.tasks.work_on_bugs", autoretry_for=(ExternalCallException,),
           retry_kwargs={'max_retries': 5}, retry_backoff=True)
 def work_on_bugs_task(update: str, bugs: typing.List[int]):
@@ -173,3 +200,13 @@ def fetch_test_cases_task(update: str):
     log.info("Received an order to fetch test cases")
     _do_init()
     main(update)
+
+
+@app.task(name="bodhi.server.tasks.fill_changelog", autoretry_for=(ExternalCallException,),
+          retry_kwargs={'max_retries': 5}, retry_backoff=True)
+def fill_changelog_task(update: str):
+    """Add the changelog and the bugs it closes to an automatically created update."""
+    from .fill_changelog import main
+    log.info("Received an order to fill the changelog of an automatic update")
+    _do_init()
+    main(update)
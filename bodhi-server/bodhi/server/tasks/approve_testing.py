@@ -17,41 +17,118 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """Comment on updates after they reach the mandatory amount of time in the testing repository."""
 
+from datetime import datetime, timedelta
 import logging
 
-from sqlalchemy import func
+from sqlalchemy import and_, false, func, or_, true
 
 from bodhi.messages.schemas import update as update_schemas
 from bodhi.server import Session, notifications, buildsys
 from bodhi.server.util import transactional_session_maker
-from ..models import Update, UpdateStatus, UpdateRequest
+from ..models import Comment, Release, TestGatingStatus, Update, UpdateStatus, UpdateRequest
 from ..config import config
 
 
 log = logging.getLogger(__name__)
 
 
+class KojiTagChanges:
+    """
+    The Koji tag changes of the updates approved in a chunk.
+
+    They are queued while the updates are processed and sent once the chunk is committed, as
+    chunked multicalls in three waves: builds are first tagged into their new tags, then untagged
+    from their old ones, and finally the merged side tags are deleted.
+    """
+
+    def __init__(self):
+        """Initialize the KojiTagChanges."""
+        self.tag = buildsys.MulticallExecutor()
+        self.untag = buildsys.MulticallExecutor()
+        self.delete = buildsys.MulticallExecutor()
+
+    def run(self):
+        """Send the queued changes to Koji, and log the ones that failed."""
+        for action, executor in (('tag', self.tag), ('untag', self.untag),
+                                 ('delete tag', self.delete)):
+            for result in executor.run():
+                if isinstance(result, dict):
+                    log.warning(f"Koji failed to {action}: {result.get('faultString')}")
+
+
+def candidates(db: Session):
+    """
+    Return a query of the updates in testing that may meet their testing requirements.
+
+    Most updates in testing have neither spent their mandatory days in testing nor received
+    positive karma, and are left out here so that their comments are never loaded. The query
+    returns a superset of the updates that meet their requirements: approve_update() still checks
+    each of them.
+
+    Args:
+        db: A database session.
+    Returns:
+        sqlalchemy.orm.query.Query: The query of the candidate updates.
+    """
+    now = datetime.utcnow()
+    may_have_karma = or_(Update.stable_karma <= 0, Update.comments.any(Comment.karma > 0))
+
+    release_filters = []
+    for release in db.query(Release):
+        days = min(release.mandatory_days_in_testing, release.critpath_mandatory_days_in_testing)
+        filters = [
+            Update.release_id == release.id,
+            or_(
+                true() if release.critpath_min_karma <= 0 else may_have_karma,
+                true() if not days else Update.date_testing <= now - timedelta(days=days),
+            ),
+        ]
+        if not release.mandatory_days_in_testing:
+            # Only autotime updates are handled in releases without testing requirements
+            filters.append(Update.autotime.is_(True))
+        release_filters.append(and_(*filters))
+
+    query = db.query(Update).filter_by(status=UpdateStatus.testing, request=None).filter(
+        or_(*release_filters) if release_filters else false())
+    if config.get('test_gating.required'):
+        query = query.filter(or_(
+            Update.test_gating_status.is_(None),
+            Update.test_gating_status.in_([TestGatingStatus.ignored, TestGatingStatus.passed])))
+    return query
+
+
 def main():
     """
     Comment on updates that are eligible to be pushed to stable.
 
-    Queries for updates in the testing state that have a NULL request, and run approve_update on
-    them.
+    Queries for updates in the testing state that have a NULL request and may meet their testing
+    requirements, and run approve_update on them. The updates are processed in chunks of
+    approve_testing.chunk_size: each chunk is committed, and then its Koji tag changes are sent.
     """
     db_factory = transactional_session_maker()
     try:
         with db_factory() as db:
-            testing = db.query(Update).filter_by(status=UpdateStatus.testing, request=None)
-            for update in testing:
-                approve_update(update, db)
+            ids = [id_ for id_, in candidates(db).with_entities(Update.id).order_by(Update.id)]
+            log.info(f'{len(ids)} updates in testing may meet their testing requirements')
+            chunk_size = config.get('approve_testing.chunk_size')
+            for start in range(0, len(ids), chunk_size):
+                tag_changes = KojiTagChanges()
+                chunk = db.query(Update).filter(
+                    Update.id.in_(ids[start:start + chunk_size]),
+                    Update.status == UpdateStatus.testing,
+                    Update.request.is_(None),
+                ).order_by(Update.id)
+                for update in chunk:
+                    approve_update(update, db, tag_changes)
                 db.commit()
+                tag_changes.run()
     except Exception:
         log.exception("There was an error approving testing updates.")
     finally:
         db_factory._end_session()
 
 
-def approve_update(update: Update, db: Session):
+def approve_update(update: Update, db: Session, tag_changes: KojiTagChanges):
     """Add a comment to an update if it is ready for stable.
 
     Check that the update is eligible to be pushed to stable but hasn't had comments from Bodhi to
@@ -59,6 +136,9 @@ def approve_update(update: Update, db: Session):
 
     Args:
         update: an update in testing that may be ready for stable.
+        db: A database session.
+        tag_changes: Collects the Koji tag changes, which the caller sends once the update is
+            committed.
     """
     if not update.release.mandatory_days_in_testing and not update.autotime:
         # If this release does not have any testing requirements and is not autotime,
@@ -121,15 +201,16 @@ def approve_update(update: Update, db: Session):
                 if update.from_tag is not None:
                     update.status = UpdateStatus.pending
                     update.remove_tag(
-                        update.release.get_pending_testing_side_tag(update.from_tag))
+                        update.release.get_pending_testing_side_tag(update.from_tag),
+                        koji=tag_changes.untag)
                 else:
                     update.status = UpdateStatus.obsolete
-                    update.remove_tag(update.release.pending_testing_tag)
-                    update.remove_tag(update.release.candidate_tag)
+                    update.remove_tag(update.release.pending_testing_tag, koji=tag_changes.untag)
+                    update.remove_tag(update.release.candidate_tag, koji=tag_changes.untag)
                 db.commit()
                 log.info(f"{update.alias} has conflicting builds - bailing")
                 return
-            update.add_tag(update.release.stable_tag)
+            update.add_tag(update.release.stable_tag, koji=tag_changes.tag)
             update.status = UpdateStatus.stable
             update.request = None
             update.pushed = True
@@ -144,24 +225,22 @@ def approve_update(update: Update, db: Session):
                 pending_signing_tag = update.release.get_pending_signing_side_tag(
                     update.from_tag)
                 testing_tag = update.release.get_pending_testing_side_tag(update.from_tag)
-                update.remove_tag(pending_signing_tag)
-                update.remove_tag(testing_tag)
-                update.remove_tag(update.from_tag)
+                update.remove_tag(pending_signing_tag, koji=tag_changes.untag)
+                update.remove_tag(testing_tag, koji=tag_changes.untag)
+                update.remove_tag(update.from_tag, koji=tag_changes.untag)
                 # Delete side-tag and its children after Update has enter stable
                 # We can't fully rely on Koji's auto-purge-when-empty because
                 # there may be older nvrs tagged in the side-tag
-                koji = buildsys.get_session()
-                koji.multicall = True
-                koji.deleteTag(pending_signing_tag)
-                koji.deleteTag(testing_tag)
-                koji.deleteTag(update.from_tag)
-                koji.multiCall()
+                tag_changes.delete.deleteTag(pending_signing_tag)
+                tag_changes.delete.deleteTag(testing_tag)
+                tag_changes.delete.deleteTag(update.from_tag)
             else:
                 # Single build update
-                update.remove_tag(update.release.pending_testing_tag)
-                update.remove_tag(update.release.pending_stable_tag)
-                update.remove_tag(update.release.pending_signing_tag)
-                update.remove_tag(update.release.testing_tag)
-                update.remove_tag(update.release.candidate_tag)
+                for tag in (update.release.pending_testing_tag,
+                            update.release.pending_stable_tag,
+                            update.release.pending_signing_tag,
+                            update.release.testing_tag,
+                            update.release.candidate_tag):
+                    update.remove_tag(tag, koji=tag_changes.untag)
 
     log.info(f'{update.alias} processed by approve_testing')
@@ -25,11 +25,20 @@ In these cases, the Update remain stuck in pending until a manual intervention.
 
 This script will cycle through builds of Updates in pending status and update
 the signed status in the db to match the tags found in Koji.
+
+The tags of the builds are listed with chunked multicalls, and the updates are checked in
+short transactions of check_signed_builds_chunk_size updates. If
+check_signed_builds_time_budget is set, the run stops when it is spent, and the task queues
+another run that picks up after the last update it checked.
 """
 
 import logging
+import time
+import typing
 from datetime import datetime, timedelta
 
+from sqlalchemy.orm import joinedload
+
 from bodhi.server import buildsys, models
 from bodhi.server.config import config
 from bodhi.server.util import transactional_session_maker
@@ -38,13 +47,28 @@ from bodhi.server.util import transactional_session_maker
 log = logging.getLogger(__name__)
 
 
-def main():
-    """Check build tags and sign those we missed."""
+def main(resume_after: int = 0) -> typing.Optional[int]:
+    """
+    Check build tags and sign those we missed.
+
+    Args:
+        resume_after: Only check the updates with a greater id, to carry on after a run that ran
+            out of time.
+    Returns:
+        The id of the last update checked if the run ran out of time, or None if it checked all
+        the updates.
+    """
     db_factory = transactional_session_maker()
     older_than = datetime.utcnow() - timedelta(days=config.get('check_signed_builds_delay'))
+    budget = config.get('check_signed_builds_time_budget')
+    deadline = time.monotonic() + budget if budget else None
+    chunk_size = max(config.get('check_signed_builds_chunk_size'), 1)
+
     with db_factory() as session:
-        updates = models.Update.query.filter(
+        candidates = session.query(models.Update.id, models.Update.date_submitted).filter(
             models.Update.status == models.UpdateStatus.pending
+        ).filter(
+            models.Update.id > resume_after
         ).filter(
             models.Update.release_id == models.Release.id
         ).filter(
@@ -53,20 +77,51 @@ def main():
                 models.ReleaseState.pending,
                 models.ReleaseState.frozen,
             ])
-        ).all()
+        ).order_by(models.Update.id).all()
+
+    if len(candidates) == 0:
+        log.debug('No stuck Updates found')
+        return None
 
-        if len(updates) == 0:
-            log.debug('No stuck Updates found')
-            return
+    # Let Bodhi have its times
+    update_ids = [id_ for id_, date_submitted in candidates if date_submitted < older_than]
+
+    for i in range(0, len(update_ids), chunk_size):
+        # Always check the first chunk, so that every run makes progress even if its budget was
+        # spent before it got here.
+        if i and deadline is not None and time.monotonic() >= deadline:
+            log.info(f'Ran out of time, {len(update_ids) - i} updates are left for the next run')
+            return update_ids[i - 1]
+        _check_updates(db_factory, update_ids[i:i + chunk_size])
+    return None
+
+
+def _check_updates(db_factory: transactional_session_maker, update_ids: typing.List[int]):
+    """
+    Check the builds of the given updates against a snapshot of their Koji tags.
+
+    Args:
+        db_factory: The factory of the database session to use.
+        update_ids: The ids of the updates to check.
+    """
+    # List the tags before opening the transaction that changes the updates, so that no
+    # transaction is held while we wait for Koji.
+    with db_factory() as session:
+        nvrs = [nvr for nvr, in session.query(models.Build.nvr).filter(
+            models.Build.update_id.in_(update_ids)).order_by(models.Build.nvr)]
+    build_tags = _list_tags(nvrs)
+
+    with db_factory() as session:
+        updates = session.query(models.Update).options(
+            joinedload(models.Update.builds), joinedload(models.Update.release)
+        ).filter(
+            models.Update.id.in_(update_ids), models.Update.status == models.UpdateStatus.pending
+        ).order_by(models.Update.id).all()
 
-        kc = buildsys.get_session()
         stuck_builds = []
         overlooked_builds = []
 
         for update in updates:
-            # Let Bodhi have its times
-            if update.date_submitted >= older_than:
-                continue
             builds = update.builds
             # Clean Updates with no builds
             if len(builds) == 0:
@@ -77,43 +132,84 @@ def main():
             pending_signing_tag = update.release.pending_signing_tag
             pending_testing_tag = update.release.pending_testing_tag
             for build in builds:
-                build_tags = [t['name'] for t in kc.listTags(build=build.nvr)]
+                if build.nvr not in build_tags:
+                    # Koji failed to tell us, the next run will try again
+                    continue
+                tags = build_tags[build.nvr]
                 if build.signed:
                     log.debug(f'{build.nvr} already marked as signed')
-                    if (update.release.testing_tag in build_tags
-                            and update.release.candidate_tag not in build_tags):
+                    if (update.release.testing_tag in tags
+                            and update.release.candidate_tag not in tags):
                         # The update was probably ejected from a compose and is stuck
                         log.debug(f'Resubmitting {update.alias} to testing')
                         update.set_request(session, models.UpdateRequest.testing, 'bodhi')
                         break
                     continue
-                if pending_signing_tag not in build_tags and pending_testing_tag in build_tags:
+                if pending_signing_tag not in tags and pending_testing_tag in tags:
                     # Our composer missed the message that the build got signed
                     log.debug(f'Changing signed status of {build.nvr}')
                     build.signed = True
-                elif pending_signing_tag in build_tags and pending_testing_tag not in build_tags:
+                elif pending_signing_tag in tags and pending_testing_tag not in tags:
                     # autosign missed the message that the build is waiting to be signed
                     log.debug(f'{build.nvr} is stuck waiting to be signed, let\'s try again')
                     stuck_builds.append((build.nvr, pending_signing_tag))
-                elif (pending_signing_tag not in build_tags
-                      and pending_testing_tag not in build_tags):
+                elif (pending_signing_tag not in tags
+                      and pending_testing_tag not in tags):
                     # this means that an update has been created but we never tagged the build
                     # as pending-signing
                     log.debug(f'Oh, no! We\'ve never sent {build.nvr} for signing, let\'s fix it')
                     overlooked_builds.append((build.nvr, pending_signing_tag))
             session.flush()
 
-        if stuck_builds:
-            kc.multicall = True
-            for b, t in stuck_builds:
-                kc.untagBuild(t, b, force=True)
-            kc.multiCall()
-            for b, t in stuck_builds:
-                kc.tagBuild(t, b, force=True)
-            kc.multiCall()
-
-        if overlooked_builds:
-            kc.multicall = True
-            for b, t in overlooked_builds:
-                kc.tagBuild(t, b, force=True)
-            kc.multiCall()
+    # The transaction is committed by now, so no lock is held while we wait for Koji.
+    if stuck_builds:
+        executor = buildsys.MulticallExecutor()
+        for b, t in stuck_builds:
+            executor.untagBuild(t, b, force=True)
+        _log_faults('untag', executor.run())
+        for b, t in stuck_builds:
+            executor.tagBuild(t, b, force=True)
+        _log_faults('tag', executor.run())
+
+    if overlooked_builds:
+        executor = buildsys.MulticallExecutor()
+        for b, t in overlooked_builds:
+            executor.tagBuild(t, b, force=True)
+        _log_faults('tag', executor.run())
+
+
+def _list_tags(nvrs: typing.List[str]) -> typing.Dict[str, typing.Set[str]]:
+    """
+    Return the names of the Koji tags of the given builds, using chunked multicalls.
+
+    Args:
+        nvrs: The NVRs of the builds.
+    Returns:
+        A dictionary mapping each NVR to the names of its tags. Builds whose tags could not be
+        listed are left out.
+    """
+    if not nvrs:
+        return {}
+    executor = buildsys.MulticallExecutor()
+    for nvr in nvrs:
+        executor.listTags(build=nvr)
+    build_tags = {}
+    for nvr, result in zip(nvrs, executor.run()):
+        if isinstance(result, dict):
+            log.warning(f'Unable to list the tags of {nvr}: {result.get("faultString")}')
+            continue
+        build_tags[nvr] = {t['name'] for t in result[0]}
+    return build_tags
+
+
+def _log_faults(action: str, results: typing.List[typing.Any]):
+    """
+    Log the Koji calls that failed.
+
+    Args:
+        action: What the calls were doing, e.g. ``tag``.
+        results: The results of the calls, in the format of Koji's ``multiCall()``.
+    """
+    for result in results:
+        if isinstance(result, dict):
+            log.warning(f'Koji failed to {action} a build: {result.get("faultString")}')
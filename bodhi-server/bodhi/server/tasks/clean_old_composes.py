@@ -15,25 +15,78 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
-"""Cleans up old composes that are left over in compose_dir."""
+"""
+Cleans up old composes that are left over in compose_dir.
 
+Old composes are first moved into a trash directory inside compose_dir, which is a cheap and
+atomic rename, and are then deleted by a background thread. A compose has a great many files, so
+the deletion is spread over a few threads and can be throttled to spare the storage.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import collections
 import os
-import shutil
+import threading
+import time
+import typing
 
 from bodhi.server import config
 
 
 log = logging.getLogger(__name__)
 
+TRASH_DIR = '.trash'
+
+# Only one thread empties the trash at a time
+_purge_lock = threading.Lock()
+
+
+class PurgeStats(typing.NamedTuple):
+    """How much space deleting some composes freed."""
+
+    composes: int = 0
+    bytes: int = 0
+    inodes: int = 0
+
+    def __add__(self, other: 'PurgeStats') -> 'PurgeStats':
+        """Return the sum of two PurgeStats."""
+        return PurgeStats(*(a + b for a, b in zip(self, other)))
+
 
-def main(num_to_keep: int):
+class Throttle(object):
+    """Limit how many times per second something happens, across threads."""
+
+    def __init__(self, rate: int):
+        """
+        Initialize the Throttle.
+
+        Args:
+            rate: The maximum number of calls to :meth:`wait` per second. ``0`` means no limit.
+        """
+        self.interval = 1.0 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Sleep until the next call is allowed."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(self._next, now) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def main(num_to_keep: int, wait: bool = False):
     """
     Delete any repo composes that are older than the newest 10 from each repo series.
 
     Args:
         num_to_keep: How many of the newest compose dirs to keep during cleanup
+        wait: If True, delete the old composes before returning instead of in the background.
     """
     compose_dir = config.config['compose_dir']
 
@@ -60,9 +113,112 @@ def main(num_to_keep: int):
         if len(dirs) > num_to_keep:
             dirs_to_delete.extend(sorted(dirs, reverse=True)[num_to_keep:])
 
+    trash_dir = os.path.join(compose_dir, TRASH_DIR)
     if dirs_to_delete:
+        os.makedirs(trash_dir, exist_ok=True)
         log.info('Deleting the following directories:')
         for d in dirs_to_delete:
-            d = os.path.join(compose_dir, d)
-            log.info(d)
-            shutil.rmtree(d)
+            log.info(os.path.join(compose_dir, d))
+            target = os.path.join(trash_dir, d)
+            if os.path.lexists(target):
+                # Left over by a purge that failed
+                target = f'{target}.{time.time()}'
+            os.rename(os.path.join(compose_dir, d), target)
+
+    if not os.path.isdir(trash_dir):
+        return
+    if wait:
+        purge(trash_dir)
+    else:
+        threading.Thread(target=purge, args=(trash_dir, ), name='compose-trash-purger',
+                         daemon=True).start()
+
+
+def purge(trash_dir: str) -> PurgeStats:
+    """
+    Delete everything in the given trash directory.
+
+    The composes in the trash are deleted concurrently by clean_old_composes_workers threads,
+    which delete at most clean_old_composes_unlink_rate files per second between them. If
+    another thread is already emptying the trash, return right away.
+
+    Args:
+        trash_dir: The trash directory to empty.
+    Returns:
+        How many composes were deleted, and how many bytes and inodes this freed.
+    """
+    stats = PurgeStats()
+    if not _purge_lock.acquire(blocking=False):
+        log.debug('The trash is already being emptied')
+        return stats
+    try:
+        throttle = Throttle(config.config['clean_old_composes_unlink_rate'])
+        workers = max(config.config['clean_old_composes_workers'], 1)
+        # Composes may be trashed while we are busy, so look again once we are done.
+        while True:
+            with os.scandir(trash_dir) as entries:
+                paths = [entry.path for entry in entries]
+            if not paths:
+                break
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(lambda p: _delete_tree(p, throttle), paths))
+            if not any(results):
+                # Nothing could be deleted, so don't spin.
+                break
+            for result in results:
+                if result:
+                    stats += result
+    finally:
+        _purge_lock.release()
+    if stats.composes:
+        log.info(f'Deleted {stats.composes} old composes, freeing {stats.bytes} bytes and '
+                 f'{stats.inodes} inodes')
+    return stats
+
+
+def _delete_tree(path: str, throttle: Throttle) -> typing.Optional[PurgeStats]:
+    """
+    Delete the given directory tree.
+
+    Files with other hardlinks left (e.g. RPMs still in a newer compose) don't free their space,
+    so only the last link of a file is counted in the returned stats.
+
+    Args:
+        path: The directory to delete.
+        throttle: The throttle each file deletion waits on.
+    Returns:
+        How much space deleting the tree freed, or None if it could not be deleted.
+    """
+    freed_bytes = freed_inodes = 0
+    # A stack of (directory, whether its content was already deleted)
+    stack = [(path, False)]
+    try:
+        if not os.path.isdir(path) or os.path.islink(path):
+            stack = []
+            st = os.lstat(path)
+            throttle.wait()
+            os.unlink(path)
+            if st.st_nlink == 1:
+                freed_bytes, freed_inodes = st.st_size, 1
+        while stack:
+            directory, emptied = stack.pop()
+            if emptied:
+                os.rmdir(directory)
+                freed_inodes += 1
+                continue
+            stack.append((directory, True))
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, False))
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                    throttle.wait()
+                    os.unlink(entry.path)
+                    if st.st_nlink == 1:
+                        freed_bytes += st.st_size
+                        freed_inodes += 1
+    except OSError:
+        log.exception(f'Unable to delete {path}')
+        return None
+    return PurgeStats(1, freed_bytes, freed_inodes)
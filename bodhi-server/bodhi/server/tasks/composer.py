@@ -27,8 +27,11 @@ from datetime import datetime
 from http.client import IncompleteRead
 from urllib.error import HTTPError, URLError
 from urllib.request import urlopen
+import contextlib
 import functools
 import hashlib
+import heapq
+import itertools
 import json
 import logging
 import os
@@ -44,7 +47,7 @@ import sqlalchemy.orm.exc
 
 from bodhi.messages.schemas import compose as compose_schemas
 from bodhi.messages.schemas import update as update_schemas
-from bodhi.server import buildsys, mail, notifications
+from bodhi.server import buildsys, mail, memo, notifications
 from bodhi.server.config import config, validate_path
 from bodhi.server.exceptions import BodhiException
 from bodhi.server.metadata import UpdateInfoMetadata
@@ -63,8 +66,9 @@ from bodhi.server.tasks.clean_old_composes import main as clean_old_composes
 from bodhi.server.util import (
     copy_container,
     get_createrepo_config,
+    ResultsDBClient,
     sanity_check_repodata,
-    sorted_updates,
+    tagging_waves,
     transactional_session_maker,
 )
 
@@ -101,6 +105,121 @@ def checkpoint(method):
     return wrapper
 
 
+class ComposeScheduler(object):
+    """
+    Hand out a limited number of compose slots, highest priority compose first.
+
+    This replaces a plain BoundedSemaphore: threads still acquire() and release() a slot, but
+    waiting composes are let through in priority order instead of whichever thread wakes up first.
+    Security composes go first, then stable before testing (as in :meth:`Compose.__lt__`), and
+    then the compose that is expected to finish soonest, based on the phase timings of previous
+    composes of the same content type and request.
+    """
+
+    # Phases in which a compose only waits on other systems, and does not hold a slot.
+    waiting_phases = frozenset([ComposeState.signing_repo.value, ComposeState.syncing_repo.value])
+
+    # Seconds of active work per update, keyed by (content_type, request). This is shared by
+    # every scheduler in the process, so that estimates survive from one compose task to the next.
+    _history = {}
+    _history_lock = threading.Lock()
+
+    def __init__(self, slots: int):
+        """
+        Initialize the ComposeScheduler.
+
+        Args:
+            slots: The number of composes that may run at the same time.
+        """
+        self.slots = slots
+        self._free = slots
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    def estimate(self, compose: dict) -> float:
+        """
+        Estimate how long the active phases of the given compose will take.
+
+        Args:
+            compose: A dictionary representation of the Compose, as passed to the ComposerThread.
+        Returns:
+            The estimated duration of the compose, in seconds.
+        """
+        with self._history_lock:
+            history = dict(self._history)
+        per_update = history.get((compose['content_type'], compose['request']))
+        if per_update is None:
+            # Without any history for this kind of compose, assume it behaves like the average
+            # compose, so the number of updates still gives a sensible order.
+            per_update = sum(history.values()) / len(history) if history else 1.0
+        return per_update * max(compose.get('update_count') or 1, 1)
+
+    def priority(self, compose: dict) -> tuple:
+        """
+        Return a sort key for the given compose, lower values going first.
+
+        Args:
+            compose: A dictionary representation of the Compose, as passed to the ComposerThread.
+        Returns:
+            A tuple that orders composes by security, request, and estimated duration.
+        """
+        return (not compose['security'], compose['request'] != UpdateRequest.stable.value,
+                self.estimate(compose))
+
+    def acquire(self, compose: dict):
+        """
+        Block until a slot is free and no compose with a higher priority is waiting for it.
+
+        Args:
+            compose: A dictionary representation of the Compose that wants a slot.
+        """
+        with self._condition:
+            ticket = (self.priority(compose), next(self._counter))
+            heapq.heappush(self._queue, ticket)
+            if self._free == 0 or self._queue[0] != ticket:
+                log.info('Waiting for a compose slot, %d composes queued', len(self._queue))
+            while self._free == 0 or self._queue[0] != ticket:
+                self._condition.wait()
+            heapq.heappop(self._queue)
+            self._free -= 1
+            # There may be more free slots for the next compose in line.
+            self._condition.notify_all()
+
+    def release(self, compose: dict):
+        """
+        Give a slot back, and wake up the composes waiting for one.
+
+        Args:
+            compose: A dictionary representation of the Compose that held the slot.
+        Raises:
+            ValueError: If more slots are released than were acquired.
+        """
+        with self._condition:
+            if self._free >= self.slots:
+                raise ValueError('Compose slot released too many times')
+            self._free += 1
+            self._condition.notify_all()
+
+    def record(self, compose: dict, phase_timings: dict):
+        """
+        Remember how long the active phases of a finished compose took.
+
+        Args:
+            compose: A dictionary representation of the finished Compose.
+            phase_timings: A mapping of ComposeState values to the seconds spent in that state.
+        """
+        active = sum(seconds for phase, seconds in phase_timings.items()
+                     if phase not in self.waiting_phases)
+        per_update = active / max(compose.get('update_count') or 1, 1)
+        key = (compose['content_type'], compose['request'])
+        with self._history_lock:
+            previous = self._history.get(key)
+            # Weigh recent composes more, so the estimate follows changes in the infrastructure.
+            self._history[key] = per_update if previous is None else (
+                0.7 * previous + 0.3 * per_update)
+
+
 class ComposerHandler(object):
     """
     The Bodhi Composer.
@@ -170,7 +289,7 @@ class ComposerHandler(object):
 
         self.compose_dir = compose_dir
 
-        self.max_composes_sem = threading.BoundedSemaphore(config.get('max_concurrent_composes'))
+        self.max_composes_sem = ComposeScheduler(config.get('max_concurrent_composes'))
 
         # This will ensure that the configured paths exist, and will raise ValueError if any does
         # not.
@@ -264,11 +383,16 @@ class ComposerHandler(object):
             # case of duplicate messages.
             composes = [c for c in composes if c.state == ComposeState.requested]
 
+            results = []
             for c in composes:
                 # Acknowledge that we've received the command to run these composes.
                 c.state = ComposeState.pending
+                compose = c.__json__(composer=True)
+                # The scheduler uses the size of the compose to estimate how long it will take.
+                compose['update_count'] = len(c.updates)
+                results.append(compose)
 
-            return [c.__json__(composer=True) for c in composes]
+            return results
 
 
 def get_composer(content_type):
@@ -299,8 +423,8 @@ class ComposerThread(threading.Thread):
         Initialize the ComposerThread.
 
         Args:
-            max_concur_sem (threading.BoundedSemaphore): Semaphore making sure only a limited
-                number of ComposerThreads run at the same time.
+            max_concur_sem (ComposeScheduler): Scheduler making sure only a limited number of
+                ComposerThreads run at the same time, in priority order.
             compose (dict): A dictionary representation of the Compose to run, formatted like the
                 output of :meth:`Compose.__json__`.
             agent (str): The user who is executing the compose.
@@ -321,16 +445,19 @@ class ComposerThread(threading.Thread):
         self.move_tags_async = []
         self.add_tags_sync = []
         self.move_tags_sync = []
+        self._build_tags = {}
+        self._phase = None
+        self.phase_timings = {}
         self.testing_digest = {}
         self.success = False
 
     def run(self):
         """Run the thread by managing a db transaction and calling work()."""
-        log.info('Grabbing semaphore')
-        self.max_concur_sem.acquire()
-        log.info('Acquired semaphore, starting')
+        log.info('Grabbing compose slot')
+        self.max_concur_sem.acquire(self._compose)
+        log.info('Acquired compose slot, starting')
         try:
-            with self.db_factory() as session:
+            with self.db_factory() as session, memo.scope():
                 self.db = session
                 self.compose = Compose.from_dict(session, self._compose)
                 self._checkpoints = json.loads(self.compose.checkpoints)
@@ -349,8 +476,21 @@ class ComposerThread(threading.Thread):
         finally:
             self.compose = None
             self.db = None
-            self.max_concur_sem.release()
-            log.info('Released semaphore')
+            self.max_concur_sem.release(self._compose)
+            log.info('Released compose slot')
+            if self.success:
+                self.max_concur_sem.record(self._compose, self.phase_timings)
+
+    @contextlib.contextmanager
+    def _slot_released(self):
+        """Let another compose use our slot while we only wait on other systems."""
+        self.max_concur_sem.release(self._compose)
+        log.info('Released compose slot while waiting')
+        try:
+            yield
+        finally:
+            self.max_concur_sem.acquire(self._compose)
+            log.info('Reacquired compose slot')
 
     def results(self):
         """
@@ -468,8 +608,10 @@ class ComposerThread(threading.Thread):
     def perform_gating(self):
         """Eject Updates that don't meet testing requirements from the compose."""
         log.debug('Performing gating.')
+        # Share one client, so results are cached for the duration of the compose.
+        resultsdb = ResultsDBClient(config)
         for update in self.compose.updates:
-            result, reason = update.check_requirements(self.db, config)
+            result, reason = update.check_requirements(self.db, config, resultsdb=resultsdb)
             if not result:
                 log.warning("%s failed gating: %s" % (update.alias, reason))
                 self.eject_from_compose(update, reason)
@@ -488,12 +630,14 @@ class ComposerThread(threading.Thread):
         log.warning(text)
         update.comment(self.db, text, author='bodhi')
         # Remove the pending tag as well
+        koji = buildsys.MulticallExecutor()
         if update.request is UpdateRequest.stable:
             update.remove_tag(update.release.pending_stable_tag,
-                              koji=buildsys.get_session())
+                              koji=koji, build_tags=self._build_tags)
         elif update.request is UpdateRequest.testing:
             update.remove_tag(update.release.pending_testing_tag,
-                              koji=buildsys.get_session())
+                              koji=koji, build_tags=self._build_tags)
+        koji.run()
         update.request = None
         notifications.publish(
             update_schemas.UpdateEjectV1.from_dict(
@@ -522,12 +666,26 @@ class ComposerThread(threading.Thread):
         """
         self.compose.checkpoints = json.dumps(self._checkpoints)
         if state is not None:
+            self._time_phase(state)
             self.compose.state = state
         self.db.commit()
         log.info('Compose object updated.')
         # Expire the compose object so sqlalchemy will reload it instead of use its cached copy
         self.db.expire(self.compose)
 
+    def _time_phase(self, state):
+        """
+        Add the time spent in the current phase to phase_timings, and start timing the next one.
+
+        Args:
+            state (bodhi.server.models.ComposeState): The state the compose is moving to.
+        """
+        now = time.monotonic()
+        if self._phase is not None:
+            phase, started = self._phase
+            self.phase_timings[phase] = self.phase_timings.get(phase, 0) + now - started
+        self._phase = (state.value, now)
+
     def load_state(self):
         """Load the state of this push so it can be resumed later if necessary."""
         self._checkpoints = json.loads(self.compose.checkpoints)
@@ -566,10 +724,48 @@ class ComposerThread(threading.Thread):
         self._determine_tag_actions()
         self._perform_tag_actions()
 
+    def _prefetch_build_tags(self):
+        """
+        Resolve the Koji tags of every build in the compose with chunked multicalls.
+
+        The tags are stored in self._build_tags, keyed by build NVR, so that planning the tag
+        actions does not need a listTags() round-trip per build. Builds for which Koji returned an
+        error are left out of the snapshot, and are looked up individually later.
+        """
+        nvrs = [build.nvr for update in self.compose.updates for build in update.builds]
+        log.info('Fetching the Koji tags of %d builds', len(nvrs))
+        koji = buildsys.MulticallExecutor()
+        for nvr in nvrs:
+            koji.listTags(nvr)
+        for nvr, result in zip(nvrs, koji.run()):
+            if isinstance(result, dict):
+                log.warning('Failed to list the tags of %s: %s', nvr, result.get('faultString'))
+                continue
+            self._build_tags[nvr] = [tag['name'] for tag in result[0]]
+
+    def _get_build_tags(self, build):
+        """
+        Return the Koji tags of the given build, preferring the prefetched snapshot.
+
+        Args:
+            build (bodhi.server.models.Build): The build whose tags are needed.
+        Returns:
+            list: A list of strings of the Koji tags on the build.
+        """
+        if build.nvr not in self._build_tags:
+            self._build_tags[build.nvr] = build.get_tags()
+        return self._build_tags[build.nvr]
+
     def _determine_tag_actions(self):
         tag_types, tag_rels = Release.get_tags()
-        # sync & async tagging batches
-        for i, batch in enumerate(sorted_updates(self.compose.updates)):
+        self._prefetch_build_tags()
+        # sync tagging batch, followed by the async tagging waves
+        sync, waves = tagging_waves(self.compose.updates)
+        for i, batch in enumerate([sync] + waves):
+            if i == 0:
+                batch_add_tags, batch_move_tags = self.add_tags_sync, self.move_tags_sync
+            else:
+                batch_add_tags, batch_move_tags = [], []
             for update in batch:
                 add_tags = []
                 move_tags = []
@@ -581,7 +777,7 @@ class ComposerThread(threading.Thread):
 
                 for build in update.builds:
                     from_tag = None
-                    tags = build.get_tags()
+                    tags = self._get_build_tags(build)
                     for tag in tags:
                         if tag in tag_types[status]:
                             from_tag = tag
@@ -598,22 +794,21 @@ class ComposerThread(threading.Thread):
                         move_tags.append((from_tag, update.requested_tag,
                                           build.nvr))
                 else:
-                    if i == 0:
-                        self.add_tags_sync.extend(add_tags)
-                        self.move_tags_sync.extend(move_tags)
-                    else:
-                        self.add_tags_async.extend(add_tags)
-                        self.move_tags_async.extend(move_tags)
+                    batch_add_tags.extend(add_tags)
+                    batch_move_tags.extend(move_tags)
+            if i != 0 and (batch_add_tags or batch_move_tags):
+                self.add_tags_async.append(batch_add_tags)
+                self.move_tags_async.append(batch_move_tags)
 
     def _perform_tag_actions(self):
-        koji = buildsys.get_session()
-        for i, batches in enumerate([(self.add_tags_sync, self.move_tags_sync),
-                                     (self.add_tags_async, self.move_tags_async)]):
+        # Each async wave is sent as a multicall, and waited for before the next one is sent.
+        for i, batches in enumerate([(self.add_tags_sync, self.move_tags_sync)]
+                                    + list(zip(self.add_tags_async, self.move_tags_async))):
             add, move = batches
             if i == 0:
-                koji.multicall = False
+                koji = buildsys.get_session()
             else:
-                koji.multicall = True
+                koji = buildsys.MulticallExecutor()
             for action in add:
                 tag, build = action
                 log.info("Adding tag %s to %s" % (tag, build))
@@ -624,9 +819,10 @@ class ComposerThread(threading.Thread):
                 koji.moveBuild(from_tag, to_tag, build, force=True)
 
             if i != 0:
-                results = koji.multiCall()
-                failed_tasks = buildsys.wait_for_tasks([task[0] for task in results],
-                                                       koji, sleep=15)
+                results = koji.run()
+                failed_tasks = [r['faultString'] for r in results if isinstance(r, dict)]
+                failed_tasks.extend(buildsys.wait_for_tasks(
+                    [r[0] for r in results if not isinstance(r, dict)], sleep=15))
                 if failed_tasks:
                     raise Exception("Failed to move builds: %s" % failed_tasks)
 
@@ -645,8 +841,7 @@ class ComposerThread(threading.Thread):
     def remove_pending_tags(self):
         """Remove all pending tags from the updates."""
         log.debug("Removing pending tags from builds")
-        koji = buildsys.get_session()
-        koji.multicall = True
+        koji = buildsys.MulticallExecutor()
         for update in self.compose.updates:
             if update.request is UpdateRequest.stable:
                 update.remove_tag(update.release.pending_stable_tag,
@@ -659,7 +854,7 @@ class ComposerThread(threading.Thread):
                                   koji=koji)
                 update.remove_tag(update.release.pending_testing_tag,
                                   koji=koji)
-        result = koji.multiCall()
+        result = koji.run()
         log.debug('remove_pending_tags koji.multiCall result = %r', result)
 
     def _mark_status_changes(self):
@@ -679,11 +874,10 @@ class ComposerThread(threading.Thread):
             update.pushed = True
 
         log.info('Deleting EOL side-tags.')
-        koji = buildsys.get_session()
-        koji.multicall = True
+        koji = buildsys.MulticallExecutor()
         for sidetag in eol_sidetags:
             koji.deleteTag(sidetag)
-        koji.multiCall()
+        koji.run()
 
     def _unlock_updates(self):
         """Unlock all the updates and clear their requests."""
@@ -1281,17 +1475,18 @@ class PungiComposerThread(ComposerThread):
                                                  'repomd.xml.asc'))
 
             log.info('Waiting for signatures in %s', ', '.join(sigpaths))
-            while True:
-                missing = []
-                for path in sigpaths:
-                    if not os.path.exists(path):
-                        missing.append(path)
-                if len(missing) == 0:
-                    log.info('All signatures were created')
-                    break
-                else:
-                    log.info('Waiting on %s', ', '.join(missing))
-                    time.sleep(300)
+            with self._slot_released():
+                while True:
+                    missing = []
+                    for path in sigpaths:
+                        if not os.path.exists(path):
+                            missing.append(path)
+                    if len(missing) == 0:
+                        log.info('All signatures were created')
+                        break
+                    else:
+                        log.info('Waiting on %s', ', '.join(missing))
+                        time.sleep(300)
         else:
             log.info('Not waiting for a repo signature')
 
@@ -1327,6 +1522,17 @@ class PungiComposerThread(ComposerThread):
 
         with open(repomd) as repomdf:
             checksum = hashlib.sha1(repomdf.read().encode('utf-8')).hexdigest()
+        with self._slot_released():
+            self._poll_master_repomd(master_repomd_url, checksum)
+
+    def _poll_master_repomd(self, master_repomd_url, checksum):
+        """
+        Block until the master mirror serves a repomd.xml with the given checksum.
+
+        Args:
+            master_repomd_url (str): The URL of the repomd.xml on the master mirror.
+            checksum (str): The sha1 checksum of our local repomd.xml.
+        """
         while True:
             try:
                 log.info('Polling %s' % master_repomd_url)
@@ -1475,6 +1681,29 @@ class ModuleComposerThread(PungiComposerThread):
         else:
             newest_builds[ns] = moduledef
 
+    def _get_koji_builds(self, builds):
+        """
+        Fetch the Koji builds for the given builds, with one chunked multicall.
+
+        Args:
+            builds (list): A list of bodhi.server.models.Build objects. Duplicates are only
+                fetched once.
+        Returns:
+            dict: A mapping of build NVRs to the Koji builds returned by koji.getBuild().
+        Raises:
+            Exception: If Koji returns an error or no data for any of the builds.
+        """
+        unique_builds = list({build.nvr: build for build in builds}.values())
+        koji = buildsys.MulticallExecutor()
+        for build in unique_builds:
+            koji.getBuild(build.nvr)
+
+        koji_builds = {}
+        for result, build in zip(koji.run(), unique_builds):
+            self._raise_on_get_build_multicall_error(result, build)
+            koji_builds[build.nvr] = result[0]
+        return koji_builds
+
     def _generate_module_list(self):
         """
         Generate a list of modules which should be used for pungi modular compose.
@@ -1485,33 +1714,21 @@ class ModuleComposerThread(PungiComposerThread):
         # For modules, both name and version can contain dashes. This makes it
         # impossible to distinguish between name and version from "nvr". We
         # therefore have to ask for Koji build here and get that information
-        # from there.
-        koji = buildsys.get_session()
-        koji.multicall = True
-        for build in self.compose.release.builds:
-            koji.getBuild(build.nvr)
-        results = koji.multiCall()
+        # from there. The builds of the release and of the updates are fetched together, so that
+        # the number of Koji requests only depends on the number of builds.
+        release_builds = list(self.compose.release.builds)
+        update_builds = [build for update in self.compose.updates for build in update.builds]
+        koji_builds = self._get_koji_builds(release_builds + update_builds)
 
         # we loop through builds so we get rid of older builds and get only
         # a dict with the newest builds
         newest_builds = {}
-        for result, build in zip(results, self.compose.release.builds):
-            self._raise_on_get_build_multicall_error(result, build)
-            koji_build = result[0]
-            self._add_build_to_newest_builds(newest_builds, koji_build)
+        for build in release_builds:
+            self._add_build_to_newest_builds(newest_builds, koji_builds[build.nvr])
 
         # make sure that the modules we want to update get their correct versions
-        for update in self.compose.updates:
-            # We need to get the Koji builds also for the updates.
-            koji.multicall = True
-            for update in self.compose.updates:
-                for build in update.builds:
-                    koji.getBuild(build.nvr)
-            results = koji.multiCall()
-            for result, build in zip(results, update.builds):
-                self._raise_on_get_build_multicall_error(result, build)
-                koji_build = result[0]
-                self._add_build_to_newest_builds(newest_builds, koji_build, True)
+        for build in update_builds:
+            self._add_build_to_newest_builds(newest_builds, koji_builds[build.nvr], True)
 
         # The keys are just used for easy name-stream finding. The name and stream are already in
         # the module definitions.
@@ -11,14 +11,26 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
-"""Look for overrides that are past their expiration dates and mark them expired."""
+"""
+Look for overrides that are past their expiration dates and mark them expired.
+
+Overrides are expired in chunks of expire_overrides_chunk_size, each in its own short transaction:
+the builds of a chunk are untagged from their override tags with a Koji multicall, the chunk is
+marked expired with a single UPDATE, and its messages are sent when the transaction commits. If
+a run fails, the chunks it already expired stay expired and the next run picks up the rest.
+"""
 
 from datetime import datetime
 import logging
+import typing
+
+from sqlalchemy.orm import joinedload
 
-from bodhi.server import Session
+from bodhi.messages.schemas import buildroot_override as override_schemas
+from bodhi.server import buildsys, notifications, Session
+from bodhi.server.config import config
 from bodhi.server.util import transactional_session_maker
-from ..models import BuildrootOverride
+from ..models import Build, BuildrootOverride
 
 
 log = logging.getLogger(__name__)
@@ -26,27 +38,69 @@ log = logging.getLogger(__name__)
 
 def main():
     """Wrap ``expire_overrides()``, catching exceptions."""
-    db_factory = transactional_session_maker()
     try:
-        with db_factory() as db:
-            expire_overrides(db)
+        expire_overrides(transactional_session_maker())
     except Exception:
         log.exception("There was an error expiring overrides")
 
 
-def expire_overrides(db: Session):
-    """Search for overrides that are past their expiration date and mark them expired."""
+def expire_overrides(db_factory: transactional_session_maker):
+    """
+    Search for overrides that are past their expiration date and mark them expired, by chunks.
+
+    Args:
+        db_factory: The factory of the database sessions to use, one per chunk.
+    """
     now = datetime.utcnow()
-    overrides = db.query(BuildrootOverride)
-    overrides = overrides.filter(BuildrootOverride.expired_date.is_(None))
-    overrides = overrides.filter(BuildrootOverride.expiration_date < now)
-    count = overrides.count()
-    if not count:
+    with db_factory() as db:
+        override_ids = [
+            id_ for id_, in db.query(BuildrootOverride.id).filter(
+                BuildrootOverride.expired_date.is_(None),
+                BuildrootOverride.expiration_date < now,
+            ).order_by(BuildrootOverride.id)]
+    if not override_ids:
         log.info("No active buildroot override to expire")
         return
-    log.info("Expiring %d buildroot overrides...", count)
+    log.info("Expiring %d buildroot overrides...", len(override_ids))
+
+    chunk_size = max(config.get('expire_overrides_chunk_size'), 1)
+    for i in range(0, len(override_ids), chunk_size):
+        with db_factory() as db:
+            _expire_chunk(db, override_ids[i:i + chunk_size])
+
+
+def _expire_chunk(db: Session, override_ids: typing.List[int]):
+    """
+    Expire the given overrides, unless they already were.
+
+    Args:
+        db: The database session to use. The chunk is expired when it commits.
+        override_ids: The ids of the overrides to expire.
+    """
+    # Another run may have expired some of them in the meantime
+    overrides = db.query(BuildrootOverride).options(
+        joinedload(BuildrootOverride.build).joinedload(Build.release)
+    ).filter(
+        BuildrootOverride.id.in_(override_ids), BuildrootOverride.expired_date.is_(None)
+    ).order_by(BuildrootOverride.id).all()
+    if not overrides:
+        return
+
+    executor = buildsys.MulticallExecutor()
     for override in overrides:
         log.debug(f"Expiring BRO for {override.build.nvr} because it's due to expire.")
-        override.expire()
-        db.add(override)
+        executor.untagBuild(override.build.release.override_tag, override.build.nvr,
+                            strict=True)
+    for override, result in zip(overrides, executor.run()):
+        if isinstance(result, dict):
+            log.error('Unable to untag override %s: %s' % (
+                override.build.nvr, result.get('faultString')))
+
+    db.query(BuildrootOverride).filter(
+        BuildrootOverride.id.in_([o.id for o in overrides])
+    ).update({BuildrootOverride.expired_date: datetime.utcnow()}, synchronize_session='fetch')
+
+    for override in overrides:
+        notifications.publish(override_schemas.BuildrootOverrideUntagV1.from_dict(
+            {'override': override}))
         log.info("Expired %s" % override.build.nvr)
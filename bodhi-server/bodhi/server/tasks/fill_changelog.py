@@ -0,0 +1,101 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""Add the changelog of its build, and the bugs it closes, to an automatically created update."""
+
+import logging
+import re
+
+from bodhi.server.config import config
+from bodhi.server.exceptions import BodhiException, ExternalCallException
+from bodhi.server.util import transactional_session_maker
+
+
+log = logging.getLogger(__name__)
+
+
+def main(alias: str):
+    """
+    Add the changelog of its build, and the bugs it closes, to an automatically created update.
+
+    The AutomaticUpdateHandler creates updates with minimal notes, so that reading the changelog
+    from Koji does not hold up the message consumer. The notes are left alone if they were edited
+    in the meantime.
+
+    Args:
+        alias: The alias of the update created by the AutomaticUpdateHandler.
+    Raises:
+        BodhiException: If the update doesn't exist.
+        ExternalCallException: If the changelog could not be read from Koji, so the task is
+            retried.
+    """
+    from bodhi.server.models import Bug, Update
+    from bodhi.server.tasks import work_on_bugs_task
+
+    db_factory = transactional_session_maker()
+    with db_factory() as session:
+        update = Update.get(alias)
+        if not update:
+            raise BodhiException(f"Couldn't find alias {alias} in DB")
+
+        build = update.builds[0]
+        try:
+            changelog = build.get_changelog(lastupdate=True)
+        except Exception as e:
+            # ValueError is often due to bot-generated builds
+            # https://pagure.io/koji/issue/3178
+            log.warning(f'Unable to get the changelog of {build.nvr}: {e}')
+            raise ExternalCallException
+
+        if not changelog:
+            log.debug(f"{build.nvr} has no new changelog entries.")
+            return
+
+        notes = f"Automatic update for {build.nvr}."
+        if update.notes != notes:
+            log.info(f"The notes of {alias} were edited, not adding the changelog.")
+            return
+
+        log.debug("Adding changelog to update notes.")
+        notes = f"""{notes}
+
+##### **Changelog**
+
+```
+{{}}
+```"""
+        if len(changelog) > config.get('update_notes_maxlength') - len(notes):
+            changelog = '[CHANGELOG OMITTED BECAUSE TOO LONG]'
+        update.notes = notes.format(changelog)
+
+        if update.release.name not in config.get('bz_exclude_rels'):
+            for b in re.finditer(config.get('bz_regex'), changelog, re.IGNORECASE):
+                idx = int(b.group(1))
+                bug = Bug.get(idx)
+                if bug is None:
+                    bug = Bug(bug_id=idx)
+                    session.add(bug)
+                    session.flush()
+                if bug not in update.bugs:
+                    log.debug(f'Adding bug #{idx} to the update.')
+                    update.bugs.append(bug)
+
+        buglist = [b.bug_id for b in update.bugs]
+
+    # This must be run after the session is closed so changes are committed to db
+    if buglist:
+        work_on_bugs_task.delay(alias, buglist)
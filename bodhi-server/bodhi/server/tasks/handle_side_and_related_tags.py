@@ -21,6 +21,7 @@ import logging
 import typing
 
 from bodhi.server import buildsys
+from .tag_update_builds import report_failures
 
 
 log = logging.getLogger(__name__)
@@ -60,12 +61,8 @@ def main(builds: typing.List[str],
             # We can remove the side tag.
             tags.append(candidate_tag)
 
-        koji.multicall = True
-        for b in builds:
-            for t in tags:
-                log.info(f"Tagging build {b} in {t}")
-                koji.tagBuild(t, b)
-        koji.multiCall()
+        log.info(f"Tagging {len(builds)} builds in {', '.join(str(t) for t in tags)}")
+        report_failures(buildsys.tag_builds([(t, b) for b in builds for t in tags]))
 
     except Exception:
         log.exception("There was an error handling side-tags updates")
@@ -0,0 +1,54 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""Refresh the test gating status of an update flagged by the ResultsDB or WaiverDB handler."""
+
+import logging
+
+from bodhi.server.util import transactional_session_maker
+
+
+log = logging.getLogger(__name__)
+
+
+def main(alias: str):
+    """
+    Ask Greenwave for a new decision about the given update, if it is still flagged.
+
+    The flag is cleared and committed before Greenwave is queried, so that results arriving
+    during the query flag the update again and get a refresh of their own.
+
+    Args:
+        alias: The alias of the update to refresh.
+    """
+    from bodhi.server.models import Update
+
+    db_factory = transactional_session_maker()
+    with db_factory():
+        update = Update.get(alias)
+        if not update:
+            log.warning(f"Couldn't find update {alias} in DB")
+            return
+        if update.test_gating_dirty_since is None:
+            log.debug(f"The test_gating_status of {alias} was already refreshed")
+            return
+        update.test_gating_dirty_since = None
+
+    with db_factory():
+        update = Update.get(alias)
+        log.info(f"Updating the test_gating_status for: {alias}")
+        update.update_test_gating_status()
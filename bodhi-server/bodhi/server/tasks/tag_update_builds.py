@@ -17,10 +17,13 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """Handle tagging builds for an update in Koji."""
 
+from collections import OrderedDict
 import logging
 import typing
 
 from bodhi.server import buildsys
+from bodhi.server.models import Build
+from bodhi.server.util import transactional_session_maker
 
 
 log = logging.getLogger(__name__)
@@ -34,11 +37,35 @@ def main(tag: str, builds: typing.List[str]):
         builds: list of new build added to the update.
     """
     try:
-        kc = buildsys.get_session()
-        kc.multicall = True
-        for build in builds:
-            kc.tagBuild(tag, build)
-            log.info(f"Tagging build {build} in {tag}")
-        kc.multiCall()
+        log.info(f"Tagging {len(builds)} builds in {tag}")
+        report_failures(buildsys.tag_builds([(tag, build) for build in builds]))
     except Exception:
         log.exception("There was an error handling tagging builds in koji.")
+
+
+def report_failures(failures: typing.List[typing.Tuple[str, str, str]]):
+    """
+    Comment on the updates of the builds that could not be tagged.
+
+    Args:
+        failures: The (tag, nvr, error) of the builds that could not be tagged, as returned by
+            :func:`bodhi.server.buildsys.tag_builds`.
+    """
+    if not failures:
+        return
+    for tag, nvr, error in failures:
+        log.error(f"Unable to tag {nvr} in {tag}: {error}")
+
+    db_factory = transactional_session_maker()
+    with db_factory() as db:
+        builds = db.query(Build).filter(Build.nvr.in_({nvr for tag, nvr, error in failures}))
+        updates = {b.nvr: b.update for b in builds if b.update is not None}
+        lines = OrderedDict()  # type: OrderedDict
+        for tag, nvr, error in failures:
+            if nvr in updates:
+                lines.setdefault(updates[nvr], []).append(f"- {nvr} in {tag}: {error}")
+        for update, update_lines in lines.items():
+            update.comment(
+                db, "Bodhi was unable to tag these builds in Koji, please retry or ask "
+                "Release Engineering for help:\n\n" + "\n".join(update_lines),
+                author='bodhi')
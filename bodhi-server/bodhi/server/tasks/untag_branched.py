@@ -0,0 +1,154 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Remove the pending and testing tags from the stable builds of branched releases.
+
+Since a separate task composes the branched stable repos, this leaves those stable updates with
+the testing tags for 1 day before untagging.
+
+The candidate builds are read with a single query, their tags are listed with chunked Koji
+multicalls, and the stale tags are removed with chunked multicalls as well.
+
+https://github.com/fedora-infra/bodhi/issues/576
+"""
+
+from datetime import datetime, timedelta
+import logging
+import typing
+
+from bodhi.server import buildsys, models
+from bodhi.server.util import transactional_session_maker
+
+
+log = logging.getLogger(__name__)
+
+
+class Candidate(typing.NamedTuple):
+    """A stable build of a branched release, with the tags of its release."""
+
+    nvr: str
+    release: str
+    stable_tag: str
+    stale_tags: typing.Tuple[str, ...]
+
+
+def main(dry_run: bool = False) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Remove the pending and testing tags from the stable builds of branched releases.
+
+    Args:
+        dry_run: If True, only log the tags that would be removed.
+    Returns:
+        The (tag, nvr) pairs that were removed, or would be removed in a dry run.
+    """
+    candidates = find_candidates(transactional_session_maker())
+    if not candidates:
+        log.info('No stable builds of branched releases to check')
+        return []
+
+    build_tags = list_tags([c.nvr for c in candidates])
+
+    untags = []
+    for candidate in candidates:
+        if candidate.nvr not in build_tags:
+            # Koji failed to tell us, the next run will try again
+            continue
+        tags = build_tags[candidate.nvr]
+        if candidate.stable_tag not in tags:
+            log.error('%s not tagged as stable %s' % (candidate.nvr, tags))
+            continue
+        for tag in candidate.stale_tags:
+            if tag in tags:
+                log.info('%s %s from %s' % (
+                    'Would remove' if dry_run else 'Removing', tag, candidate.nvr))
+                untags.append((tag, candidate.nvr))
+
+    if untags and not dry_run:
+        executor = buildsys.MulticallExecutor()
+        for tag, nvr in untags:
+            executor.untagBuild(tag, nvr)
+        for (tag, nvr), result in zip(untags, executor.run(progress=_progress('Untagged'))):
+            if isinstance(result, dict):
+                log.warning(f'Unable to remove {tag} from {nvr}: {result.get("faultString")}')
+    log.info('%s %d tags from %d builds' % ('Would remove' if dry_run else 'Removed',
+                                            len(untags), len(candidates)))
+    return untags
+
+
+def find_candidates(db_factory: transactional_session_maker) -> typing.List[Candidate]:
+    """
+    Return the builds of the updates of pending releases that went stable more than a day ago.
+
+    Args:
+        db_factory: The factory of the database session to use.
+    Returns:
+        The candidate builds, sorted by release and NVR.
+    """
+    one_day_ago = datetime.utcnow() - timedelta(days=1)
+    with db_factory() as db:
+        rows = db.query(
+            models.Build.nvr, models.Release.name, models.Release.dist_tag,
+            models.Release.testing_tag, models.Release.pending_signing_tag,
+            models.Release.pending_testing_tag,
+        ).join(
+            models.Update, models.Build.update_id == models.Update.id
+        ).join(
+            models.Release, models.Update.release_id == models.Release.id
+        ).filter(
+            models.Release.state == models.ReleaseState.pending,
+            models.Update.status == models.UpdateStatus.stable,
+            models.Update.date_stable < one_day_ago,
+        ).order_by(models.Release.name, models.Build.nvr).all()
+    return [Candidate(nvr, release, stable_tag, (testing, pending_signing, pending_testing))
+            for nvr, release, stable_tag, testing, pending_signing, pending_testing in rows]
+
+
+def list_tags(nvrs: typing.List[str]) -> typing.Dict[str, typing.List[str]]:
+    """
+    Return the names of the Koji tags of the given builds, using chunked multicalls.
+
+    Args:
+        nvrs: The NVRs of the builds.
+    Returns:
+        A dictionary mapping each NVR to the names of its tags. Builds whose tags could not be
+        listed are left out.
+    """
+    executor = buildsys.MulticallExecutor()
+    for nvr in nvrs:
+        executor.listTags(nvr)
+    build_tags = {}
+    for nvr, result in zip(nvrs, executor.run(progress=_progress('Listed the tags of'))):
+        if isinstance(result, dict):
+            log.warning(f'Unable to list the tags of {nvr}: {result.get("faultString")}')
+            continue
+        build_tags[nvr] = [t['name'] for t in result[0]]
+    return build_tags
+
+
+def _progress(action: str) -> typing.Callable[[int, int], None]:
+    """
+    Return a progress callback for :meth:`bodhi.server.buildsys.MulticallExecutor.run`.
+
+    Args:
+        action: What the calls do, e.g. ``Untagged``.
+    Returns:
+        A callable logging how many builds were done so far.
+    """
+    def progress(done: int, total: int):
+        log.info(f'{action} {done}/{total} builds')
+    return progress
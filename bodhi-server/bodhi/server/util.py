@@ -17,7 +17,8 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """Random functions that don't fit elsewhere."""
 
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 from importlib import import_module
@@ -36,6 +37,7 @@ import re
 import socket
 import subprocess
 import tempfile
+import threading
 import time
 import types
 import typing
@@ -56,15 +58,13 @@ import requests
 import rpm
 import zstandard
 
-from bodhi.server import ffmarkdown, log, buildsys, Session
+from bodhi.server import ffmarkdown, http_client, log, buildsys, Session
 from bodhi.server.config import config
 from bodhi.server.exceptions import RepodataException
 
 
 _ = TranslationStringFactory('bodhi')
 
-http_session = requests.Session()
-
 
 def header(x):
     """Display a given message as a heading."""
@@ -194,6 +194,160 @@ class memoized(object):
         return functools.partial(self.__call__, obj)
 
 
+class CritpathIndex(object):
+    """
+    The critical path components of a collection, indexed for fast lookups.
+
+    The index is built once from the JSON file of the collection, and keeps for each component
+    type the components of each group, the set of all the components, and where each component
+    appears, so that looking up a handful of components does not scan the whole critical path.
+    """
+
+    def __init__(self, data: typing.Mapping[str, typing.Mapping[str, typing.Iterable[str]]]):
+        """
+        Initialize the CritpathIndex.
+
+        Args:
+            data: The critical path of the collection, as returned by :func:`read_critpath_json`.
+        """
+        self.groups = {}  # type: typing.Dict[str, typing.Dict[str, typing.Tuple[str, ...]]]
+        self.components = {}  # type: typing.Dict[str, typing.FrozenSet[str]]
+        self.component_groups = {}  # type: typing.Dict[str, typing.Dict[str, typing.Tuple]]
+        self._flat = {}  # type: typing.Dict[str, typing.Tuple[str, ...]]
+        self._positions = {}  # type: typing.Dict[str, typing.Dict[str, typing.List[int]]]
+        for component_type, groups in data.items():
+            groups = {group: tuple(comps) for group, comps in groups.items()}
+            component_groups = defaultdict(list)
+            positions = defaultdict(list)
+            flat = []
+            for group, comps in groups.items():
+                for comp in comps:
+                    if group not in component_groups[comp]:
+                        component_groups[comp].append(group)
+                    positions[comp].append(len(flat))
+                    flat.append(comp)
+            self.groups[component_type] = groups
+            self.components[component_type] = frozenset(flat)
+            self.component_groups[component_type] = {
+                comp: tuple(comp_groups) for comp, comp_groups in component_groups.items()}
+            self._flat[component_type] = tuple(flat)
+            self._positions[component_type] = dict(positions)
+
+    def grouped(self, component_type: str,
+                components: typing.Optional[typing.Iterable[str]] = None) -> dict:
+        """
+        Return the components of the given type by group, in the order of the JSON file.
+
+        Args:
+            component_type: The component type to search for.
+            components: If given, only these components are returned.
+        Returns:
+            A dictionary mapping the name of each group to the list of its components. Groups
+            without any of the requested components are left out.
+        """
+        groups = self.groups.get(component_type, {})
+        if not components:
+            return {group: list(comps) for group, comps in groups.items()}
+        component_groups = self.component_groups.get(component_type, {})
+        matched = defaultdict(set)
+        for comp in components:
+            for group in component_groups.get(comp, ()):
+                matched[group].add(comp)
+        return {group: [comp for comp in comps if comp in matched[group]]
+                for group, comps in groups.items() if group in matched}
+
+    def list(self, component_type: str,
+             components: typing.Optional[typing.Iterable[str]] = None) -> list:
+        """
+        Return the components of the given type, group after group.
+
+        Args:
+            component_type: The component type to search for.
+            components: If given, only these components are returned.
+        Returns:
+            The critpath components, listed once for each group they are part of.
+        """
+        flat = self._flat.get(component_type, ())
+        if components is None:
+            return list(flat)
+        positions = self._positions.get(component_type, {})
+        return [flat[i] for i in sorted(i for comp in set(components)
+                                        for i in positions.get(comp, ()))]
+
+    def contains(self, component_type: str, components: typing.Iterable[str]) -> bool:
+        """
+        Return whether any of the given components is in the critical path.
+
+        Args:
+            component_type: The component type to search for.
+            components: The components to look up.
+        Returns:
+            ``True`` if at least one of the components is in the critical path.
+        """
+        return not self.components.get(component_type, frozenset()).isdisjoint(components)
+
+
+_critpath_indexes = {}  # type: typing.Dict[str, typing.Tuple[typing.Any, CritpathIndex]]
+_critpath_indexes_lock = threading.Lock()
+
+
+def get_critpath_index(collection: str) -> CritpathIndex:
+    """
+    Return the critpath index of the given collection, reading its JSON file if it changed.
+
+    Each process keeps the index of each collection in memory, and only reads the JSON file again
+    when its modification time or size changed since it was last read.
+
+    Args:
+        collection: The collection/branch to search.
+    Returns:
+        The critpath index of the collection.
+    Raises:
+        FileNotFoundError: If there is no file for the requested collection.
+        json.JSONDecodeError: If the file is not valid JSON.
+    """
+    jsonfile = os.path.join(config.get('critpath.jsonpath'), f'{collection}.json')
+    try:
+        stat = os.stat(jsonfile)
+        version = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        # Leave it to read_critpath_json() to complain, and don't keep anything in memory.
+        version = None
+    with _critpath_indexes_lock:
+        cached = _critpath_indexes.get(jsonfile)
+    if version is not None and cached is not None and cached[0] == version:
+        return cached[1]
+    index = CritpathIndex(read_critpath_json(collection))
+    if version is not None:
+        with _critpath_indexes_lock:
+            _critpath_indexes[jsonfile] = (version, index)
+    return index
+
+
+def reset_critpath_indexes():
+    """Forget the critpath indexes, so that they get read again from the JSON files."""
+    with _critpath_indexes_lock:
+        _critpath_indexes.clear()
+
+
+def _critpath_index_or_none(collection: str) -> typing.Optional[CritpathIndex]:
+    """
+    Return the critpath index of the given collection, or None if its JSON file can't be read.
+
+    Args:
+        collection: The collection/branch to search.
+    Returns:
+        The critpath index of the collection, or None.
+    """
+    try:
+        return get_critpath_index(collection)
+    except FileNotFoundError:
+        log.warning(f'No JSON file found for collection {collection}')
+    except json.JSONDecodeError:
+        log.warning(f'JSON file for collection {collection} is invalid')
+    return None
+
+
 def get_grouped_critpath_components(collection='master', component_type='rpm', components=None):
     """
     Return a dictionary of critical path components by group for a given collection.
@@ -213,21 +367,10 @@ def get_grouped_critpath_components(collection='master', component_type='rpm', c
         if not critpath_type:
             critpath_type = "(default)"
         raise ValueError(f'critpath.type {critpath_type} does not support groups')
-    critpath_components = {}
-    try:
-        critpath_components = read_critpath_json(collection).get(component_type, {})
-    except FileNotFoundError:
-        log.warning(f'No JSON file found for collection {collection}')
-    except json.JSONDecodeError:
-        log.warning(f'JSON file for collection {collection} is invalid')
-    if components and critpath_components:
-        filtered_dict = defaultdict(list)
-        for (group, groupcomps) in critpath_components.items():
-            filteredcomps = [gcomp for gcomp in groupcomps if gcomp in components]
-            if filteredcomps:
-                filtered_dict[group].extend(filteredcomps)
-        critpath_components = dict(filtered_dict)
-    return critpath_components
+    index = _critpath_index_or_none(collection)
+    if index is None:
+        return {}
+    return index.grouped(component_type, components)
 
 
 def get_critpath_components(collection='master', component_type='rpm', components=None):
@@ -251,25 +394,38 @@ def get_critpath_components(collection='master', component_type='rpm', component
                     ' non-RPM components'.format(critpath_type or "(default)"))
 
     if critpath_type == 'json':
-        try:
-            critpath_components_grouped = read_critpath_json(collection).get(component_type, {})
-            for compgroup in critpath_components_grouped.values():
-                critpath_components.extend(compgroup)
-        except FileNotFoundError:
-            log.warning(f'No JSON file found for collection {collection}')
-        except json.JSONDecodeError:
-            log.warning(f'JSON file for collection {collection} is invalid')
+        index = _critpath_index_or_none(collection)
+        if index is not None:
+            critpath_components = index.list(component_type, components)
     else:
         critpath_components = config.get('critpath_pkgs')
-
-    # Filter the list of components down to what was requested, in case the specific path did
-    # not take our request into account.
-    if components is not None:
-        critpath_components = [c for c in critpath_components if c in components]
+        # Filter the list of components down to what was requested, in case the specific path
+        # did not take our request into account.
+        if components is not None:
+            critpath_components = [c for c in critpath_components if c in components]
 
     return critpath_components
 
 
+def contains_critpath_component(collection='master', component_type='rpm', components=()):
+    """
+    Return whether any of the given components is in the critical path of a collection.
+
+    Args:
+        collection (str): The collection/branch to search. Defaults to 'master'. Only
+            has any effect when critpath_type is json.
+        component_type (str): The component type to search for. Defaults to 'rpm'. Only
+            has any effect when critpath_type is json.
+        components (frozenset): The components to look up.
+    Returns:
+        bool: ``True`` if at least one of the components is in the critical path.
+    """
+    if config.get('critpath.type') == 'json':
+        index = _critpath_index_or_none(collection)
+        return index is not None and index.contains(component_type, components)
+    return bool(get_critpath_components(collection, component_type, frozenset(components)))
+
+
 def sanity_check_repodata(myurl, repo_type):
     """
     Sanity check the repodata for a given repository.
@@ -784,7 +940,8 @@ def sorted_updates(updates):
             with a multicall.
     """
     builds = defaultdict(set)
-    sync, async_ = [], []
+    # dicts are used as insertion ordered sets, to keep membership tests cheap.
+    sync, async_ = {}, {}
     for update in updates:
         for build in update.builds:
             builds[build.nvr_name].add(build)
@@ -793,14 +950,13 @@ def sorted_updates(updates):
     for package in sorted(builds.keys()):
         if len(builds[package]) > 1:
             for build in sorted_builds(builds[package])[::-1]:
-                if build.update not in sync:
-                    sync.append(build.update)
-                if build.update in async_:
-                    async_.remove(build.update)
+                sync.setdefault(build.update)
+                async_.pop(build.update, None)
         else:
-            build = list(builds[package])[0]
-            if build.update not in async_ and build.update not in sync:
-                async_.append(build.update)
+            build = next(iter(builds[package]))
+            if build.update not in sync:
+                async_.setdefault(build.update)
+    sync, async_ = list(sync), list(async_)
     log.info('sync = %s', [up.alias for up in sync])
     log.info('async_ = %s', [up.alias for up in async_])
     if not (len(set(sync) & set(async_)) == 0 and len(set(sync) | set(async_)) == len(updates)):
@@ -812,6 +968,77 @@ def sorted_updates(updates):
     return sync, async_
 
 
+def tagging_waves(updates):
+    """
+    Group the given Updates into ordered waves, so the highest version is tagged last.
+
+    Updates that contain builds of the same package need to be tagged in version order, so that the
+    highest version appears as the 'latest' in koji. Each Update is ranked by the longest chain of
+    Updates holding lower versions of its packages, and each rank forms a wave: the Updates in a
+    wave can be tagged together with a multicall once the previous wave is done.
+
+    Updates that cannot be ordered (e.g. two Updates that each hold the newer build of one of their
+    shared packages) are left out of the waves together with the Updates they share packages with.
+    Those are returned in the order given by :func:`sorted_updates`, to be tagged one at a time.
+
+    Args:
+        updates (iterable): An iterable of bodhi.server.models.Update objects to be sorted.
+    Returns:
+        tuple: A 2-tuple. The first element is a list of Updates that should be tagged
+            synchronously in a specific order. The second element is a list of waves, which are
+            lists of Updates that can be tagged asynchronously in koji with a multicall.
+    """
+    updates = list(updates)
+    builds = defaultdict(set)
+    for update in updates:
+        for build in update.builds:
+            builds[build.nvr_name].add(build)
+
+    # Every Update must be tagged after the Updates holding the lower versions of its packages.
+    successors = {update: set() for update in updates}
+    # Updates that share packages are grouped with a union-find.
+    groups = {update: update for update in updates}
+
+    def find_group(update):
+        while groups[update] is not update:
+            groups[update] = groups[groups[update]]
+            update = groups[update]
+        return update
+
+    for package in sorted(builds.keys()):
+        ordered = sorted_builds(builds[package])[::-1]
+        for older, newer in zip(ordered, ordered[1:]):
+            if older.update is not newer.update:
+                successors[older.update].add(newer.update)
+                groups[find_group(older.update)] = find_group(newer.update)
+
+    # Rank the Updates in topological order. Updates caught in an ordering cycle never get ready.
+    predecessors = Counter(u for following in successors.values() for u in following)
+    ready = [update for update in updates if not predecessors[update]]
+    ranks = dict.fromkeys(ready, 0)
+    while ready:
+        update = ready.pop()
+        for successor in successors[update]:
+            ranks[successor] = max(ranks.get(successor, 0), ranks[update] + 1)
+            predecessors[successor] -= 1
+            if not predecessors[successor]:
+                ready.append(successor)
+
+    conflicting = {find_group(update) for update in updates if update not in ranks}
+    sync = []
+    if conflicting:
+        sync = sorted_updates([u for u in updates if find_group(u) in conflicting])[0]
+    waves = []
+    for update in updates:
+        if find_group(update) in conflicting:
+            continue
+        while len(waves) <= ranks[update]:
+            waves.append([])
+        waves[ranks[update]].append(update)
+    log.info('waves = %s', [[up.alias for up in wave] for wave in waves])
+    return sync, waves
+
+
 def cmd(cmd, cwd=None, raise_on_error=False):
     """
     Run the given command in a subprocess.
@@ -865,7 +1092,8 @@ def tokenize(string):
             yield token
 
 
-def taskotron_results(settings, entity='results/latest', max_queries=10, **kwargs):
+def taskotron_results(settings, entity='results/latest', max_queries=10, session=None,
+                      raise_errors=False, **kwargs):
     """
     Yield resultsdb results using query arguments.
 
@@ -876,12 +1104,18 @@ def taskotron_results(settings, entity='results/latest', max_queries=10, **kwarg
             just a single page. ``None`` or ``0`` means no limit. Please note some tests might have
             thousands of results in the database and it's very reasonable to limit queries (thus the
             default value).
+        session (requests.Session or None): The HTTP session to perform the queries with. If None
+            (the default), the session of the resultsdb service client is used.
+        raise_errors (bool): If True, re-raise the Exception that stopped the query after logging
+            it, instead of just stopping.
         kwargs (dict): Args that will be passed to resultsdb to specify what results to retrieve.
     Returns:
         generator or None: Yields Python objects loaded from ResultsDB's "data" field in its JSON
-            response, or None if there was an Exception while performing the query.
+            response, or None if there was an Exception while performing the query and
+            raise_errors is False.
     """
     max_queries = max_queries or 0
+    client = http_client.get_client('resultsdb')
     url = settings['resultsdb_api_url'] + "/api/v2.0/" + entity
     if kwargs:
         url = url + "?" + urlencode(kwargs)
@@ -891,7 +1125,7 @@ def taskotron_results(settings, entity='results/latest', max_queries=10, **kwarg
     try:
         while data and url:
             log.debug("Grabbing %r" % url)
-            response = requests.get(url, timeout=60)
+            response = (session or client.session).get(url, timeout=client.timeout)
             if response.status_code != 200:
                 raise IOError("status code was %r" % response.status_code)
             json = response.json()
@@ -905,6 +1139,135 @@ def taskotron_results(settings, entity='results/latest', max_queries=10, **kwarg
                 break
     except Exception as e:
         log.exception("Problem talking to %r : %r" % (url, str(e)))
+        if raise_errors:
+            raise
+
+
+class ResultsDBClient(object):
+    """
+    Query ResultsDB for the latest results of many items at once.
+
+    Queries are sent concurrently, and queries of the same type, since and testcases are batched
+    into a single query with a list of items. requests.Session is not thread safe, so each worker
+    thread gets its own session, all of them mounted on the pooled adapter of the resultsdb service
+    client. Results are cached per (type, item, since, testcases) for the lifetime of the client,
+    so a client should not outlive the operation it is created for (e.g. gating the updates of a
+    compose). Failed queries are not cached, so they are retried on the next lookup.
+    """
+
+    # The maximum number of items in a single query.
+    batch_size = 20
+
+    def __init__(self, settings, workers=None):
+        """
+        Initialize the ResultsDBClient.
+
+        Args:
+            settings (bodhi.server.config.BodhiConfig): Bodhi's settings.
+            workers (int or None): The maximum number of concurrent queries. Defaults to the
+                resultsdb_workers setting.
+        """
+        self.settings = settings
+        self.workers = max(workers or settings.get('resultsdb_workers', 4), 1)
+        self._sessions = threading.local()
+        self._cache = {}
+
+    @property
+    def session(self):
+        """
+        Return the session of the current thread, creating it if needed.
+
+        Returns:
+            requests.Session: A session routed through the resultsdb service client's adapter.
+        """
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = http_client.get_client('resultsdb').mount(requests.Session())
+            self._sessions.session = session
+        return session
+
+    def latest_results(self, queries):
+        """
+        Return the latest results for each of the given queries.
+
+        Args:
+            queries (list): A list of (type, item, since, testcases) tuples, where testcases is a
+                comma separated string of testcase names.
+        Returns:
+            list: A list of results per query, in the same order as queries.
+        Raises:
+            Exception: The first error met while querying ResultsDB, once the results of the
+                successful queries have been cached.
+        """
+        batches = defaultdict(list)
+        for query in dict.fromkeys(queries):
+            if query not in self._cache:
+                type_, item, since, testcases = query
+                batches[(type_, since, testcases)].append(item)
+
+        requests_ = []
+        for (type_, since, testcases), items in batches.items():
+            for i in range(0, len(items), self.batch_size):
+                requests_.append((type_, items[i:i + self.batch_size], since, testcases))
+
+        if len(requests_) > 1 and self.workers > 1:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(requests_))) as pool:
+                responses = list(pool.map(self._try_query, requests_))
+        else:
+            responses = [self._try_query(request) for request in requests_]
+
+        errors = []
+        for (type_, items, since, testcases), (results, error) in zip(requests_, responses):
+            if error is not None:
+                errors.append(error)
+                continue
+            for item in items:
+                self._cache[(type_, item, since, testcases)] = results[item]
+        if errors:
+            raise errors[0]
+
+        return [self._cache[query] for query in queries]
+
+    def _try_query(self, request):
+        """
+        Query ResultsDB for the latest results of a batch of items, catching any error.
+
+        Args:
+            request (tuple): A (type, items, since, testcases) tuple.
+        Returns:
+            tuple: A (results, error) tuple, where results is the return value of :meth:`_query`
+                or None, and error is the Exception it raised or None.
+        """
+        try:
+            return self._query(request), None
+        except Exception as e:
+            return None, e
+
+    def _query(self, request):
+        """
+        Query ResultsDB for the latest results of a batch of items.
+
+        Args:
+            request (tuple): A (type, items, since, testcases) tuple.
+        Returns:
+            dict: A mapping of each item to the list of its results.
+        """
+        type_, items, since, testcases = request
+        query = dict(type=type_, item=','.join(items), since=since, testcases=testcases)
+        if len(items) == 1:
+            return {items[0]: list(taskotron_results(self.settings, session=self.session,
+                                                     raise_errors=True, **query))}
+
+        # Without this, ResultsDB would only return the latest result of each testcase across
+        # all the items.
+        query['_distinct_on'] = 'item'
+        results = {item: [] for item in items}
+        for result in taskotron_results(self.settings, session=self.session, raise_errors=True,
+                                        **query):
+            for item in result['data'].get('item', []):
+                if item in results:
+                    results[item].append(result)
+        return results
 
 
 class TransactionalSessionMaker(object):
@@ -1016,17 +1379,20 @@ def call_api(api_url, service_name, error_key=None, method='GET', data=None, hea
     """
     Perform an HTTP request with response type and error handling.
 
+    The request is sent with the pooled session of the service's
+    :class:`bodhi.server.http_client.ServiceClient`, which also provides its timeout and backoff.
+
     Args:
         api_url (str): The URL to query.
         service_name (str): The service name being queried (used to form human friendly error
-            messages).
+            messages, and to pick the service's client).
         error_key (str): The key that indexes error messages in the JSON body for the given
             service. If this is set to None, the JSON response will be used as the error message.
         method (str): The HTTP method to use for the request. Defaults to ``GET``.
         data (dict): Query string parameters that will be sent along with the request to the server.
         headers (dict): The headers to send along with the request.
-        retries (int): The number of times to retry, each after a 1 second sleep, if we get a
-            non-200 HTTP code. Defaults to 3.
+        retries (int): The number of times to retry, each after a jittered exponential backoff,
+            if we get a non-200 HTTP code. Defaults to 0.
     Returns:
         dict: A dictionary representing the JSON response from the remote service.
     Raises:
@@ -1034,29 +1400,34 @@ def call_api(api_url, service_name, error_key=None, method='GET', data=None, hea
     """
     if data is None:
         data = dict()
-    log.debug("Querying url: %s", api_url)
+    client = http_client.get_client(service_name)
     if method == 'POST':
         if headers is None:
             headers = {'Content-Type': 'application/json'}
         base_error_msg = (
             'Bodhi failed to send POST request to {0} at the following URL '
             '"{1}". The status code was "{2}".')
-        rv = http_session.post(api_url,
-                               headers=headers,
-                               data=json.dumps(data),
-                               timeout=60)
     else:
         base_error_msg = (
             'Bodhi failed to get a resource from {0} at the following URL '
             '"{1}". The status code was "{2}".')
-        rv = http_session.get(api_url, timeout=60)
-
-    if rv.status_code >= 200 and rv.status_code < 300:
-        return rv.json()
-    elif retries:
-        time.sleep(1)
-        return call_api(api_url, service_name, error_key, method, data, headers, retries - 1)
-    elif rv.status_code == 500:
+
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(client.backoff(attempt - 1))
+        log.debug("Querying url: %s", api_url)
+        if method == 'POST':
+            rv = client.session.post(api_url,
+                                     headers=headers,
+                                     data=json.dumps(data),
+                                     timeout=client.timeout)
+        else:
+            rv = client.session.get(api_url, timeout=client.timeout)
+
+        if rv.status_code >= 200 and rv.status_code < 300:
+            return rv.json()
+
+    if rv.status_code == 500:
         log.debug(rv.text)
         # There will be no JSON with an error message here
         error_msg = base_error_msg.format(
@@ -17,9 +17,14 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """A collection of validators for Bodhi requests."""
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 from functools import wraps
+import time
+import typing
 
+from dogpile.cache.api import NO_VALUE
+from prometheus_client import Histogram
 from pyramid.exceptions import HTTPNotFound, HTTPBadRequest
 from pyramid.httpexceptions import HTTPFound, HTTPNotImplemented
 from sqlalchemy.sql import or_, and_
@@ -30,7 +35,7 @@ import rpm
 
 from bodhi.server.config import config
 from bodhi.server.exceptions import BodhiException
-from . import buildsys, log
+from . import buildsys, cache, log
 from .models import (
     Build,
     Bug,
@@ -64,6 +69,12 @@ the page open for a long time. Please reload the page and try to submit your
 data again. Make sure to save your input somewhere before reloading.
 """.replace('\n', ' ')
 
+pagure_acl_request = Histogram(
+    'pagure_acl_request',
+    'Time spent asking Pagure about the committers of packages',
+    labelnames=['call'],
+)
+
 
 def postschema_validator(f):
     """
@@ -436,6 +447,109 @@ def validate_qa_acls(request, **kwargs):
     return validate_acls(request, **kwargs)
 
 
+def _cached_pagure_calls(
+        calls: typing.Dict[str, typing.Tuple[str, typing.Callable]]
+) -> typing.Dict[str, typing.Any]:
+    """
+    Return the results of the given Pagure calls, from the ``pagure_acls`` cache region if possible.
+
+    The calls that are not cached are made concurrently, and each of them is timed in the
+    ``pagure_acl_request`` histogram. Results are cached for pagure_acl_cache_ttl seconds, except
+    False which is cached for pagure_acl_cache_negative_ttl seconds. Exceptions are not cached.
+
+    Args:
+        calls: A dictionary mapping cache keys to the name of the call, used as the label of the
+            metric, and the callable making the call.
+    Returns:
+        A dictionary mapping the cache keys to the result of the call, or to the exception it
+        raised.
+    """
+    ttl = config['pagure_acl_cache_ttl']
+    negative_ttl = config['pagure_acl_cache_negative_ttl']
+    max_ttl = max(ttl, negative_ttl)
+    region = cache.get_region('pagure_acls')
+
+    results = {}
+    misses = {}
+    for key, call in calls.items():
+        cached = region.get(key, expiration_time=max_ttl) if max_ttl > 0 else NO_VALUE
+        if cached is not NO_VALUE:
+            value, stored_at = cached
+            if time.time() - stored_at < (ttl if value is not False else negative_ttl):
+                results[key] = value
+                continue
+        misses[key] = call
+
+    def timed(name, fn):
+        start = time.monotonic()
+        try:
+            return fn()
+        finally:
+            pagure_acl_request.labels(call=name).observe(time.monotonic() - start)
+
+    if len(misses) > 1:
+        with ThreadPoolExecutor(max_workers=config['pagure_acl_workers']) as pool:
+            futures = {key: pool.submit(timed, *call) for key, call in misses.items()}
+        outcomes = {}
+        for key, future in futures.items():
+            try:
+                outcomes[key] = future.result()
+            except Exception as e:
+                outcomes[key] = e
+    else:
+        outcomes = {}
+        for key, call in misses.items():
+            try:
+                outcomes[key] = timed(*call)
+            except Exception as e:
+                outcomes[key] = e
+
+    for key, value in outcomes.items():
+        results[key] = value
+        if max_ttl > 0 and not isinstance(value, Exception):
+            region.set(key, (value, time.time()))
+    return results
+
+
+def _pagure_acls(
+        username: str, packages: typing.List[typing.Tuple[Package, str]]
+) -> typing.Tuple[typing.Dict[tuple, typing.Any], typing.Dict[str, typing.Any]]:
+    """
+    Ask Pagure whether the user can commit to the given packages, and who commits to them.
+
+    Args:
+        username: The name of the user.
+        packages: The packages, with the branch the user wants to commit to.
+    Returns:
+        Two dictionaries. The first maps each package name and branch to whether the user has
+        commit access, or to the exception raised while asking Pagure. The second maps the name
+        of each package the user has commit access to to its committers, or to the exception
+        raised while asking Pagure.
+    """
+    namespaces = config.get('pagure_namespaces')
+    # Read everything the cache keys need now, so that the threads don't touch the session.
+    repos = {package.name: f'{namespaces[package.type.name]}/{package.external_name}'
+             for package, branch in packages}
+
+    def access_key(package, branch):
+        return f'pagure_acl:{repos[package.name]}:{branch}:{username}'
+
+    access = _cached_pagure_calls({
+        access_key(package, branch): (
+            'hascommit', lambda p=package, b=branch: p.hascommitaccess(username, b))
+        for package, branch in packages})
+    decisions = {(package.name, branch): access[access_key(package, branch)]
+                 for package, branch in packages}
+
+    granted = {package.name: package for package, branch in packages
+               if decisions[(package.name, branch)]
+               and not isinstance(decisions[(package.name, branch)], Exception)}
+    committers = _cached_pagure_calls({
+        f'pagure_committers:{repos[name]}': ('committers', package.get_pkg_committers_from_pagure)
+        for name, package in granted.items()})
+    return decisions, {name: committers[f'pagure_committers:{repos[name]}'] for name in granted}
+
+
 @postschema_validator
 def validate_acls(request, **kwargs):
     """
@@ -466,8 +580,11 @@ def validate_acls(request, **kwargs):
         # If you're not logged in, obviously you don't have ACLs.
         request.errors.add('cookies', 'user', 'No ACLs for anonymous user')
         return
-    user = User.get(request.identity.name)
-    user_groups = [group.name for group in user.groups]
+    username = request.identity.name
+    # The identity loaded by BodhiSecurityPolicy already knows the groups of the user
+    user_groups = getattr(request.identity, 'group_names', None)
+    if user_groups is None:
+        user_groups = [group.name for group in User.get(username).groups]
     acl_system = config.get('acl_system')
 
     builds = None
@@ -492,7 +609,7 @@ def validate_acls(request, **kwargs):
     admin_groups = config['admin_packager_groups']
     for group in admin_groups:
         if group in user_groups:
-            log.debug(f'{user.name} is in {group} admin group')
+            log.debug(f'{username} is in {group} admin group')
             return
 
     # Make sure the user is in the mandatory packager groups. This is a
@@ -501,7 +618,7 @@ def validate_acls(request, **kwargs):
     mandatory_groups = config['mandatory_packager_groups']
     for mandatory_group in mandatory_groups:
         if mandatory_group not in user_groups:
-            error = (f'{user.name} is not a member of "{mandatory_group}", which is a '
+            error = (f'{username} is not a member of "{mandatory_group}", which is a '
                      f'mandatory packager group')
             request.errors.add('body', 'builds', error)
             return
@@ -519,27 +636,28 @@ def validate_acls(request, **kwargs):
             request.errors.add('body', 'builds', error)
             return
 
-        if sidetag_owner != user.name:
+        if sidetag_owner != username:
             request.errors.add('body',
                                'builds',
-                               f'{user.name} does not own {sidetag} side-tag')
+                               f'{username} does not own {sidetag} side-tag')
             request.errors.status = 403
         return
     elif 'update' in request.validated and sidetag:
         # This is a simplified check to avoid quering Koji for the side-tag owner
         # The user whom created the update is surely the one owning the side-tag
         update = request.validated['update']
-        if user == update.user:
-            log.debug(f'{user.name} owns {update.alias} side-tag update')
+        if update.user.name == username:
+            log.debug(f'{username} owns {update.alias} side-tag update')
         else:
             request.errors.add('body',
                                'builds',
-                               f'{user.name} does not own {sidetag} side-tag')
+                               f'{username} does not own {sidetag} side-tag')
             request.errors.status = 403
         return
 
     # For normal updates, check against every build
     log.debug('Using builds validation method')
+    checks = []
     for build in builds:
         # The whole point of the blocks inside this conditional is to determine
         # the "release" and "package" associated with the given build.  For raw
@@ -576,42 +694,51 @@ def validate_acls(request, **kwargs):
             package = build.package
             release = build.update.release
 
-        # Now that we know the release and the package associated with this
-        # build, we can ask our ACL system about it.
+        checks.append((package, release, buildinfo))
+
+    # Now that we know the release and the package associated with each
+    # build, we can ask our ACL system about them. Pagure is asked about all
+    # the builds at once.
+    if acl_system == 'pagure':
+        decisions, pagure_committers = _pagure_acls(
+            username, list({(p.name, r.branch): (p, r.branch) for p, r, b in checks}.values()))
+
+    for package, release, buildinfo in checks:
         has_access = False
         if acl_system == 'pagure':
             # Verify user's commit access
-            try:
-                has_access = package.hascommitaccess(user.name, release.branch)
-            except RuntimeError as error:
+            has_access = decisions[(package.name, release.branch)]
+            if isinstance(has_access, RuntimeError):
                 # If it's a RuntimeError, then the error will be logged
                 # and we can return the error to the user as is
-                log.error(error)
-                request.errors.add('body', 'builds', str(error))
+                log.error(has_access)
+                request.errors.add('body', 'builds', str(has_access))
                 return
-            except Exception as error:
+            elif isinstance(has_access, Exception):
                 # This is an unexpected error, so let's log it and give back
                 # a generic error to the user
-                log.exception(error)
+                log.error(has_access, exc_info=has_access)
                 error_msg = ('Unable to access Pagure to check ACLs. '
                              'Please try again later.')
                 request.errors.add('body', 'builds', error_msg)
                 return
-            people = [user.name]
+            people = [username]
             if has_access:
                 # Retrieve people to be informed of the update
-                try:
-                    people = package.get_pkg_committers_from_pagure()[0]
-                except Exception:
+                people = pagure_committers[package.name]
+                if isinstance(people, Exception):
                     # This will simply mean no email will be posted to affected users
                     # Just log it.
                     log.warning(f'Unable to retrieve committers list from Pagure '
                                 f'for {package.name}.')
+                    people = [username]
+                else:
+                    people = people[0]
         elif acl_system == 'dummy':
             committers = ['ralph', 'bowlofeggs', 'guest']
             if config['acl_dummy_committer']:
                 committers.append(config['acl_dummy_committer'])
-            if user.name in committers:
+            if username in committers:
                 has_access = True
             people = committers
         else:
@@ -622,7 +749,7 @@ def validate_acls(request, **kwargs):
 
         if not has_access:
             request.errors.add('body', 'builds',
-                               f'{user.name} does not have commit access to {package.name}')
+                               f'{username} does not have commit access to {package.name}')
             request.errors.status = 403
 
 
@@ -638,6 +638,6 @@ def get_critpath_components(request):
     component_type = request.params.get('component_type', 'rpm')
     components = request.params.get('components')
     if components is not None:
-        components = components.split(',')
+        components = frozenset(components.split(','))
     return bodhi.server.util.get_grouped_critpath_components(collection, component_type,
                                                              components)
@@ -28,6 +28,7 @@ __init__ until we make a major Bodhi release. See https://github.com/fedora-infr
 from pyramid.events import NewRequest, subscriber
 
 from bodhi import server
+from bodhi.server import memo
 
 
 def _complete_database_session(request):
@@ -82,3 +83,20 @@ def _rollback_or_commit(request):
         server.Session().rollback()
     else:
         server.Session().commit()
+
+
+def memoize_tween_factory(handler, registry):
+    """
+    Create a tween that memoizes the properties of the models during each request.
+
+    See :mod:`bodhi.server.memo`. The number of lookups of each memoized property is logged at the
+    debug level at the end of the request.
+    """
+    def tween(request):
+        with memo.scope() as current:
+            try:
+                return handler(request)
+            finally:
+                server.log.debug('Memoized property lookups for %s %s: %r', request.method,
+                                 request.path, dict(current.lookups))
+    return tween
@@ -56,6 +56,10 @@ beat_schedule = {
         "task": "expire_overrides",
         "schedule": 60 * 60,  # every hour
     },
+    "untag-branched": {
+        "task": "untag_branched",
+        "schedule": crontab(hour=4, minute=13),
+    },
 }
 # The celery process must have write access to this file:
 beat_schedule_filename = "/tmp/celerybeat-schedule"
@@ -1,12 +1,15 @@
 from unittest import mock
 
 from authlib.oauth2.rfc6750 import InvalidTokenError
+import munch
 from pyramid import testing
 from pyramid.httpexceptions import HTTPAccepted, HTTPUnauthorized
 import pytest
+from sqlalchemy import event
 
-from bodhi.server import models
-from bodhi.server.auth.utils import get_and_store_user, get_final_redirect, remember_me
+from bodhi.server import models, security
+from bodhi.server.auth.utils import (
+    create_or_update_user, get_and_store_user, get_final_redirect, remember_me)
 
 from .. import base
 from .utils import fake_send
@@ -145,3 +148,70 @@ class TestGetAndStoreUser(base.BasePyTestCase):
             with pytest.raises(InvalidTokenError) as exc:
                 get_and_store_user(request, "TOKEN", HTTPAccepted())
         assert str(exc.value) == "invalid_token: No userinfo for token"
+
+
+class TestCreateOrUpdateUser(base.BasePyTestCase):
+    """Test the create_or_update_user() function."""
+
+    def test_invalidates_identity(self):
+        """The cached identities of the user should be forgotten after the commit."""
+        security.identity_cache.set('ticket', munch.munchify({'name': 'guest'}))
+        security.identity_cache.set('other', munch.munchify({'name': 'ralph'}))
+
+        user = create_or_update_user(self.db, 'guest', 'guest@example.com', ['packager'])
+
+        assert [g.name for g in user.groups] == ['packager']
+        # Nothing is forgotten until the new groups are committed.
+        assert security.identity_cache.get('ticket').name == 'guest'
+
+        self.db.commit()
+
+        assert security.identity_cache.get('ticket') is None
+        assert security.identity_cache.get('other').name == 'ralph'
+
+    def test_sync_groups(self):
+        """Groups should be added, created and removed to match the given ones."""
+        self.db.add(models.Group(name='existing'))
+        self.db.flush()
+
+        with mock.patch('bodhi.server.auth.utils.log.info') as info:
+            user = create_or_update_user(
+                self.db, 'guest', 'guest@example.com', ['new', 'existing', ' ', 'new'])
+
+        assert sorted(g.name for g in user.groups) == ['existing', 'new']
+        assert models.Group.get('new') is not None
+        assert info.mock_calls == [
+            mock.call('Adding %s to %s group', 'guest', 'existing'),
+            mock.call('Adding %s to %s group', 'guest', 'new'),
+            mock.call('Removing %s from %s group', 'guest', 'packager'),
+        ]
+
+    def test_new_user(self):
+        """A new user should be created with its groups."""
+        user = create_or_update_user(self.db, 'newbie', 'newbie@example.com', ['packager'])
+
+        assert user.email == 'newbie@example.com'
+        assert [g.name for g in user.groups] == ['packager']
+
+    def test_query_count(self):
+        """The number of queries should not depend on the number of groups."""
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        create_or_update_user(self.db, 'guest', 'guest@example.com', ['packager'])
+        self.db.flush()
+        engine = self.db.get_bind()
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            create_or_update_user(
+                self.db, 'guest', 'guest@example.com',
+                ['packager'] + [f'group{i}' for i in range(50)])
+            self.db.flush()
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+
+        # The user, its current groups, and the existing and new groups it was added to
+        assert len([s for s in statements if s.lstrip().startswith('SELECT')]) == 4
+        assert len(statements) < 10
@@ -24,6 +24,8 @@ import tempfile
 
 import pytest
 
+from bodhi.server import cache, http_client, security, util
+
 
 # Set BODHI_CONFIG to our testing ini file.
 @pytest.fixture(autouse=True)
@@ -33,6 +35,34 @@ def mock_settings_env_vars():
         yield
 
 
+@pytest.fixture(autouse=True)
+def reset_http_clients():
+    """Give each test fresh service clients, so circuit breakers do not carry over."""
+    yield
+    http_client.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_cache_regions():
+    """Give each test fresh cache regions, configured from its settings."""
+    yield
+    cache.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_identity_cache():
+    """Do not let identities cached by a test leak into the next ones."""
+    yield
+    security.identity_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_critpath_indexes():
+    """Do not let critpath indexes read by a test leak into the next ones."""
+    yield
+    util.reset_critpath_indexes()
+
+
 @pytest.fixture(scope="session")
 def critpath_json_config(request):
     """
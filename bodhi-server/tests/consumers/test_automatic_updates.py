@@ -41,7 +41,7 @@ from bodhi.server.models import (
 from .. import base
 
 
-@mock.patch('bodhi.server.consumers.automatic_updates.work_on_bugs_task', mock.Mock())
+@mock.patch('bodhi.server.consumers.automatic_updates.fill_changelog_task', mock.Mock())
 class TestAutomaticUpdateHandler(base.BasePyTestCase):
     """Test the automatic update handler."""
 
@@ -116,129 +116,19 @@ class TestAutomaticUpdateHandler(base.BasePyTestCase):
 
         assert not any(r.levelno >= logging.WARNING for r in caplog.records)
 
-    @pytest.mark.parametrize('changelog', (True, None, ""))
     @mock.patch('bodhi.server.models.RpmBuild.get_changelog')
-    def test_changelog(self, mock_generate_changelog, changelog):
-        """Assert that update notes contain the changelog if it exists."""
-        if changelog:
-            # fill the changelog here rather than in the decorator
-            changelog = ('* Sat Aug  3 2013 Fedora Releng <rel-eng@lists.fedoraproject.org> - 2\n'
-                         '- Added a free money feature.\n* Tue Jun 11 2013 Randy <bowlofeggs@fpo>'
-                         ' - 2.0.1-2\n- Make users ☺\n')
-
-        mock_generate_changelog.return_value = changelog
-
-        # process the message
-        self.handler(self.sample_message)
-
-        # check if the update exists...
-        update = self.db.query(Update).join(Build).filter(
-            Update.builds.any(Build.nvr == self.sample_nvr)
-        ).first()
-
-        if changelog:
-            assert update.notes == f"""Automatic update for colord-1.3.4-1.fc26.
-
-##### **Changelog**
-
-```
-{changelog}
-```"""
-        else:  # no changelog
-            assert update.notes == "Automatic update for colord-1.3.4-1.fc26."
-
-    @mock.patch('bodhi.server.models.RpmBuild.get_changelog')
-    def test_changelog_too_long(self, mock_generate_changelog):
-        """The changelog must be omitted if it's too long."""
-        mock_generate_changelog.return_value = 'a' * config.get('update_notes_maxlength')
-
-        # process the message
-        self.handler(self.sample_message)
-
-        # check if the update exists...
-        update = self.db.query(Update).join(Build).filter(
-            Update.builds.any(Build.nvr == self.sample_nvr)
-        ).first()
-
-        assert update.notes == """Automatic update for colord-1.3.4-1.fc26.
-
-##### **Changelog**
-
-```
-[CHANGELOG OMITTED BECAUSE TOO LONG]
-```"""
-
-    @mock.patch('bodhi.server.models.RpmBuild.get_changelog')
-    def test_bug_added(self, mock_generate_changelog):
-        """Assert that a bug is added to the update if proper string is in changelog."""
-        changelog = ('* Sat Aug  3 2013 Fedora Releng <rel-eng@lists.fedoraproject.org> - 2\n'
-                     '- Added a free money feature.\n- Fix rhbz#112233.')
-
-        mock_generate_changelog.return_value = changelog
-
-        # process the message
-        self.handler(self.sample_message)
-
-        # check if the update exists...
-        update = self.db.query(Update).join(Build).filter(
-            Update.builds.any(Build.nvr == self.sample_nvr)
-        ).first()
-
-        assert update.notes == f"""Automatic update for colord-1.3.4-1.fc26.
-
-##### **Changelog**
-
-```
-{changelog}
-```"""
-        assert len(update.bugs) > 0
-        assert update.bugs[0].bug_id == 112233
-
-    @mock.patch.dict(config, [('bz_exclude_rels', ['F17'])])
-    @mock.patch('bodhi.server.models.RpmBuild.get_changelog')
-    def test_bug_not_added_excluded_release(self, mock_generate_changelog):
-        """Assert that a bug is not added for excluded release."""
-        changelog = ('* Sat Aug  3 2013 Fedora Releng <rel-eng@lists.fedoraproject.org> - 2\n'
-                     '- Added a free money feature.\n- Fix rhbz#112233.')
-
-        mock_generate_changelog.return_value = changelog
-
-        # process the message
-        self.handler(self.sample_message)
+    def test_changelog_deferred(self, get_changelog):
+        """Assert that the changelog is left to fill_changelog_task."""
+        with mock.patch('bodhi.server.consumers.automatic_updates.fill_changelog_task') as task:
+            self.handler(self.sample_message)
 
-        # check if the update exists...
         update = self.db.query(Update).join(Build).filter(
             Update.builds.any(Build.nvr == self.sample_nvr)
         ).first()
-
-        assert update.notes == f"""Automatic update for colord-1.3.4-1.fc26.
-
-##### **Changelog**
-
-```
-{changelog}
-```"""
-        assert len(update.bugs) == 0
-
-    @mock.patch('bodhi.server.consumers.automatic_updates.log.warning')
-    @mock.patch('bodhi.server.consumers.automatic_updates.sleep')
-    @mock.patch('bodhi.server.models.RpmBuild.get_changelog')
-    def test_changelog_handled_exception(self, mock_generate_changelog, sleep, warning):
-        """Assert that update creation is not successful if get_changelog() raises ValueError."""
-        mock_generate_changelog.side_effect = ValueError('Handled exception')
-        with pytest.raises(ValueError) as exc:
-            self.handler(self.sample_message)
-        assert str(exc.value) == 'Handled exception'
-        sleep.assert_called_once_with(5)
-        warning.assert_called_once_with('Handled exception')
-
-    @mock.patch('bodhi.server.models.RpmBuild.get_changelog')
-    def test_changelog_unhandled_exception(self, mock_generate_changelog):
-        """Assert that update creation is not succesful if get_changelog() raises Exception."""
-        mock_generate_changelog.side_effect = Exception('Unhandled exception')
-        with pytest.raises(Exception) as exc:
-            self.handler(self.sample_message)
-        assert str(exc.value) == 'Unhandled exception'
+        assert update.notes == "Automatic update for colord-1.3.4-1.fc26."
+        assert update.bugs == []
+        get_changelog.assert_not_called()
+        task.delay.assert_called_once_with(update.alias)
 
     def test_consume_with_orphan_build(self, caplog):
         """
@@ -477,6 +367,16 @@ class TestAutomaticUpdateHandler(base.BasePyTestCase):
         assert any(x.startswith(f"Ignoring build being tagged into '{bogus_tag}'")
                    for x in caplog.messages)
 
+    @mock.patch('bodhi.server.consumers.automatic_updates.buildsys.get_session')
+    def test_ignored_tag_no_koji_call(self, get_session):
+        """Test that messages about ignored tags don't query Koji."""
+        msg = deepcopy(self.sample_message)
+        msg.body['tag'] = 'thisisntthetagyourelookingfor'
+
+        self.handler(msg)
+
+        get_session.assert_not_called()
+
     def test_duplicate_message(self, caplog):
         """Assert that duplicate messages ignore existing build/update."""
         caplog.set_level(logging.DEBUG)
@@ -500,7 +400,7 @@ class TestAutomaticUpdateHandler(base.BasePyTestCase):
             'name': 'python-pants',
             'tag_id': 214,
             'instance': 's390',
-            'tag': 'f17-updates-testing-pending',
+            'tag': 'f17-updates-candidate',
             'user': 'lmacken',
             'version': '1.3.4',
             'owner': 'lmacken',
@@ -22,7 +22,11 @@ from fedora_messaging.api import Message
 from fedora_messaging.exceptions import Nack
 
 from bodhi.server import config
-from bodhi.server.consumers import Consumer, HandlerInfo, signed
+from bodhi.server.consumers import (
+    Consumer,
+    HandlerInfo,
+    signed,
+)
 
 
 @mock.patch.dict(
@@ -87,15 +91,18 @@ class TestConsumer:
         )
 
         signed_handler = mock.Mock()
-        SignedHandler.side_effect = lambda: signed_handler
+        SignedHandler.side_effect = lambda **kwargs: signed_handler
 
         automatic_update_handler = mock.Mock()
-        AutomaticUpdateHandler.side_effect = lambda: automatic_update_handler
+        AutomaticUpdateHandler.side_effect = lambda **kwargs: automatic_update_handler
 
         Consumer()(msg)
 
         signed_handler.assert_called_once_with(msg)
         automatic_update_handler.assert_called_once_with(msg)
+        # Both handlers filter tags with the same index
+        tag_index = SignedHandler.call_args[1]['tag_index']
+        assert AutomaticUpdateHandler.call_args[1]['tag_index'] is tag_index
 
     @mock.patch('bodhi.server.consumers.ResultsdbHandler')
     def test_messaging_callback_resultsdb(self, Handler):
@@ -118,3 +125,51 @@ class TestConsumer:
         Handler.side_effect = lambda: handler
         Consumer()(msg)
         handler.assert_called_once_with(msg)
+
+    def test_handlers_for(self):
+        """The handlers should be indexed by topic, and reindexed if handler_infos changes."""
+        consumer = Consumer()
+
+        handlers = consumer.handlers_for('org.fedoraproject.prod.buildsys.tag')
+
+        assert [hi.name for hi in handlers] == ['Signed', 'Automatic Update']
+        assert consumer.handlers_for('org.fedoraproject.prod.buildsys.tag') is handlers
+        assert consumer.handlers_for('org.fedoraproject.prod.buildsys.untag') == ()
+
+        consumer.handler_infos = [HandlerInfo('.buildsys.tag', 'Other', mock.Mock())]
+        assert [hi.name for hi in consumer.handlers_for(
+            'org.fedoraproject.prod.buildsys.tag')] == ['Other']
+
+    def test_handlers_run_in_order(self):
+        """The handlers matching a message should run one after the other, in order."""
+        msg = Message(topic="org.fedoraproject.prod.buildsys.tag", body={})
+        calls = []
+        consumer = Consumer()
+        consumer.handler_infos = [
+            HandlerInfo('.buildsys.tag', f'H{i}',
+                        mock.Mock(side_effect=lambda m, i=i: calls.append(i)))
+            for i in range(2)]
+
+        consumer(msg)
+
+        assert calls == [0, 1]
+
+    @mock.patch('bodhi.server.consumers.consumer_handler_duration')
+    @mock.patch('bodhi.server.consumers.consumer_queue_depth')
+    def test_metrics(self, queue_depth, duration):
+        """The queue depth and handler latency should be recorded."""
+        msg = Message(topic="org.fedoraproject.prod.buildsys.tag", body={})
+        consumer = Consumer()
+        consumer.handler_infos = [
+            HandlerInfo('.buildsys.tag', 'Good', mock.Mock()),
+            HandlerInfo('.buildsys.tag', 'Bad', mock.Mock(side_effect=Exception('oops'))),
+        ]
+
+        with pytest.raises(Nack):
+            consumer(msg)
+
+        assert queue_depth.labels.call_args_list.count(mock.call(handler='Good')) == 2
+        assert queue_depth.labels.return_value.inc.call_count == 2
+        assert queue_depth.labels.return_value.dec.call_count == 2
+        duration.labels.assert_any_call(handler='Good', outcome='success')
+        duration.labels.assert_any_call(handler='Bad', outcome='error')
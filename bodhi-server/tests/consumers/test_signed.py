@@ -110,6 +110,20 @@ class TestSignedHandlerConsume(base.BasePyTestCase):
         self.handler(self.sample_message)
         assert build.signed is True
 
+    @mock.patch('bodhi.server.consumers.signed.log')
+    @mock.patch('bodhi.server.consumers.signed.Build')
+    def test_consume_irrelevant_tag(self, mock_build_model, mock_log):
+        """
+        Assert that messages about tags no release uses are dropped before looking up the build.
+        """
+        self.sample_message.body['tag'] = 'f17-updates-candidate'
+
+        self.handler(self.sample_message)
+
+        mock_log.info.assert_called_with(
+            "Tag is not a pending_testing tag of any release, skipping")
+        mock_build_model.get.assert_not_called()
+
     @mock.patch('bodhi.server.consumers.signed.log')
     @mock.patch('bodhi.server.consumers.signed.Build')
     def test_consume_not_pending_testing_tag(self, mock_build_model, mock_log):
@@ -0,0 +1,68 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This test suite contains tests for the bodhi.server.consumers.util module."""
+
+from unittest import mock
+
+from bodhi.server.config import config
+from bodhi.server.consumers.util import TagIndex
+from bodhi.server.models import Release
+
+from ..base import BasePyTestCase, TransactionalSessionMaker
+
+
+class TestTagIndex(BasePyTestCase):
+    """Test the TagIndex class."""
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.db_factory = TransactionalSessionMaker(self.Session)
+        self.index = TagIndex()
+
+    def test_signed_tags(self):
+        """Pending testing tags and testing side tags should be relevant to the Signed handler."""
+        assert self.index.is_signed_tag('f17-updates-testing-pending', self.db_factory)
+        assert self.index.is_signed_tag('f17-build-side-1234-testing-pending', self.db_factory)
+        assert not self.index.is_signed_tag('f17-updates-candidate', self.db_factory)
+
+    def test_automatic_update_tags(self):
+        """Only the candidate tags of releases with automatic updates should be relevant."""
+        assert self.index.is_automatic_update_tag('f17-updates-candidate', self.db_factory)
+        assert not self.index.is_automatic_update_tag('f17-updates-testing', self.db_factory)
+
+        release = Release.query.filter_by(name='F17').one()
+        release.create_automatic_updates = False
+        self.db.flush()
+        self.index.refresh(self.db_factory)
+
+        assert not self.index.is_automatic_update_tag('f17-updates-candidate', self.db_factory)
+
+    @mock.patch.dict(config, {'consumer.tag_index_ttl': 60})
+    @mock.patch('bodhi.server.consumers.util.time.monotonic')
+    def test_ttl(self, monotonic):
+        """The index should only be loaded again once it is older than the TTL."""
+        monotonic.return_value = 100
+        with mock.patch.object(self.index, 'refresh', wraps=self.index.refresh) as refresh:
+            self.index.is_signed_tag('f17-updates-testing-pending', self.db_factory)
+            monotonic.return_value = 159
+            self.index.is_automatic_update_tag('f17-updates-candidate', self.db_factory)
+            assert refresh.call_count == 1
+
+            monotonic.return_value = 160
+            self.index.is_signed_tag('f17-updates-testing-pending', self.db_factory)
+            assert refresh.call_count == 2
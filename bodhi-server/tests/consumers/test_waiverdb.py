@@ -142,6 +142,24 @@ class TestWaiverdbHandler(BasePyTestCase):
             assert update.test_gating_status == models.TestGatingStatus.passed
             # don't bother testing every other path here too
 
+    @mock.patch.dict('bodhi.server.config.config', {'test_gating.refresh_window': 30})
+    @mock.patch('bodhi.server.consumers.util.refresh_test_gating_status_task')
+    def test_waiverdb_coalesced(self, task):
+        """
+        Assert that with a refresh window, messages only flag the update,
+        and a single refresh is scheduled for a burst of them.
+        """
+        update = self.single_build_update
+        testmsg = self.get_sample_message(typ="koji_build")
+
+        with mock.patch("bodhi.server.models.Update.update_test_gating_status") as updmock:
+            for i in range(3):
+                self.handler(testmsg)
+
+        assert updmock.call_count == 0
+        assert update.test_gating_dirty_since is not None
+        task.apply_async.assert_called_once_with((update.alias,), countdown=30)
+
     @mock.patch('bodhi.server.consumers.waiverdb.log')
     def test_waiverdb_bad_message(self, mock_log):
         """ Assert that the consumer ignores badly formed messages."""
@@ -21,6 +21,7 @@ This module contains tests for the bodhi.server.scripts.sar module.
 
 from datetime import datetime
 from unittest import mock
+import json
 import os
 
 from click import testing
@@ -150,3 +151,34 @@ class TestSar(BasePyTestCase):
         r = runner.invoke(sar.get_user_data, ["--username=" + "guest", "--human-readable"])
 
         assert r.exit_code == 0
+
+    @mock.patch('bodhi.server.scripts.sar.BATCH_SIZE', 1)
+    def test_batches(self):
+        """Users with more rows than a batch should get all their data."""
+        self.create_update(['python-nose-1.3.7-11.fc17'])
+        self.create_update(['python-paste-deploy-1.5.2-8.fc17', 'nodejs-grunt-0.4.5-1.fc17'])
+        self.db.commit()
+
+        runner = testing.CliRunner()
+        r = runner.invoke(sar.get_user_data, ["--username=" + "guest"])
+
+        assert r.exit_code == 0
+        updates = json.loads(r.output)['guest']['updates']
+        assert [sorted(u['builds']) for u in updates] == [
+            ['bodhi-2.0-1.fc17'], ['python-nose-1.3.7-11.fc17'],
+            ['nodejs-grunt-0.4.5-1.fc17', 'python-paste-deploy-1.5.2-8.fc17']]
+
+
+class TestJsonChunks:
+    """This class contains tests for the _json_chunks() function."""
+
+    def test_same_as_dumps(self):
+        """The chunks should add up to what json.dumps() returns for the same data as lists."""
+        def items():
+            yield {'b': 1, 'a': [None, True]}
+            yield 'ü"'
+
+        value = {'z': items(), 'a': {'y': 1.5, 'x': items()}, 'e': (x for x in [])}
+        expected = {'z': list(items()), 'a': {'y': 1.5, 'x': list(items())}, 'e': []}
+
+        assert ''.join(sar._json_chunks(value)) == json.dumps(expected, sort_keys=True)
@@ -0,0 +1,65 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This module contains tests for bodhi.server.services.caches."""
+from unittest import mock
+
+from bodhi.server import cache
+from .. import base
+
+
+class TestCachesService(base.BasePyTestCase):
+    """Test the /admin/caches/ endpoints."""
+
+    def test_query_caches(self):
+        """The hits and misses of the regions should be returned."""
+        region = cache.get_region()
+        region.get('foo')
+
+        res = self.app.get('/admin/caches/', status=200)
+
+        assert res.json_body['caches']['default']['misses'] >= 1
+
+    @mock.patch('bodhi.server.services.caches.cache.invalidate', return_value=['default'])
+    def test_invalidate(self, invalidate):
+        """POSTing to a region should invalidate it."""
+        res = self.app.post('/admin/caches/default', {'csrf_token': self.get_csrf_token()},
+                            status=200)
+
+        assert res.json_body == {'invalidated': ['default']}
+        invalidate.assert_called_once_with('default')
+
+    @mock.patch('bodhi.server.services.caches.cache.invalidate',
+                return_value=['default', 'avatars'])
+    def test_invalidate_all(self, invalidate):
+        """POSTing to all should invalidate all the regions."""
+        res = self.app.post('/admin/caches/all', {'csrf_token': self.get_csrf_token()},
+                            status=200)
+
+        assert res.json_body == {'invalidated': ['default', 'avatars']}
+        invalidate.assert_called_once_with(None)
+
+    def test_invalidate_unknown(self):
+        """POSTing to an unknown region should return a 404."""
+        res = self.app.post('/admin/caches/nope', {'csrf_token': self.get_csrf_token()},
+                            status=404)
+
+        assert res.json_body['errors'][0]['description'] == 'No such cache region'
+
+    def test_invalidate_no_csrf(self):
+        """The CSRF token should be required."""
+        self.app.post('/admin/caches/default', status=400)
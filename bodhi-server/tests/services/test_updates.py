@@ -7142,7 +7142,7 @@ class TestGetTestResults(BasePyTestCase):
         }
 
     @mock.patch.dict(config, [('greenwave_api_url', 'https://greenwave.api')])
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     @mock.patch('bodhi.server.util.call_api', wraps=call_api)
     def test_get_test_results_calling_greenwave_500(self, call_api, http_session, *args):
         """
@@ -7159,7 +7159,9 @@ class TestGetTestResults(BasePyTestCase):
 
         res = self.app.get(f'/updates/{up.alias}/get-test-results', status=502)
 
-        assert call_api.call_count == 4
+        # The request is retried 3 times.
+        assert call_api.call_count == 1
+        assert http_session.post.call_count == 4
         assert res.json_body == {
             'errors': [
                 {
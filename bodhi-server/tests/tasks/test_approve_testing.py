@@ -19,16 +19,16 @@
 This module contains tests for the bodhi.server.tasks.approve_testing module.
 """
 from datetime import datetime, timedelta
-from unittest.mock import call, patch
+from unittest.mock import ANY, call, patch
 
 from fedora_messaging import api, testing as fml_testing
 import pytest
 
 from bodhi.messages.schemas import update as update_schemas
 from bodhi.server.config import config
-from bodhi.server import models
+from bodhi.server import buildsys, models
 from bodhi.server.tasks import approve_testing_task
-from bodhi.server.tasks.approve_testing import main as approve_testing_main
+from bodhi.server.tasks.approve_testing import candidates, main as approve_testing_main
 from ..base import BasePyTestCase
 from .base import BaseTaskTestCase
 
@@ -177,13 +177,14 @@ class TestMain(BaseTaskTestCase):
         log.info.assert_called_with(f'{update.alias} now meets testing requirements')
         log.exception.assert_called_with("There was an error approving testing updates.")
 
+    @patch.dict(config, [('approve_testing.chunk_size', 1)])
     @patch('bodhi.server.models.Update.comment', side_effect=[None, IOError('The DB died lol')])
     @patch('bodhi.server.tasks.approve_testing.log')
     @pytest.mark.parametrize('composed_by_bodhi', (True, False))
     def test_exception_handler_on_the_second_update(
             self, log, comment, composed_by_bodhi):
         """
-        Ensure, that when the Exception is raised, all previous transactions are commited,
+        Ensure, that when the Exception is raised, all previous chunks are commited,
         the Exception handler prints the Exception, rolls back and closes the db, and exits.
         """
         update = self.db.query(models.Update).all()[0]
@@ -695,21 +696,23 @@ class TestMain(BaseTaskTestCase):
             # to stable directly, it adds f17-updates (the stable tag) then
             # removes f17-updates-testing-pending and f17-updates-pending
             assert remove_tag.call_args_list == \
-                [call('f17-updates-testing-pending'), call('f17-updates-pending'),
-                 call('f17-updates-signing-pending'), call('f17-updates-testing'),
-                 call('f17-updates-candidate')]
+                [call('f17-updates-testing-pending', koji=ANY),
+                 call('f17-updates-pending', koji=ANY),
+                 call('f17-updates-signing-pending', koji=ANY),
+                 call('f17-updates-testing', koji=ANY),
+                 call('f17-updates-candidate', koji=ANY)]
 
             assert add_tag.call_args_list == \
-                [call('f17-updates')]
+                [call('f17-updates', koji=ANY)]
             delete_tag.assert_not_called()
         else:
             assert remove_tag.call_args_list == \
-                [call(f'{from_side_tag}-signing-pending'),
-                 call(f'{from_side_tag}-testing-pending'),
-                 call(from_side_tag)]
+                [call(f'{from_side_tag}-signing-pending', koji=ANY),
+                 call(f'{from_side_tag}-testing-pending', koji=ANY),
+                 call(from_side_tag, koji=ANY)]
 
             assert add_tag.call_args_list == \
-                [call('f17-updates')]
+                [call('f17-updates', koji=ANY)]
             assert delete_tag.call_args_list == \
                 [call(f'{from_side_tag}-signing-pending'),
                  call(f'{from_side_tag}-testing-pending'),
@@ -1000,3 +1003,121 @@ class TestMain(BaseTaskTestCase):
         approve_testing_main()
 
         assert update.status == models.UpdateStatus.stable
+
+
+class TestCandidates(BaseTaskTestCase):
+    """
+    This class contains tests for the candidates() function.
+    """
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.update = self.db.query(models.Update).all()[0]
+        self.update.autotime = False
+        self.update.request = None
+        self.update.status = models.UpdateStatus.testing
+        self.update.date_testing = datetime.utcnow() - timedelta(days=1)
+        self.update.comments = []
+        self.db.flush()
+
+    def test_not_enough_days_nor_karma(self):
+        """Updates with neither enough days in testing nor karma should be left out."""
+        assert candidates(self.db).all() == []
+
+    def test_enough_days(self):
+        """Updates with enough days in testing should be candidates."""
+        self.update.date_testing = datetime.utcnow() - timedelta(days=7)
+        self.db.flush()
+
+        assert candidates(self.db).all() == [self.update]
+
+    def test_positive_karma(self):
+        """Updates with positive karma should be candidates."""
+        self.update.comment(self.db, 'works', karma=1, author='tester')
+        self.db.flush()
+
+        assert candidates(self.db).all() == [self.update]
+
+    @patch.dict(config, [('fedora.mandatory_days_in_testing', 0)])
+    def test_no_mandatory_days_in_testing(self):
+        """Only autotime updates should be candidates in releases without mandatory days."""
+        assert candidates(self.db).all() == []
+
+        self.update.autotime = True
+        self.db.flush()
+
+        assert candidates(self.db).all() == [self.update]
+
+    @patch.dict(config, [('test_gating.required', True)])
+    def test_gating_failed(self):
+        """Updates that failed gating should be left out when gating is required."""
+        self.update.date_testing = datetime.utcnow() - timedelta(days=7)
+        self.update.test_gating_status = models.TestGatingStatus.failed
+        self.db.flush()
+
+        assert candidates(self.db).all() == []
+
+        self.update.test_gating_status = models.TestGatingStatus.passed
+        self.db.flush()
+
+        assert candidates(self.db).all() == [self.update]
+
+    @patch('bodhi.server.tasks.approve_testing.approve_update')
+    def test_main_skips_non_candidates(self, approve_update):
+        """main() should not look at the updates that are not candidates."""
+        self.db.info['messages'] = []
+
+        approve_testing_main()
+
+        approve_update.assert_not_called()
+
+
+class TestChunks(BaseTaskTestCase):
+    """
+    This class contains tests for the chunked processing of main().
+    """
+
+    @patch.dict(config, [('fedora.mandatory_days_in_testing', 0),
+                         ('approve_testing.chunk_size', 2)])
+    @patch('bodhi.server.models.Update.find_conflicting_builds', return_value=[])
+    @patch('bodhi.server.models.mail', autospec=True)
+    def test_tag_changes_batched(self, mail, find_conflicting_builds):
+        """The Koji tag changes of a chunk should be sent after it is committed."""
+        updates = [self.db.query(models.Update).all()[0],
+                   self.create_update(['bodhi2-2.0-1.fc17']),
+                   self.create_update(['bodhi3-2.0-1.fc17'])]
+        for update in updates:
+            update.autotime = True
+            update.request = None
+            update.release.composed_by_bodhi = False
+            update.stable_days = 0
+            update.date_testing = datetime.utcnow()
+            update.status = models.UpdateStatus.testing
+        self.db.info['messages'] = []
+        self.db.commit()
+
+        with patch('bodhi.server.tasks.approve_testing.KojiTagChanges.run',
+                   autospec=True) as run:
+            with patch.object(self.db, 'commit', wraps=self.db.commit) as commit:
+                run.side_effect = lambda changes: calls.append(
+                    (commit.call_count, len(changes.untag._calls)))
+                calls = []
+                with fml_testing.mock_sends(*[api.Message] * 3):
+                    approve_testing_main()
+
+        # Each update commits once when it's marked as stable, and each chunk once more.
+        assert calls == [(3, 10), (5, 5)]
+        assert all(u.status == models.UpdateStatus.stable for u in updates)
+
+    @patch('bodhi.server.tasks.approve_testing.log.warning')
+    def test_koji_failures_logged(self, warning):
+        """Koji calls that fail should be logged."""
+        from bodhi.server.tasks.approve_testing import KojiTagChanges
+        changes = KojiTagChanges()
+        changes.delete.deleteTag('f17-build-side-1234')
+
+        with patch.object(buildsys.MulticallExecutor, 'run',
+                          side_effect=[[], [], [{'faultString': 'no such tag'}]]):
+            changes.run()
+
+        warning.assert_called_once_with('Koji failed to delete tag: no such tag')
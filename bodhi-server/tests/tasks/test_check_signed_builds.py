@@ -23,6 +23,7 @@ from datetime import datetime
 from unittest.mock import call, patch
 
 from bodhi.server import models
+from bodhi.server.config import config
 from bodhi.server.tasks import check_signed_builds_task
 from bodhi.server.tasks.check_signed_builds import main as check_signed_builds_main
 from ..base import BasePyTestCase
@@ -37,11 +38,26 @@ class TestTask(BasePyTestCase):
     @patch("bodhi.server.tasks.config")
     @patch("bodhi.server.tasks.check_signed_builds.main")
     def test_task(self, main_function, config_mock, init_db_mock, buildsys):
-        check_signed_builds_task()
+        main_function.return_value = None
+        with patch.object(check_signed_builds_task, 'delay') as delay:
+            check_signed_builds_task()
         config_mock.load_config.assert_called_with()
         init_db_mock.assert_called_with(config_mock)
         buildsys.setup_buildsystem.assert_called_with(config_mock)
-        main_function.assert_called()
+        main_function.assert_called_once_with(0)
+        delay.assert_not_called()
+
+    @patch("bodhi.server.tasks.buildsys")
+    @patch("bodhi.server.tasks.initialize_db")
+    @patch("bodhi.server.tasks.config")
+    @patch("bodhi.server.tasks.check_signed_builds.main", return_value=42)
+    def test_task_out_of_time(self, main_function, config_mock, init_db_mock, buildsys):
+        """A task that runs out of time should queue another one to carry on."""
+        with patch.object(check_signed_builds_task, 'delay') as delay:
+            check_signed_builds_task(resume_after=12)
+
+        main_function.assert_called_once_with(12)
+        delay.assert_called_once_with(resume_after=42)
 
 
 class TestCheckSignedBuilds(BaseTaskTestCase):
@@ -61,7 +77,7 @@ class TestCheckSignedBuilds(BaseTaskTestCase):
         check_signed_builds_main()
 
         debug.assert_called_once_with('No stuck Updates found')
-        buildsys.get_session.assert_not_called()
+        buildsys.MulticallExecutor.assert_not_called()
 
     @patch('bodhi.server.tasks.check_signed_builds.buildsys')
     @patch('bodhi.server.tasks.check_signed_builds.log.debug')
@@ -81,11 +97,11 @@ class TestCheckSignedBuilds(BaseTaskTestCase):
             {'arches': 'i386 x86_64 ppc ppc64', 'id': 10, 'locked': True,
              'name': 'f17-updates-pending', 'perm': None, 'perm_id': None}, ]
 
-        buildsys.get_session.return_value.listTags.return_value = listTags
+        buildsys.MulticallExecutor.return_value.run.return_value = [[listTags]]
         check_signed_builds_main()
 
         update = models.Update.query.first()
-        buildsys.get_session.assert_called_once()
+        buildsys.MulticallExecutor.return_value.listTags.assert_not_called()
         assert update.builds[0].signed is False
 
     @patch('bodhi.server.tasks.check_signed_builds.buildsys')
@@ -98,10 +114,12 @@ class TestCheckSignedBuilds(BaseTaskTestCase):
         assert update.builds[0].signed
 
         self.db.commit()
+        buildsys.MulticallExecutor.return_value.run.return_value = [[[]]]
 
         check_signed_builds_main()
 
-        buildsys.get_session.assert_called_once()
+        buildsys.MulticallExecutor.return_value.listTags.assert_called_once_with(
+            build='bodhi-2.0-1.fc17')
         debug.assert_called_once_with('bodhi-2.0-1.fc17 already marked as signed')
 
     @patch('bodhi.server.models.Update.set_request')
@@ -120,10 +138,11 @@ class TestCheckSignedBuilds(BaseTaskTestCase):
             {'arches': 'i386 x86_64 ppc ppc64', 'id': 10, 'locked': True,
              'name': 'f17-updates-testing', 'perm': None, 'perm_id': None}, ]
 
-        buildsys.get_session.return_value.listTags.return_value = listTags
+        buildsys.MulticallExecutor.return_value.run.return_value = [[listTags]]
         check_signed_builds_main()
 
-        buildsys.get_session.assert_called_once()
+        buildsys.MulticallExecutor.return_value.listTags.assert_called_once_with(
+            build='bodhi-2.0-1.fc17')
         calls = [call('bodhi-2.0-1.fc17 already marked as signed'),
                  call(f'Resubmitting {update.alias} to testing')]
         debug.assert_has_calls(calls)
@@ -148,17 +167,18 @@ class TestCheckSignedBuilds(BaseTaskTestCase):
             {'arches': 'i386 x86_64 ppc ppc64', 'id': 10, 'locked': True,
              'name': 'f17-updates-signing-pending', 'perm': None, 'perm_id': None}, ]
 
-        buildsys.get_session.return_value.listTags.return_value = listTags
+        buildsys.MulticallExecutor.return_value.run.return_value = [[listTags]]
         check_signed_builds_main()
 
         update = models.Update.query.first()
-        buildsys.get_session.assert_called_once()
+        buildsys.MulticallExecutor.return_value.listTags.assert_called_once_with(
+            build='bodhi-2.0-1.fc17')
         assert update.builds[0].signed is False
         debug.assert_called_once_with('bodhi-2.0-1.fc17 is stuck waiting to be signed, '
                                       'let\'s try again')
-        buildsys.get_session.return_value.untagBuild.assert_called_once_with(
+        buildsys.MulticallExecutor.return_value.untagBuild.assert_called_once_with(
             'f17-updates-signing-pending', 'bodhi-2.0-1.fc17', force=True)
-        buildsys.get_session.return_value.tagBuild.assert_called_once_with(
+        buildsys.MulticallExecutor.return_value.tagBuild.assert_called_once_with(
             'f17-updates-signing-pending', 'bodhi-2.0-1.fc17', force=True)
 
     @patch('bodhi.server.tasks.check_signed_builds.buildsys')
@@ -180,15 +200,16 @@ class TestCheckSignedBuilds(BaseTaskTestCase):
             {'arches': 'i386 x86_64 ppc ppc64', 'id': 10, 'locked': True,
              'name': 'f17-updates-candidate', 'perm': None, 'perm_id': None}, ]
 
-        buildsys.get_session.return_value.listTags.return_value = listTags
+        buildsys.MulticallExecutor.return_value.run.return_value = [[listTags]]
         check_signed_builds_main()
 
         update = models.Update.query.first()
-        buildsys.get_session.assert_called_once()
+        buildsys.MulticallExecutor.return_value.listTags.assert_called_once_with(
+            build='bodhi-2.0-1.fc17')
         assert update.builds[0].signed is False
         debug.assert_called_once_with('Oh, no! We\'ve never sent bodhi-2.0-1.fc17 for signing, '
                                       'let\'s fix it')
-        buildsys.get_session.return_value.tagBuild.assert_called_once_with(
+        buildsys.MulticallExecutor.return_value.tagBuild.assert_called_once_with(
             'f17-updates-signing-pending', 'bodhi-2.0-1.fc17', force=True)
 
     @patch('bodhi.server.tasks.check_signed_builds.buildsys')
@@ -208,11 +229,12 @@ class TestCheckSignedBuilds(BaseTaskTestCase):
             {'arches': 'i386 x86_64 ppc ppc64', 'id': 10, 'locked': True,
              'name': 'f17-updates-testing-pending', 'perm': None, 'perm_id': None}, ]
 
-        buildsys.get_session.return_value.listTags.return_value = listTags
+        buildsys.MulticallExecutor.return_value.run.return_value = [[listTags]]
         check_signed_builds_main()
 
         update = models.Update.query.first()
-        buildsys.get_session.assert_called_once()
+        buildsys.MulticallExecutor.return_value.listTags.assert_called_once_with(
+            build='bodhi-2.0-1.fc17')
         debug.assert_called_once_with('Changing signed status of bodhi-2.0-1.fc17')
         assert update.builds[0].signed is True
 
@@ -230,6 +252,79 @@ class TestCheckSignedBuilds(BaseTaskTestCase):
         check_signed_builds_main()
 
         update = models.Update.query.first()
-        buildsys.get_session.assert_called_once()
+        buildsys.MulticallExecutor.return_value.listTags.assert_not_called()
         debug.assert_called_once_with(f'Obsoleting empty update {update.alias}')
         assert update.status == models.UpdateStatus.obsolete
+
+    @patch('bodhi.server.tasks.check_signed_builds.buildsys')
+    @patch('bodhi.server.tasks.check_signed_builds.log.warning')
+    def test_check_signed_builds_list_tags_failed(self, warning, buildsys):
+        """
+        Builds whose tags Koji failed to list should be left alone until the next run.
+        """
+        update = models.Update.query.first()
+        update.builds[0].signed = False
+        self.db.commit()
+        buildsys.MulticallExecutor.return_value.run.return_value = [
+            {'faultCode': 1000, 'faultString': 'oops'}]
+
+        check_signed_builds_main()
+
+        warning.assert_called_once_with('Unable to list the tags of bodhi-2.0-1.fc17: oops')
+        buildsys.MulticallExecutor.return_value.tagBuild.assert_not_called()
+        assert models.Update.query.first().builds[0].signed is False
+
+
+class TestTimeSlicing(BaseTaskTestCase):
+    """This test class contains tests for the chunks and time budget of main()."""
+
+    def setup_method(self, method):
+        """Make three old pending updates."""
+        super().setup_method(method)
+        self.create_update(['bodhi2-2.0-1.fc17'])
+        self.create_update(['bodhi3-2.0-1.fc17'])
+        for update in models.Update.query.all():
+            update.status = models.UpdateStatus.pending
+            update.date_submitted = datetime(2020, 1, 1)
+        self.db.commit()
+        self.ids = sorted(u.id for u in models.Update.query.all())
+
+    @patch.dict(config, {'check_signed_builds_chunk_size': 2})
+    @patch('bodhi.server.tasks.check_signed_builds._check_updates')
+    def test_chunks(self, check_updates):
+        """The updates should be checked in chunks."""
+        check_signed_builds_main()
+
+        assert [c[0][1] for c in check_updates.call_args_list] == [self.ids[:2], self.ids[2:]]
+
+    @patch.dict(config, {'check_signed_builds_chunk_size': 1,
+                         'check_signed_builds_time_budget': 10})
+    @patch('bodhi.server.tasks.check_signed_builds.time.monotonic')
+    @patch('bodhi.server.tasks.check_signed_builds._check_updates')
+    def test_time_budget(self, check_updates, monotonic):
+        """A run that runs out of time should stop, and the next one should carry on."""
+        monotonic.side_effect = [0, 5, 11, 100, 101]
+
+        resume_after = check_signed_builds_main()
+
+        assert [c[0][1] for c in check_updates.call_args_list] == [[i] for i in self.ids[:2]]
+        assert resume_after == self.ids[1]
+
+        check_updates.reset_mock()
+        resume_after = check_signed_builds_main(resume_after)
+
+        assert [c[0][1] for c in check_updates.call_args_list] == [[self.ids[2]]]
+        assert resume_after is None
+
+    @patch.dict(config, {'check_signed_builds_chunk_size': 2,
+                         'check_signed_builds_time_budget': 10})
+    @patch('bodhi.server.tasks.check_signed_builds.time.monotonic')
+    @patch('bodhi.server.tasks.check_signed_builds._check_updates')
+    def test_time_budget_spent_before_first_chunk(self, check_updates, monotonic):
+        """A run whose budget is already spent should still check its first chunk."""
+        monotonic.side_effect = [0, 20]
+
+        resume_after = check_signed_builds_main()
+
+        assert [c[0][1] for c in check_updates.call_args_list] == [self.ids[:2]]
+        assert resume_after == self.ids[1]
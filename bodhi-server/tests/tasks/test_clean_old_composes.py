@@ -19,13 +19,14 @@
 This module contains tests for the bodhi.server.tasks.clean_old_composes module.
 """
 
-from unittest.mock import patch
+from unittest.mock import call, patch
 import os
 import shutil
 import tempfile
+import threading
 
 from bodhi.server import config
-from bodhi.server.tasks import clean_old_composes_task
+from bodhi.server.tasks import clean_old_composes, clean_old_composes_task
 from bodhi.server.tasks.clean_old_composes import main as clean_old_composes_main
 from ..base import BasePyTestCase
 
@@ -89,7 +90,7 @@ class TestMain(BasePyTestCase):
         with open(os.path.join(self.compose_dir, 'COOL_FILE.txt'), 'w') as cool_file:
             cool_file.write('This file should be allowed to hang out here because it\'s cool.')
         with patch.dict(config.config, {'compose_dir': self.compose_dir}):
-            clean_old_composes_main(2)
+            clean_old_composes_main(2, wait=True)
         # We expect these and only these directories to remain.
         expected_dirs = {
             'dist-5E-epel-161012.1854', 'dist-5E-epel-161013.1711',
@@ -101,7 +102,7 @@ class TestMain(BasePyTestCase):
             'f23-updates-testing-161003.2217', 'f24-updates-161002.2331',
             'f24-updates-161003.1302', 'f24-updates-testing-161001.0424',
             'this_should_get_left_alone', 'f23-updates-should_be_untouched',
-            'f23-updates.repocache', 'f23-updates-testing-blank'}
+            'f23-updates.repocache', 'f23-updates-testing-blank', '.trash'}
         actual_dirs = set([d for d in os.listdir(self.compose_dir)
                            if os.path.isdir(os.path.join(self.compose_dir, d))])
         assert actual_dirs == expected_dirs
@@ -112,6 +113,140 @@ class TestMain(BasePyTestCase):
         # Make sure the logged output is correct
         expected_output = set(dirs) - expected_dirs
         expected_output = {os.path.join(self.compose_dir, d) for d in expected_output}
-        expected_output = expected_output | {'Deleting the following directories:'}
+        expected_output = expected_output | {
+            'Deleting the following directories:',
+            'Deleted 9 old composes, freeing 67 bytes and 10 inodes'}
         logged = set([c[0][0] for c in log.info.call_args_list])
         assert logged == expected_output
+        assert os.listdir(os.path.join(self.compose_dir, '.trash')) == []
+
+    @patch('bodhi.server.tasks.clean_old_composes.purge')
+    def test_main_background(self, purge):
+        """
+        By default the old composes should be moved to the trash and deleted in the background.
+        """
+        for d in ('f23-updates-161004.1423', 'f23-updates-161005.0259'):
+            os.makedirs(os.path.join(self.compose_dir, d))
+        os.makedirs(os.path.join(self.compose_dir, '.trash', 'f23-updates-161004.1423'))
+        trash_dir = os.path.join(self.compose_dir, '.trash')
+
+        with patch.dict(config.config, {'compose_dir': self.compose_dir}):
+            clean_old_composes_main(1)
+
+        assert sorted(os.listdir(self.compose_dir)) == ['.trash', 'f23-updates-161005.0259']
+        trashed = sorted(os.listdir(trash_dir))
+        assert len(trashed) == 2
+        assert trashed[0] == 'f23-updates-161004.1423'
+        assert trashed[1].startswith('f23-updates-161004.1423.')
+        for thread in threading.enumerate():
+            if thread.name == 'compose-trash-purger':
+                thread.join()
+        purge.assert_called_once_with(trash_dir)
+
+    @patch('bodhi.server.tasks.clean_old_composes.purge')
+    def test_main_no_trash(self, purge):
+        """
+        Nothing should be started if there is nothing to delete.
+        """
+        with patch.dict(config.config, {'compose_dir': self.compose_dir}):
+            clean_old_composes_main(1)
+
+        purge.assert_not_called()
+        assert os.listdir(self.compose_dir) == []
+
+
+class TestPurge(BasePyTestCase):
+    """
+    This class contains tests for the purge() function.
+    """
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.trash_dir = tempfile.mkdtemp()
+        self.keep_dir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.trash_dir)
+        shutil.rmtree(self.keep_dir)
+        super().teardown_method(method)
+
+    def test_hardlinks(self):
+        """
+        Files with links out of the trash should not be counted as freed.
+        """
+        compose = os.path.join(self.trash_dir, 'f23-updates-161004.1423')
+        os.makedirs(os.path.join(compose, 'Packages', 'b'))
+        with open(os.path.join(compose, 'Packages', 'b', 'bodhi.rpm'), 'w') as rpm:
+            rpm.write('1234')
+        with open(os.path.join(compose, 'repomd.xml'), 'w') as repomd:
+            repomd.write('12')
+        os.link(os.path.join(compose, 'Packages', 'b', 'bodhi.rpm'),
+                os.path.join(self.keep_dir, 'bodhi.rpm'))
+        os.symlink('repomd.xml', os.path.join(compose, 'link'))
+        with open(os.path.join(self.trash_dir, 'stray_file'), 'w') as stray:
+            stray.write('123')
+
+        stats = clean_old_composes.purge(self.trash_dir)
+
+        assert stats == clean_old_composes.PurgeStats(
+            composes=2, bytes=2 + len('repomd.xml') + 3, inodes=6)
+        assert os.listdir(self.trash_dir) == []
+        assert os.listdir(self.keep_dir) == ['bodhi.rpm']
+
+    def test_already_running(self):
+        """
+        Only one thread should empty the trash at a time.
+        """
+        os.makedirs(os.path.join(self.trash_dir, 'f23-updates-161004.1423'))
+
+        with clean_old_composes._purge_lock:
+            stats = clean_old_composes.purge(self.trash_dir)
+
+        assert stats == clean_old_composes.PurgeStats()
+        assert os.listdir(self.trash_dir) == ['f23-updates-161004.1423']
+
+    @patch('bodhi.server.tasks.clean_old_composes.log.exception')
+    @patch('bodhi.server.tasks.clean_old_composes.os.rmdir', side_effect=PermissionError)
+    def test_failure(self, rmdir, exception):
+        """
+        A compose that can't be deleted should be logged and left in the trash.
+        """
+        compose = os.path.join(self.trash_dir, 'f23-updates-161004.1423')
+        os.makedirs(compose)
+
+        stats = clean_old_composes.purge(self.trash_dir)
+
+        assert stats == clean_old_composes.PurgeStats()
+        exception.assert_called_once_with(f'Unable to delete {compose}')
+        assert os.listdir(self.trash_dir) == ['f23-updates-161004.1423']
+
+
+class TestThrottle:
+    """
+    This class contains tests for the Throttle class.
+    """
+
+    @patch('bodhi.server.tasks.clean_old_composes.time.sleep')
+    @patch('bodhi.server.tasks.clean_old_composes.time.monotonic', return_value=10.0)
+    def test_wait(self, monotonic, sleep):
+        """
+        Calls past the rate should be spread out.
+        """
+        throttle = clean_old_composes.Throttle(4)
+
+        for i in range(3):
+            throttle.wait()
+
+        assert sleep.mock_calls == [call(0.25), call(0.5)]
+
+    @patch('bodhi.server.tasks.clean_old_composes.time.sleep')
+    def test_no_limit(self, sleep):
+        """
+        A rate of 0 should never wait.
+        """
+        throttle = clean_old_composes.Throttle(0)
+
+        for i in range(3):
+            throttle.wait()
+
+        sleep.assert_not_called()
@@ -25,6 +25,7 @@ import json
 import os
 import shutil
 import tempfile
+import threading
 import time
 import urllib.parse as urlparse
 
@@ -67,6 +68,7 @@ from bodhi.server.tasks.composer import (
     checkpoint,
     ComposerHandler,
     ComposerThread,
+    ComposeScheduler,
     ContainerComposerThread,
     FlatpakComposerThread,
     ModuleComposerThread,
@@ -157,6 +159,107 @@ class TestCheckpoint:
         assert 'checkpointed functions may not return stuff' in str(exc.value)
 
 
+class TestComposeScheduler:
+    """Test the ComposeScheduler class."""
+
+    def setup_method(self, method):
+        self._history = ComposeScheduler._history.copy()
+        ComposeScheduler._history.clear()
+
+    def teardown_method(self, method):
+        ComposeScheduler._history.clear()
+        ComposeScheduler._history.update(self._history)
+
+    @staticmethod
+    def _compose(request='testing', security=False, content_type='rpm', update_count=1):
+        return {'request': request, 'security': security, 'content_type': content_type,
+                'release_id': 1, 'update_count': update_count}
+
+    def test_priority(self):
+        """Security composes go first, then stable ones, then the shortest."""
+        scheduler = ComposeScheduler(1)
+        big_testing = self._compose(update_count=50)
+        small_testing = self._compose(update_count=2)
+        stable = self._compose('stable', update_count=100)
+        security = self._compose(security=True, update_count=200)
+
+        composes = sorted([big_testing, small_testing, stable, security],
+                          key=scheduler.priority)
+
+        assert composes == [security, stable, small_testing, big_testing]
+
+    def test_estimate_uses_history(self):
+        """The estimate should follow the phase timings of previous composes."""
+        scheduler = ComposeScheduler(1)
+        rpm = self._compose(update_count=10)
+        module = self._compose(content_type='module', update_count=2)
+        # Without history, only the number of updates matters.
+        assert scheduler.estimate(rpm) == 10
+        assert scheduler.estimate(module) == 2
+
+        scheduler.record(self._compose(content_type='module', update_count=1),
+                         {'initializing': 5, 'punging': 95, 'syncing_repo': 1000})
+        scheduler.record(self._compose(update_count=10),
+                         {'initializing': 1, 'punging': 9, 'signing_repo': 1000})
+
+        # The time spent waiting on signatures and syncs does not count.
+        assert scheduler.estimate(module) == 200
+        assert scheduler.estimate(rpm) == 10
+        # Kinds of composes we have no history for fall back to the average.
+        assert scheduler.estimate(self._compose('stable', update_count=2)) == 101
+
+        scheduler.record(self._compose(update_count=10), {'punging': 110})
+
+        assert scheduler.estimate(rpm) == pytest.approx(40)
+
+    def test_acquire_in_priority_order(self):
+        """Waiting composes should get the free slot in priority order."""
+        scheduler = ComposeScheduler(1)
+        first = self._compose()
+        scheduler.acquire(first)
+        order = []
+
+        def run(compose, name):
+            scheduler.acquire(compose)
+            order.append(name)
+            scheduler.release(compose)
+
+        composes = [(self._compose(update_count=10), 'big testing'),
+                    (self._compose(update_count=1), 'small testing'),
+                    (self._compose('stable', update_count=10), 'stable')]
+        threads = [threading.Thread(target=run, args=c) for c in composes]
+        for thread in threads:
+            thread.start()
+        while len(scheduler._queue) < 3:
+            time.sleep(0.01)
+
+        scheduler.release(first)
+        for thread in threads:
+            thread.join()
+
+        assert order == ['stable', 'small testing', 'big testing']
+        assert scheduler._free == 1
+
+    def test_acquire_multiple_slots(self):
+        """Composes should not wait while there are free slots."""
+        scheduler = ComposeScheduler(2)
+
+        scheduler.acquire(self._compose())
+        scheduler.acquire(self._compose())
+
+        assert scheduler._free == 0
+        assert scheduler._queue == []
+
+    def test_release_too_many(self):
+        """Releasing a slot that was never acquired should raise a ValueError."""
+        scheduler = ComposeScheduler(1)
+
+        with pytest.raises(ValueError) as exc:
+            scheduler.release(self._compose())
+
+        assert str(exc.value) == 'Compose slot released too many times'
+
+
 @mock.patch('bodhi.server.push.initialize_db', mock.MagicMock())
 def _make_task(transactional_session_maker, extra_push_args=None):
     """
@@ -375,7 +478,8 @@ That was the actual one''' % compose_dir
             compose = Compose.from_dict(db, composes[0])
             assert composes == \
                 [{'content_type': compose.content_type.value, 'release_id': compose.release.id,
-                  'request': compose.request.value, 'security': compose.security}]
+                  'request': compose.request.value, 'security': compose.security,
+                  'update_count': 1}]
             assert compose.state == ComposeState.pending
 
     def test__get_composes_api_3(self):
@@ -605,6 +709,10 @@ That was the actual one''' % compose_dir
             ('f17-updates-candidate', 'f17-updates-testing', 'bodhi-2.0-1.fc17')
         assert self.koji.__moved__[1] == \
             ('f17-updates-candidate', 'f17-updates-testing', 'bodhi-2.0-2.fc17')
+        # The phase timings of the successful compose feed the scheduler's estimates.
+        compose, timings = self.semmock.record.call_args[0]
+        assert compose['update_count'] == 2
+        assert set(timings) == {'initializing', 'punging', 'notifying', 'cleaning'}
 
     @mock.patch(**mock_taskotron_results)
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread._sanity_check_repo')
@@ -1365,6 +1473,7 @@ That was the actual one'''
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread._wait_for_repo_signature')
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread._wait_for_sync')
     @mock.patch('bodhi.server.tasks.composer.time.sleep')
+    @mock.patch('bodhi.server.tasks.clean_old_composes.purge')
     def test_clean_old_composes_true(self, *args):
         """Test work() with clean_old_composes set to True."""
         config["clean_old_composes"] = True
@@ -1428,7 +1537,7 @@ That was the actual one'''
             'f23-updates-testing-161003.2217', 'f24-updates-161002.2331',
             'f24-updates-161003.1302', 'f24-updates-testing-161001.0424',
             'this_should_get_left_alone', 'f23-updates-should_be_untouched',
-            'f23-updates.repocache', 'f23-updates-testing-blank'}
+            'f23-updates.repocache', 'f23-updates-testing-blank', '.trash'}
         actual_dirs = set([
             d for d in os.listdir(compose_dir)
             if os.path.isdir(os.path.join(compose_dir, d))
@@ -1644,6 +1753,42 @@ testmodule:master:20172:2
             in str(exc.value)
         )
 
+    def test_generate_module_list_scales_with_builds(self):
+        """
+        Benchmark _generate_module_list() with a few hundred module builds in DevBuildsys.
+
+        Each build should be fetched from Koji only once, however many updates are composed.
+        """
+        release = self.create_release('27M')
+        user = self.db.query(User).first()
+        updates = []
+        for i in range(50):
+            package = Package(name=f'testmodule{i}', type=ContentType.module)
+            self.db.add(package)
+            builds = [ModuleBuild(nvr=f'testmodule{i}-master-2017{v:04d}.{v}',
+                                  release=release, signed=True, package=package)
+                      for v in range(6)]
+            self.db.add_all(builds)
+            # The update pushes an older version than the newest one in the release.
+            updates.append(Update(
+                builds=[builds[3]], user=user, status=UpdateStatus.testing,
+                request=UpdateRequest.stable, stable_karma=3, unstable_karma=-3,
+                notes='Useful details!', release=release, type=UpdateType.bugfix))
+        self.db.flush()
+        t = ModuleComposerThread(self.semmock, {}, 'puiterwijk', self.db_factory, self.tempdir)
+        t.compose = mock.MagicMock(release=release, updates=updates)
+        get_build = buildsys.DevBuildsys.getBuild
+
+        with mock.patch.object(buildsys.DevBuildsys, 'getBuild', autospec=True,
+                               side_effect=get_build) as getBuild:
+            module_defs = list(t._generate_module_list())
+
+        assert getBuild.call_count == 300
+        assert sorted(module_defs, key=lambda m: int(m['name'][10:])) == [
+            {'name': f'testmodule{i}', 'stream': 'master', 'version': '20170003',
+             'context': '3'}
+            for i in range(50)]
+
     @mock.patch(**mock_failed_taskotron_results)
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread._sanity_check_repo')
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread._stage_repo')
@@ -2718,8 +2863,9 @@ class TestComposerThread__perform_tag_actions(ComposerThreadBaseTestCase):
         t = ComposerThread(self.semmock, task['composes'][0],
                            'bowlofeggs', self.Session, self.tempdir)
         t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.add_tags_async.append([])
         t.move_tags_async.append(
-            ('f26-updates-candidate', 'f26-updates-testing', 'bodhi-2.3.2-1.fc26'))
+            [('f26-updates-candidate', 'f26-updates-testing', 'bodhi-2.3.2-1.fc26')])
 
         with pytest.raises(Exception) as exc:
             t._perform_tag_actions()
@@ -2732,6 +2878,26 @@ class TestComposerThread__perform_tag_actions(ComposerThreadBaseTestCase):
 
         self.assert_sems(0)
 
+    @mock.patch('bodhi.server.tasks.composer.buildsys.wait_for_tasks', return_value=[])
+    def test_waves_in_order(self, wait_for_tasks):
+        """Each wave should be sent and waited for before the next one."""
+        task = self._make_task()
+        t = ComposerThread(self.semmock, task['composes'][0],
+                           'bowlofeggs', self.Session, self.tempdir)
+        t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.add_tags_async = [[('f26-updates', 'pkga-1.0-1.fc26')], []]
+        t.move_tags_async = [
+            [('f26-updates-candidate', 'f26-updates-testing', 'pkgb-1.0-1.fc26')],
+            [('f26-updates-candidate', 'f26-updates-testing', 'pkgb-2.0-1.fc26')]]
+
+        t._perform_tag_actions()
+
+        assert wait_for_tasks.call_count == 2
+        assert buildsys.DevBuildsys.__added__ == [('f26-updates', 'pkga-1.0-1.fc26')]
+        assert buildsys.DevBuildsys.__moved__ == [
+            ('f26-updates-candidate', 'f26-updates-testing', 'pkgb-1.0-1.fc26'),
+            ('f26-updates-candidate', 'f26-updates-testing', 'pkgb-2.0-1.fc26')]
+
 
 class TestComposerThread_remove_pending_tags(ComposerThreadBaseTestCase):
     """This test class contains tests for the ComposerThread.remove_pending_tags() method."""
@@ -2843,9 +3009,69 @@ class TestComposerThread__determine_tag_actions(ComposerThreadBaseTestCase):
         assert len(t.compose.updates) == 0
         self.assert_sems(0)
 
+    def test_prefetch_build_tags_chunked(self):
+        """The build tags should be resolved with one multicall per chunk of builds."""
+        task = self._make_task()
+        t = ComposerThread(self.semmock, task['composes'][0],
+                           'bowlofeggs', self.Session, self.tempdir)
+        t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.db
+        t.skip_compose = False
+        koji = mock.MagicMock()
+        koji.multiCall.return_value = [[[{'name': 'f17-updates-candidate'}, {'name': 'f17'}]]]
+
+        with mock.patch('bodhi.server.tasks.composer.buildsys.get_session', return_value=koji):
+            with mock.patch.dict(config, {'koji_multicall_chunk_size': 1}):
+                t._determine_tag_actions()
+
+        koji.listTags.assert_called_once_with('bodhi-2.0-1.fc17')
+        assert koji.multiCall.call_count == 1
+        assert t._build_tags == {'bodhi-2.0-1.fc17': ['f17-updates-candidate', 'f17']}
+        assert t.move_tags_async == [
+            [('f17-updates-candidate', 'f17-updates-testing', 'bodhi-2.0-1.fc17')]]
+
+    @mock.patch('bodhi.server.models.buildsys.get_session')
+    def test_prefetch_build_tags_fault(self, get_session):
+        """Builds that Koji failed to list tags for should be looked up individually."""
+        get_session.return_value.listTags.return_value = [{'name': 'f17-updates-candidate'}]
+        get_session.return_value.multiCall.return_value = [
+            {'faultCode': 1000, 'faultString': 'Boom'}]
+        task = self._make_task()
+        t = ComposerThread(self.semmock, task['composes'][0],
+                           'bowlofeggs', self.Session, self.tempdir)
+        t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.db
+        t.skip_compose = True
+
+        t._determine_tag_actions()
+
+        # Once in the multicall, and once more on its own.
+        assert get_session.return_value.listTags.call_count == 2
+        assert t._build_tags == {'bodhi-2.0-1.fc17': ['f17-updates-candidate']}
+        assert t.add_tags_async == [[('f17-updates-testing', 'bodhi-2.0-1.fc17')]]
+
 
 class TestComposerThread_eject_from_compose(ComposerThreadBaseTestCase):
     """This test class contains tests for the ComposerThread.eject_from_compose() method."""
+    def test_uses_build_tags_snapshot(self):
+        """Builds known not to carry the pending tag should not be untagged."""
+        up = self.db.query(Update).one()
+        up.request = UpdateRequest.testing
+        self.db.commit()
+        task = self._make_task()
+        t = ComposerThread(self.semmock, task['composes'][0],
+                           'bowlofeggs', self.Session, self.tempdir)
+        t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.Session()
+        t.id = 'f17-updates-testing'
+        t._build_tags = {'bodhi-2.0-1.fc17': ['f17-updates-candidate']}
+        up = self.db.query(Update).one()
+
+        with mock_sends(update_schemas.UpdateEjectV1):
+            t.eject_from_compose(up, 'This update is unacceptable!')
+
+        assert buildsys.DevBuildsys.__untag__ == []
+
     def test_testing_request(self):
         """
         Assert correct behavior when the update's request is set to testing.
@@ -2990,6 +3216,22 @@ class TestComposerThread_save_state(ComposerThreadBaseTestCase):
         assert json.loads(compose.checkpoints) == {'cool': 'checkpoint'}
         t.db.commit.assert_called_once_with()
 
+    @mock.patch('bodhi.server.tasks.composer.time.monotonic', side_effect=[10, 25, 27])
+    def test_phase_timings(self, monotonic):
+        """Test that the time spent in each state is recorded."""
+        t = ComposerThread(self.semmock, self._make_task()['composes'][0],
+                           'bowlofeggs', self.Session, self.tempdir)
+        t._checkpoints = {}
+        t.compose = self.db.query(Compose).one()
+        t.db = self.db
+
+        t.save_state(ComposeState.initializing)
+        t.save_state(ComposeState.punging)
+        t.save_state()
+        t.save_state(ComposeState.notifying)
+
+        assert t.phase_timings == {'initializing': 15, 'punging': 2}
+
 
 class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
     """This test class contains tests for the PungiComposerThread._wait_for_sync() method."""
@@ -3668,13 +3910,17 @@ class TestPungiComposerThread__wait_for_repo_signature(ComposerThreadBaseTestCas
                        "/composepath/compose/Everything/x86_64/os/repodata/repomd.xml.asc, "
                        "/composepath/compose/Everything/aarch64/os/repodata/repomd.xml.asc, "
                        "/composepath/compose/Everything/source/tree/repodata/repomd.xml.asc"),
+             mock.call('Released compose slot while waiting'),
              mock.call('Waiting on %s',
                        "/composepath/compose/Everything/x86_64/os/repodata/repomd.xml.asc, "
                        "/composepath/compose/Everything/aarch64/os/repodata/repomd.xml.asc, "
                        "/composepath/compose/Everything/source/tree/repodata/repomd.xml.asc"),
              mock.call('Waiting on %s',
                        "/composepath/compose/Everything/aarch64/os/repodata/repomd.xml.asc"),
-             mock.call('All signatures were created')]
+             mock.call('All signatures were created'),
+             mock.call('Reacquired compose slot')]
+        # The compose slot is free for other composes while we wait.
+        self.assert_sems(1)
         assert exists.mock_calls == \
             [mock.call('/composepath/compose/Everything/x86_64/os/repodata/repomd.xml.asc'),
              mock.call('/composepath/compose/Everything/aarch64/os/repodata/repomd.xml.asc'),
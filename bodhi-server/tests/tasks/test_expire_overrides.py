@@ -95,3 +95,71 @@ class TestMain(BaseTaskTestCase):
         expire_overrides_main()
 
         log.exception.assert_called_once()
+
+
+@mock.patch('bodhi.server.tasks.expire_overrides.buildsys.MulticallExecutor')
+class TestChunks(BaseTaskTestCase):
+    """Test that overrides are expired in chunks."""
+
+    def setup_method(self, method):
+        """Make three overrides overdue."""
+        super().setup_method(method)
+        self.create_update(['python-nose-1.3.7-11.fc17', 'python-paste-deploy-1.5.2-8.fc17'])
+        self.db.flush()
+        for override in self.db.query(models.BuildrootOverride).all():
+            override.expiration_date = override.expiration_date - timedelta(days=500)
+        self.db.commit()
+
+    @mock.patch.dict('bodhi.server.tasks.expire_overrides.config',
+                     {'expire_overrides_chunk_size': 2})
+    def test_chunks(self, executor):
+        """Each chunk should be untagged with one multicall, and its messages sent."""
+        executor.return_value.run.side_effect = [[[None], [None]], [[None]]]
+
+        with fml_testing.mock_sends(*[api.Message] * 3):
+            expire_overrides_main()
+
+        assert executor.return_value.run.call_count == 2
+        assert executor.return_value.untagBuild.mock_calls == [
+            mock.call('f17-override', 'bodhi-2.0-1.fc17', strict=True),
+            mock.call('f17-override', 'python-nose-1.3.7-11.fc17', strict=True),
+            mock.call('f17-override', 'python-paste-deploy-1.5.2-8.fc17', strict=True)]
+        assert self.db.query(models.BuildrootOverride).filter(
+            models.BuildrootOverride.expired_date.is_(None)).count() == 0
+
+    @mock.patch('bodhi.server.tasks.expire_overrides.log')
+    def test_untag_fault(self, log, executor):
+        """Overrides Koji failed to untag should still be expired."""
+        executor.return_value.run.return_value = [
+            [None], {'faultCode': 1000, 'faultString': 'not tagged'}, [None]]
+
+        with fml_testing.mock_sends(*[api.Message] * 3):
+            expire_overrides_main()
+
+        log.error.assert_called_once_with(
+            'Unable to untag override python-nose-1.3.7-11.fc17: not tagged')
+        assert self.db.query(models.BuildrootOverride).filter(
+            models.BuildrootOverride.expired_date.is_(None)).count() == 0
+
+    @mock.patch.dict('bodhi.server.tasks.expire_overrides.config',
+                     {'expire_overrides_chunk_size': 2})
+    @mock.patch('bodhi.server.tasks.expire_overrides.log')
+    def test_resume(self, log, executor):
+        """A failed run should keep the chunks it expired, and the next run expire the rest."""
+        executor.return_value.run.side_effect = [[[None], [None]], IOError('oh no')]
+
+        with fml_testing.mock_sends(*[api.Message] * 2):
+            expire_overrides_main()
+
+        log.exception.assert_called_once_with("There was an error expiring overrides")
+        left = self.db.query(models.BuildrootOverride).filter(
+            models.BuildrootOverride.expired_date.is_(None)).all()
+        assert [o.build.nvr for o in left] == ['python-paste-deploy-1.5.2-8.fc17']
+
+        executor.return_value.run.side_effect = [[[None]]]
+        executor.return_value.untagBuild.reset_mock()
+        with fml_testing.mock_sends(api.Message):
+            expire_overrides_main()
+
+        executor.return_value.untagBuild.assert_called_once_with(
+            'f17-override', 'python-paste-deploy-1.5.2-8.fc17', strict=True)
@@ -0,0 +1,148 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+This module contains tests for the bodhi.server.tasks.fill_changelog module.
+"""
+
+from unittest.mock import patch
+
+import pytest
+
+from bodhi.server import models
+from bodhi.server.config import config
+from bodhi.server.exceptions import BodhiException, ExternalCallException
+from bodhi.server.tasks import fill_changelog_task
+from bodhi.server.tasks.fill_changelog import main
+
+from ..base import BasePyTestCase
+from .base import BaseTaskTestCase
+
+
+class TestTask(BasePyTestCase):
+    """Test the task in bodhi.server.tasks."""
+
+    @patch("bodhi.server.tasks.buildsys")
+    @patch("bodhi.server.tasks.initialize_db")
+    @patch("bodhi.server.tasks.config")
+    @patch("bodhi.server.tasks.fill_changelog.main")
+    def test_task(self, main_function, config_mock, init_db_mock, buildsys):
+        fill_changelog_task('foo')
+        config_mock.load_config.assert_called_with()
+        init_db_mock.assert_called_with(config_mock)
+        buildsys.setup_buildsystem.assert_called_with(config_mock)
+        main_function.assert_called_with('foo')
+
+
+@patch('bodhi.server.tasks.work_on_bugs_task')
+@patch('bodhi.server.models.RpmBuild.get_changelog')
+class TestMain(BaseTaskTestCase):
+    """This test class contains tests for the main() function."""
+
+    changelog = ('* Sat Aug  3 2013 Fedora Releng <rel-eng@lists.fedoraproject.org> - 2\n'
+                 '- Added a free money feature.\n- Fix rhbz#112233.')
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.update = self.db.query(models.Update).join(models.Build).filter(
+            models.Build.nvr == 'bodhi-2.0-1.fc17').one()
+        self.update.notes = "Automatic update for bodhi-2.0-1.fc17."
+        self.update.bugs = []
+        self.db.flush()
+
+    def test_changelog(self, get_changelog, work_on_bugs_task):
+        """The changelog and the bugs it closes should be added to the update."""
+        get_changelog.return_value = self.changelog
+
+        main(self.update.alias)
+
+        get_changelog.assert_called_once_with(lastupdate=True)
+        assert self.update.notes == f"""Automatic update for bodhi-2.0-1.fc17.
+
+##### **Changelog**
+
+```
+{self.changelog}
+```"""
+        assert [b.bug_id for b in self.update.bugs] == [112233]
+        work_on_bugs_task.delay.assert_called_once_with(self.update.alias, [112233])
+
+    @pytest.mark.parametrize('changelog', (None, ""))
+    def test_no_changelog(self, get_changelog, work_on_bugs_task, changelog):
+        """Without a changelog, the notes should be left alone."""
+        get_changelog.return_value = changelog
+
+        main(self.update.alias)
+
+        assert self.update.notes == "Automatic update for bodhi-2.0-1.fc17."
+        work_on_bugs_task.delay.assert_not_called()
+
+    def test_changelog_too_long(self, get_changelog, work_on_bugs_task):
+        """The changelog must be omitted if it's too long."""
+        get_changelog.return_value = 'a' * config.get('update_notes_maxlength')
+
+        main(self.update.alias)
+
+        assert self.update.notes == """Automatic update for bodhi-2.0-1.fc17.
+
+##### **Changelog**
+
+```
+[CHANGELOG OMITTED BECAUSE TOO LONG]
+```"""
+
+    @patch.dict(config, [('bz_exclude_rels', ['F17'])])
+    def test_bug_not_added_excluded_release(self, get_changelog, work_on_bugs_task):
+        """Assert that a bug is not added for excluded release."""
+        get_changelog.return_value = self.changelog
+
+        main(self.update.alias)
+
+        assert self.changelog in self.update.notes
+        assert len(self.update.bugs) == 0
+        work_on_bugs_task.delay.assert_not_called()
+
+    def test_notes_edited(self, get_changelog, work_on_bugs_task):
+        """Notes edited since the update was created should be left alone."""
+        get_changelog.return_value = self.changelog
+        self.update.notes = 'Better notes'
+        self.db.flush()
+
+        main(self.update.alias)
+
+        assert self.update.notes == 'Better notes'
+        assert len(self.update.bugs) == 0
+
+    @pytest.mark.parametrize('exception', (ValueError('Handled exception'), Exception('oops')))
+    @patch('bodhi.server.tasks.fill_changelog.log.warning')
+    def test_changelog_exception(self, warning, get_changelog, work_on_bugs_task, exception):
+        """Failing to read the changelog should raise ExternalCallException, to retry."""
+        get_changelog.side_effect = exception
+
+        with pytest.raises(ExternalCallException):
+            main(self.update.alias)
+
+        warning.assert_called_once_with(
+            f'Unable to get the changelog of bodhi-2.0-1.fc17: {exception}')
+        work_on_bugs_task.delay.assert_not_called()
+
+    def test_update_nonexistent(self, get_changelog, work_on_bugs_task):
+        """Assert BodhiException is raised if the update doesn't exist."""
+        with pytest.raises(BodhiException) as exc:
+            main('foo')
+
+        assert str(exc.value) == "Couldn't find alias foo in DB"
@@ -59,3 +59,21 @@ class TestMain(BaseTaskTestCase):
         handle_srtags_main(builds, update.release.pending_signing_tag, None, None,
                            update.release.candidate_tag)
         assert "There was an error handling side-tags updates" in caplog.messages
+
+    @patch('bodhi.server.tasks.handle_side_and_related_tags.report_failures')
+    @patch('bodhi.server.tasks.handle_side_and_related_tags.buildsys.tag_builds')
+    def test_tag_batches(self, tag_builds, report_failures):
+        """Every build should be tagged in every tag in batches, and failures reported."""
+        u = self.db.query(models.Update).first()
+        tag_builds.return_value = [('f17-updates-candidate', 'bodhi-2.0-1.fc17', 'oh no')]
+
+        handle_srtags_main(['bodhi-2.0-1.fc17', 'python-nose-1.3.7-11.fc17'],
+                           u.release.pending_signing_tag, 'f17-build-side-1234',
+                           None, u.release.candidate_tag)
+
+        tag_builds.assert_called_once_with([
+            ('f17-updates-signing-pending', 'bodhi-2.0-1.fc17'),
+            ('f17-updates-candidate', 'bodhi-2.0-1.fc17'),
+            ('f17-updates-signing-pending', 'python-nose-1.3.7-11.fc17'),
+            ('f17-updates-candidate', 'python-nose-1.3.7-11.fc17')])
+        report_failures.assert_called_once_with(tag_builds.return_value)
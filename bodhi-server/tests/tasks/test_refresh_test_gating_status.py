@@ -0,0 +1,77 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+This module contains tests for the bodhi.server.tasks.refresh_test_gating_status module.
+"""
+
+from datetime import datetime
+from unittest.mock import patch
+
+from bodhi.server import models
+from bodhi.server.tasks import refresh_test_gating_status_task
+from bodhi.server.tasks.refresh_test_gating_status import main
+
+from ..base import BasePyTestCase
+from .base import BaseTaskTestCase
+
+
+class TestTask(BasePyTestCase):
+    """Test the task in bodhi.server.tasks."""
+
+    @patch("bodhi.server.tasks.buildsys")
+    @patch("bodhi.server.tasks.initialize_db")
+    @patch("bodhi.server.tasks.config")
+    @patch("bodhi.server.tasks.refresh_test_gating_status.main")
+    def test_task(self, main_function, config_mock, init_db_mock, buildsys):
+        refresh_test_gating_status_task('FEDORA-2017-a3bbe1a8f2')
+        config_mock.load_config.assert_called_with()
+        init_db_mock.assert_called_with(config_mock)
+        buildsys.setup_buildsystem.assert_called_with(config_mock)
+        main_function.assert_called_with('FEDORA-2017-a3bbe1a8f2')
+
+
+class TestMain(BaseTaskTestCase):
+    """This test class contains tests for the main() function."""
+
+    @patch('bodhi.server.models.Update.update_test_gating_status')
+    def test_refresh(self, update_test_gating_status):
+        """A flagged update should be refreshed, and its flag cleared."""
+        update = models.Update.query.first()
+        update.test_gating_dirty_since = datetime.utcnow()
+        self.db.flush()
+
+        main(update.alias)
+
+        update_test_gating_status.assert_called_once_with()
+        assert update.test_gating_dirty_since is None
+
+    @patch('bodhi.server.models.Update.update_test_gating_status')
+    def test_already_refreshed(self, update_test_gating_status):
+        """An update that is not flagged anymore should not be refreshed again."""
+        update = models.Update.query.first()
+
+        main(update.alias)
+
+        update_test_gating_status.assert_not_called()
+
+    @patch('bodhi.server.tasks.refresh_test_gating_status.log.warning')
+    def test_missing_update(self, warning):
+        """A missing update should be logged."""
+        main('FEDORA-2000-abcdef')
+
+        warning.assert_called_once_with("Couldn't find update FEDORA-2000-abcdef in DB")
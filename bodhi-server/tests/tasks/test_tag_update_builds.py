@@ -1,5 +1,7 @@
 from unittest.mock import patch, MagicMock
 
+from fedora_messaging import testing as fml_testing
+
 from bodhi.server import buildsys, models
 from bodhi.server.tasks import tag_update_builds_task
 from bodhi.server.tasks.tag_update_builds import main as tag_update_builds_main
@@ -55,3 +57,35 @@ class TestMain(BaseTaskTestCase):
             tag_update_builds_main("f17-signing-pending", update.builds)
 
         assert "There was an error handling tagging builds in koji." in caplog.messages
+
+    @patch('bodhi.server.tasks.tag_update_builds.buildsys.tag_builds')
+    def test_failures_commented(self, tag_builds):
+        """Builds that could not be tagged should be listed in a comment on their update."""
+        update = self.db.query(models.Update).first()
+        tag_builds.return_value = [('f17-updates-signing-pending', 'bodhi-2.0-1.fc17', 'oh no'),
+                                   ('f17-updates-signing-pending', 'unknown-1-1.fc17', 'oh no')]
+
+        # Comments from the bodhi system user are not announced on the bus
+        with fml_testing.mock_sends():
+            tag_update_builds_main('f17-updates-signing-pending',
+                                   ['bodhi-2.0-1.fc17', 'unknown-1-1.fc17'])
+
+        tag_builds.assert_called_once_with([
+            ('f17-updates-signing-pending', 'bodhi-2.0-1.fc17'),
+            ('f17-updates-signing-pending', 'unknown-1-1.fc17')])
+        comment = update.comments[-1]
+        assert comment.user.name == 'bodhi'
+        assert comment.text == (
+            'Bodhi was unable to tag these builds in Koji, please retry or ask Release '
+            'Engineering for help:\n\n- bodhi-2.0-1.fc17 in f17-updates-signing-pending: oh no')
+
+    @patch('bodhi.server.tasks.tag_update_builds.buildsys.tag_builds', return_value=[])
+    def test_no_failures(self, tag_builds):
+        """No comment should be added if all the builds were tagged."""
+        update = self.db.query(models.Update).first()
+        comments = len(update.comments)
+
+        with fml_testing.mock_sends():
+            tag_update_builds_main('f17-updates-signing-pending', ['bodhi-2.0-1.fc17'])
+
+        assert len(update.comments) == comments
@@ -0,0 +1,165 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This module contains tests for the bodhi.server.tasks.untag_branched module."""
+
+from datetime import datetime, timedelta
+from unittest import mock
+
+from bodhi.server import models
+from bodhi.server.tasks import untag_branched, untag_branched_task
+from ..base import BasePyTestCase
+from .base import BaseTaskTestCase
+
+
+class TestTask(BasePyTestCase):
+    """Test the task in bodhi.server.tasks."""
+
+    @mock.patch("bodhi.server.tasks.bugs")
+    @mock.patch("bodhi.server.tasks.buildsys")
+    @mock.patch("bodhi.server.tasks.initialize_db")
+    @mock.patch("bodhi.server.tasks.config")
+    @mock.patch("bodhi.server.tasks.untag_branched.main")
+    def test_task(self, main_function, config_mock, init_db_mock, buildsys, bugs):
+        untag_branched_task(dry_run=True)
+        config_mock.load_config.assert_called_with()
+        init_db_mock.assert_called_with(config_mock)
+        buildsys.setup_buildsystem.assert_called_with(config_mock)
+        bugs.set_bugtracker.assert_called_with()
+        main_function.assert_called_with(dry_run=True)
+
+
+@mock.patch('bodhi.server.tasks.untag_branched.log')
+@mock.patch('bodhi.server.tasks.untag_branched.buildsys.MulticallExecutor')
+class TestMain(BaseTaskTestCase):
+    """Test the main() function."""
+
+    def setup_method(self, method):
+        """Make the update of bodhi-2.0-1.fc17 a stable update of a pending release."""
+        super().setup_method(method)
+        release = models.Release.query.filter_by(name='F17').one()
+        release.state = models.ReleaseState.pending
+        update = models.Update.query.filter_by(release=release).first()
+        update.date_stable = datetime.utcnow() - timedelta(days=2)
+        update.status = models.UpdateStatus.stable
+        self.db.commit()
+
+    def _tags(self, executor, *results):
+        """Make the executor return the given listTags results, then the untag results."""
+        executor.return_value.run.side_effect = list(results) + [[[None]] * 3]
+
+    def test_stale_tags_removed(self, executor, log):
+        """The testing and pending tags should be removed from stable builds."""
+        self._tags(executor, [[[{'name': 'f17-updates-testing'}, {'name': 'f17'},
+                                {'name': 'f17-updates-testing-pending'}]]])
+
+        untags = untag_branched.main()
+
+        assert untags == [('f17-updates-testing', 'bodhi-2.0-1.fc17'),
+                          ('f17-updates-testing-pending', 'bodhi-2.0-1.fc17')]
+        executor.return_value.listTags.assert_called_once_with('bodhi-2.0-1.fc17')
+        assert executor.return_value.untagBuild.mock_calls == [
+            mock.call('f17-updates-testing', 'bodhi-2.0-1.fc17'),
+            mock.call('f17-updates-testing-pending', 'bodhi-2.0-1.fc17')]
+        assert executor.return_value.run.call_count == 2
+        log.info.assert_any_call('Removing f17-updates-testing from bodhi-2.0-1.fc17')
+        log.info.assert_called_with('Removed 2 tags from 1 builds')
+
+    def test_pending_signing_tag_present(self, executor, log):
+        """The pending_signing tag should be removed if it is present."""
+        self._tags(executor, [[[{'name': 'f17-updates-signing-pending'}, {'name': 'f17'}]]])
+
+        untag_branched.main()
+
+        executor.return_value.untagBuild.assert_called_once_with(
+            'f17-updates-signing-pending', 'bodhi-2.0-1.fc17')
+        assert log.error.call_count == 0
+
+    def test_dry_run(self, executor, log):
+        """Nothing should be untagged in a dry run."""
+        self._tags(executor, [[[{'name': 'f17-updates-testing'}, {'name': 'f17'}]]])
+
+        untags = untag_branched.main(dry_run=True)
+
+        assert untags == [('f17-updates-testing', 'bodhi-2.0-1.fc17')]
+        executor.return_value.untagBuild.assert_not_called()
+        assert executor.return_value.run.call_count == 1
+        log.info.assert_any_call('Would remove f17-updates-testing from bodhi-2.0-1.fc17')
+        log.info.assert_called_with('Would remove 1 tags from 1 builds')
+
+    def test_no_tags_to_remove(self, executor, log):
+        """Nothing should be untagged if only the stable tag is present."""
+        self._tags(executor, [[[{'name': 'f17'}]]])
+
+        assert untag_branched.main() == []
+
+        executor.return_value.untagBuild.assert_not_called()
+        assert log.error.call_count == 0
+
+    def test_stable_tag_missing(self, executor, log):
+        """An error should be logged if the stable tag is not on a stable build."""
+        self._tags(executor, [[[{'name': 'f17-updates-testing'},
+                                {'name': 'f17-updates-signing-pending'},
+                                {'name': 'f17-updates-testing-pending'}]]])
+
+        assert untag_branched.main() == []
+
+        executor.return_value.untagBuild.assert_not_called()
+        log.error.assert_called_once_with(
+            ("bodhi-2.0-1.fc17 not tagged as stable ['f17-updates-testing', "
+             "'f17-updates-signing-pending', 'f17-updates-testing-pending']"))
+
+    def test_list_tags_fault(self, executor, log):
+        """Builds whose tags can't be listed should be skipped."""
+        self._tags(executor, [{'faultCode': 1000, 'faultString': 'oh no'}])
+
+        assert untag_branched.main() == []
+
+        executor.return_value.untagBuild.assert_not_called()
+        log.warning.assert_called_once_with('Unable to list the tags of bodhi-2.0-1.fc17: oh no')
+
+    def test_untag_fault(self, executor, log):
+        """Tags Koji failed to remove should be logged."""
+        executor.return_value.run.side_effect = [
+            [[[{'name': 'f17-updates-testing'}, {'name': 'f17'}]]],
+            [{'faultCode': 1000, 'faultString': 'oh no'}]]
+
+        untag_branched.main()
+
+        log.warning.assert_called_once_with(
+            'Unable to remove f17-updates-testing from bodhi-2.0-1.fc17: oh no')
+
+    def test_update_too_new(self, executor, log):
+        """The tags of updates that went stable less than a day ago should stay."""
+        update = models.Update.query.filter_by(status=models.UpdateStatus.stable).one()
+        update.date_stable = datetime.utcnow()
+        self.db.commit()
+
+        assert untag_branched.main() == []
+
+        executor.assert_not_called()
+        log.info.assert_called_once_with('No stable builds of branched releases to check')
+
+    def test_progress(self, executor, log):
+        """The progress of the multicalls should be logged."""
+        self._tags(executor, [[[{'name': 'f17'}]]])
+
+        untag_branched.main()
+
+        progress = executor.return_value.run.call_args[1]['progress']
+        progress(1, 2)
+        log.info.assert_called_with('Listed the tags of 1/2 builds')
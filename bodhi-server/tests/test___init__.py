@@ -22,7 +22,7 @@ import collections
 from pyramid import testing
 
 from bodhi import server
-from bodhi.server import models
+from bodhi.server import cache, models
 from bodhi.server.config import config
 from bodhi.server.views import generic
 
@@ -69,16 +69,13 @@ class TestGetBuildinfo:
 
 class TestGetCacheregion:
     """Test get_cacheregion()."""
-    @mock.patch.dict('bodhi.server.bodhi_config', {'some': 'config'}, clear=True)
-    @mock.patch('bodhi.server.make_region')
-    def test_get_cacheregion(self, make_region):
-        """Test get_cacheregion."""
+    def test_get_cacheregion(self):
+        """get_cacheregion() should return the same default region for every request."""
         # The argument (request) doesn't get used, so we'll just pass None.
         region = server.get_cacheregion(None)
 
-        make_region.assert_called_once_with()
-        assert region is make_region.return_value
-        region.configure_from_config.assert_called_once_with({'some': 'config'}, 'dogpile.cache.')
+        assert region is cache.get_region()
+        assert server.get_cacheregion(None) is region
 
 
 class TestGetKoji:
@@ -23,6 +23,8 @@ import os
 
 import koji
 import pytest
+import requests.exceptions
+import urllib3.exceptions
 
 from bodhi.server import buildsys
 
@@ -294,6 +296,192 @@ class TestSetupBuildsystem:
                       {'buildsystem': 'Something unsupported'})
 
 
+class TestMulticallExecutor:
+    """Test the MulticallExecutor class."""
+
+    def setup_method(self, method):
+        buildsys.setup_buildsystem({'buildsystem': 'dev'})
+
+    def teardown_method(self, method):
+        buildsys.teardown_buildsystem()
+
+    def test_chunks_keep_call_order(self):
+        """Results should be returned in the order the calls were queued, across chunks."""
+        executor = buildsys.MulticallExecutor(chunk_size=2, workers=3)
+        nvrs = ['bodhi-2.0-1.fc17', 'TurboGears-1.0.2.2-2.fc17', 'python-3.0-1.fc17',
+                'gcc-12.0-1.fc17', 'kernel-6.0-1.fc17']
+        for nvr in nvrs:
+            executor.getBuild(nvr)
+
+        results = executor.run()
+
+        assert [r[0]['nvr'] for r in results] == nvrs
+        # The queue is emptied.
+        assert executor.run() == []
+
+    @pytest.mark.parametrize('workers', (1, 3))
+    def test_progress(self, workers):
+        """The progress callback should be called once per chunk."""
+        executor = buildsys.MulticallExecutor(chunk_size=2, workers=workers)
+        for i in range(5):
+            executor.getBuild(f'bodhi-2.0-{i}.fc17')
+        progress = mock.MagicMock()
+
+        executor.run(progress=progress)
+
+        assert progress.call_count == 3
+        assert progress.call_args_list[-1] == mock.call(5, 5)
+
+    def test_sessions_are_pooled(self):
+        """No more sessions than workers should be created."""
+        session_factory = mock.MagicMock(side_effect=buildsys.DevBuildsys)
+        executor = buildsys.MulticallExecutor(chunk_size=1, workers=2,
+                                              session_factory=session_factory)
+        for i in range(10):
+            executor.tagBuild('f17-updates', f'bodhi-2.0-{i}.fc17', force=True)
+
+        results = executor.run()
+
+        assert results == [[None]] * 10
+        assert session_factory.call_count <= 2
+        assert sorted(buildsys.DevBuildsys.__added__) == sorted(
+            [('f17-updates', f'bodhi-2.0-{i}.fc17') for i in range(10)])
+
+    @mock.patch('bodhi.server.buildsys.log.exception')
+    def test_failed_chunk_retried_one_by_one(self, exception):
+        """A chunk whose multicall fails should have its calls retried individually."""
+        session = mock.MagicMock()
+        session.multiCall.side_effect = koji.GenericError('timed out')
+        session.getBuild.side_effect = [
+            None, None,  # Queued in the multicall.
+            {'nvr': 'a-1-1.fc17'}, koji.GenericError('No such build')]
+        executor = buildsys.MulticallExecutor(session_factory=lambda: session)
+        executor.getBuild('a-1-1.fc17')
+        executor.getBuild('b-1-1.fc17')
+
+        results = executor.run()
+
+        exception.assert_called_once_with(
+            'Koji multicall of %d calls failed, retrying them one by one', 2)
+        assert results == [[{'nvr': 'a-1-1.fc17'}],
+                           {'faultCode': 1000, 'faultString': 'No such build'}]
+
+    @mock.patch('bodhi.server.buildsys.log.exception')
+    def test_failed_chunk_already_applied(self, exception):
+        """Faults saying a change was already made should count as successes when retried."""
+        session = mock.MagicMock()
+        session.multiCall.side_effect = requests.exceptions.ReadTimeout('timed out')
+        session.tagBuild.side_effect = [
+            None, None,  # Queued in the multicall.
+            koji.GenericError('build a-1-1.fc17 already tagged (f17-updates)'),
+            koji.GenericError('build b-1-1.fc17 is locked'),
+        ]
+        session.untagBuild.side_effect = [
+            None, koji.GenericError('build a-1-1.fc17 not in tag f17-updates-testing')]
+        executor = buildsys.MulticallExecutor(session_factory=lambda: session)
+        executor.tagBuild('f17-updates', 'a-1-1.fc17')
+        executor.tagBuild('f17-updates', 'b-1-1.fc17')
+        executor.untagBuild('f17-updates-testing', 'a-1-1.fc17')
+
+        results = executor.run()
+
+        assert results == [[None],
+                           {'faultCode': 1000, 'faultString': 'build b-1-1.fc17 is locked'},
+                           [None]]
+
+    @pytest.mark.parametrize('error', [
+        requests.exceptions.ConnectTimeout('too slow'),
+        requests.exceptions.ConnectionError(
+            urllib3.exceptions.MaxRetryError(
+                None, '/kojihub',
+                urllib3.exceptions.NewConnectionError(None, 'Connection refused'))),
+    ])
+    @mock.patch('bodhi.server.buildsys.log.exception')
+    def test_failed_chunk_not_sent(self, exception, error):
+        """Calls that never reached Koji should be sent again as they are."""
+        session = mock.MagicMock()
+        session.multiCall.side_effect = error
+        session.tagBuild.side_effect = [
+            None,  # Queued in the multicall.
+            koji.GenericError('build a-1-1.fc17 already tagged (f17-updates)')]
+        executor = buildsys.MulticallExecutor(session_factory=lambda: session)
+        executor.tagBuild('f17-updates', 'a-1-1.fc17')
+
+        results = executor.run()
+
+        assert results == [{'faultCode': 1000,
+                            'faultString': 'build a-1-1.fc17 already tagged (f17-updates)'}]
+
+    def test_private_attributes(self):
+        """Private attribute lookups should not be turned into queued calls."""
+        executor = buildsys.MulticallExecutor()
+
+        with pytest.raises(AttributeError):
+            executor._missing
+
+    def test_defaults_from_config(self):
+        """The chunk size and workers should default to the configured values."""
+        with mock.patch.dict('bodhi.server.buildsys.config',
+                             {'koji_multicall_chunk_size': 42, 'koji_multicall_workers': 3}):
+            executor = buildsys.MulticallExecutor()
+
+        assert executor.chunk_size == 42
+        assert executor.workers == 3
+
+
+@mock.patch('bodhi.server.buildsys.time.sleep')
+@mock.patch('bodhi.server.buildsys.MulticallExecutor')
+class TestTagBuilds:
+    """Test the tag_builds() function."""
+
+    def test_all_tagged(self, executor, sleep):
+        """All the builds should be tagged in one run of the executor."""
+        executor.return_value.run.return_value = [[None], [None]]
+
+        failures = buildsys.tag_builds([('f17-updates', 'a-1-1.fc17'),
+                                        ('f17-updates', 'b-1-1.fc17')])
+
+        assert failures == []
+        assert executor.return_value.tagBuild.mock_calls == [
+            mock.call('f17-updates', 'a-1-1.fc17'), mock.call('f17-updates', 'b-1-1.fc17')]
+        sleep.assert_not_called()
+
+    def test_failed_calls_retried(self, executor, sleep):
+        """Only the failed calls should be retried, with a growing delay."""
+        fault = {'faultCode': 1000, 'faultString': 'oh no'}
+        executor.return_value.run.side_effect = [[[None], fault], [fault], [[None]]]
+
+        failures = buildsys.tag_builds([('f17-updates', 'a-1-1.fc17'),
+                                        ('f17-updates', 'b-1-1.fc17')],
+                                       retries=2, retry_delay=3)
+
+        assert failures == []
+        assert executor.return_value.tagBuild.mock_calls[2:] == [
+            mock.call('f17-updates', 'b-1-1.fc17'), mock.call('f17-updates', 'b-1-1.fc17')]
+        assert sleep.mock_calls == [mock.call(3), mock.call(6)]
+
+    def test_still_failing(self, executor, sleep):
+        """The calls that fail after the last retry should be returned."""
+        executor.return_value.run.return_value = [{'faultCode': 1000, 'faultString': 'oh no'}]
+
+        with mock.patch.dict('bodhi.server.buildsys.config',
+                             {'koji_tag_retries': 1, 'koji_tag_retry_delay': 5.0}):
+            failures = buildsys.tag_builds([('f17-updates', 'a-1-1.fc17')])
+
+        assert failures == [('f17-updates', 'a-1-1.fc17', 'oh no')]
+        assert executor.return_value.run.call_count == 2
+        sleep.assert_called_once_with(5.0)
+
+    def test_already_tagged(self, executor, sleep):
+        """Builds that are already in the tag should count as tagged."""
+        executor.return_value.run.return_value = [
+            {'faultCode': 1000,
+             'faultString': 'build a-1-1.fc17 already tagged (f17-updates)'}]
+
+        assert buildsys.tag_builds([('f17-updates', 'a-1-1.fc17')]) == []
+        sleep.assert_not_called()
+
+
 @mock.patch('bodhi.server.buildsys.log.debug')
 class TestWaitForTasks:
     """Test the wait_for_tasks() function."""
@@ -317,6 +505,19 @@ class TestWaitForTasks:
         assert sleep.mock_calls == [mock.call(0.01), mock.call(0.01)]
         assert session.getTaskInfo.mock_calls == [mock.call(1), mock.call(2), mock.call(3)]
 
+    @mock.patch('bodhi.server.buildsys.time.sleep')
+    def test_adaptive_polling(self, sleep, debug):
+        """The polling interval should double while a task is running, up to sleep."""
+        session = mock.MagicMock()
+        session.taskFinished.side_effect = [False, False, False, False, True, False, True]
+        session.getTaskInfo.return_value = {'state': koji.TASK_STATES['CLOSED']}
+
+        ret = buildsys.wait_for_tasks([1, 2], session, sleep=5, min_sleep=2)
+
+        assert ret == []
+        assert sleep.mock_calls == [mock.call(2), mock.call(4), mock.call(5), mock.call(5),
+                                    mock.call(2)]
+
     def test_with_failed_task(self, debug):
         """Assert that we return a list of failed_tasks."""
         tasks = [1, 2, 3]
@@ -0,0 +1,184 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This module contains tests for bodhi.server.cache."""
+
+from unittest import mock
+
+from dogpile.cache.api import NO_VALUE, CacheBackend
+import pytest
+
+from bodhi.server import cache
+
+
+SETTINGS = {
+    'dogpile.cache.backend': 'dogpile.cache.memory',
+    'dogpile.cache.expiration_time': '100',
+    'dogpile.cache.regions': ['avatars'],
+    'dogpile.cache.avatars.backend': 'dogpile.cache.memory',
+    'dogpile.cache.avatars.expiration_time': '86400',
+    'dogpile.cache.avatars.local_lru_size': '2',
+    'dogpile.cache.avatars.local_expiration_time': '30',
+}
+
+
+class TestConfigure:
+    """Test the configure() and get_region() functions."""
+
+    def test_regions(self):
+        """Each configured region should get its own settings."""
+        cache.configure(SETTINGS)
+
+        assert cache.get_region().expiration_time == 100
+        assert cache.get_region('avatars').expiration_time == 86400
+        assert cache.get_region('avatars') is not cache.get_region()
+        assert cache._proxy(cache.get_region(), cache.LocalLRUProxy) is None
+        lru = cache._proxy(cache.get_region('avatars'), cache.LocalLRUProxy)
+        assert (lru.size, lru.expiration_time) == (2, 30)
+
+    def test_unknown_region(self):
+        """Regions that are not configured should get the default region."""
+        cache.configure(SETTINGS)
+
+        assert cache.get_region('nope') is cache.get_region()
+
+    def test_configured_once(self):
+        """The regions should be created once and then shared."""
+        cache.configure(SETTINGS)
+        region = cache.get_region()
+
+        cache.configure({'dogpile.cache.backend': 'dogpile.cache.null'})
+
+        assert cache.get_region() is region
+
+    @mock.patch.dict('bodhi.server.cache.config',
+                     {'dogpile.cache.backend': 'dogpile.cache.memory',
+                      'dogpile.cache.expiration_time': 5})
+    def test_lazy(self):
+        """The regions should be created from Bodhi's settings on first use."""
+        assert cache.get_region().expiration_time == 5
+
+
+class TestMetrics:
+    """Test the hit and miss metrics."""
+
+    @mock.patch('bodhi.server.cache.cache_lookups')
+    def test_hits_and_misses(self, cache_lookups):
+        """Lookups should be counted by region and result."""
+        cache.configure(SETTINGS)
+        region = cache.get_region()
+
+        region.get('foo')
+        region.set('foo', 'bar')
+        region.get('foo')
+        region.get_multi(['foo', 'baz'])
+
+        assert cache.stats() == {'default': {'hits': 2, 'misses': 2},
+                                 'avatars': {'hits': 0, 'misses': 0}}
+        cache_lookups.labels.assert_any_call(region='default', result='hit')
+        cache_lookups.labels.assert_any_call(region='default', result='miss')
+
+
+class TestLocalLRUProxy:
+    """Test the LocalLRUProxy class."""
+
+    def setup_method(self, method):
+        """Set up a LocalLRUProxy in front of a mock backend."""
+        self.backend = mock.MagicMock(spec=CacheBackend)
+        self.backend.get.return_value = NO_VALUE
+        self.lru = cache.LocalLRUProxy(2, 30).wrap(self.backend)
+
+    def test_hit_in_memory(self):
+        """Values set or read recently should be served from memory."""
+        self.backend.get.return_value = 'b'
+
+        assert self.lru.get('b') == 'b'
+        self.lru.set('a', 'a')
+        assert self.lru.get('a') == 'a'
+        assert self.lru.get('b') == 'b'
+
+        self.backend.get.assert_called_once_with('b')
+        self.backend.set.assert_called_once_with('a', 'a')
+
+    def test_misses_not_kept(self):
+        """Misses should not be kept in memory."""
+        assert self.lru.get('a') is NO_VALUE
+        assert self.lru.get('a') is NO_VALUE
+
+        assert self.backend.get.call_count == 2
+
+    def test_eviction(self):
+        """The least recently used value should be evicted when the LRU is full."""
+        self.lru.set_multi({'a': 1, 'b': 2})
+        self.lru.get('a')
+        self.lru.set('c', 3)
+
+        assert list(self.lru._values) == ['a', 'c']
+
+    @mock.patch('bodhi.server.cache.time.monotonic')
+    def test_expiration(self, monotonic):
+        """Values should not be kept in memory longer than the expiration time."""
+        monotonic.return_value = 100
+        self.lru.set('a', 1)
+        self.backend.get.return_value = 2
+
+        monotonic.return_value = 131
+        assert self.lru.get('a') == 2
+
+    def test_delete(self):
+        """Deleted keys should be dropped from memory too."""
+        self.lru.set_multi({'a': 1, 'b': 2})
+
+        self.lru.delete('a')
+        self.lru.delete_multi(['b'])
+
+        assert self.lru.get('a') is NO_VALUE
+        assert self.lru.get('b') is NO_VALUE
+        self.backend.delete.assert_called_once_with('a')
+        self.backend.delete_multi.assert_called_once_with(['b'])
+
+
+class TestInvalidate:
+    """Test the invalidate() function."""
+
+    def test_invalidate_region(self):
+        """Invalidating a region should only affect this region, and its local copies."""
+        cache.configure(SETTINGS)
+        cache.get_region().set('foo', 'bar')
+        cache.get_region('avatars').set('foo', 'bar')
+
+        assert cache.invalidate('avatars') == ['avatars']
+
+        assert cache._proxy(cache.get_region('avatars'), cache.LocalLRUProxy)._values == {}
+        assert cache.get_region().get('foo') == 'bar'
+        assert cache.get_region('avatars').get('foo') is NO_VALUE
+
+    def test_invalidate_all(self):
+        """All regions should be invalidated if no name is given."""
+        cache.configure(SETTINGS)
+        cache.get_region().set('foo', 'bar')
+
+        assert cache.invalidate() == ['default', 'avatars']
+
+        assert cache.get_region().get('foo') is NO_VALUE
+
+    def test_unknown_region(self):
+        """Invalidating an unknown region should raise a KeyError."""
+        cache.configure(SETTINGS)
+
+        with pytest.raises(KeyError):
+            cache.invalidate('nope')
@@ -0,0 +1,251 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This module contains tests for bodhi.server.http_client."""
+
+from unittest import mock
+import threading
+
+import pytest
+import requests
+
+from bodhi.server import http_client
+from bodhi.server.config import config
+
+
+@pytest.fixture
+def transport():
+    """Answer all outbound requests with a FakeTransport during the test."""
+    fake = http_client.FakeTransport()
+    http_client.install_fake_transport(fake)
+    yield fake
+    http_client.install_fake_transport(None)
+
+
+class TestCircuitBreaker:
+    """Test the CircuitBreaker class."""
+
+    @mock.patch('bodhi.server.http_client.time.monotonic', return_value=100)
+    def test_opens_after_failures(self, monotonic):
+        """The circuit should open after the configured number of consecutive failures."""
+        breaker = http_client.CircuitBreaker('greenwave', 2, 30)
+
+        breaker.record(False)
+        breaker.check()
+        breaker.record(False)
+
+        with pytest.raises(http_client.CircuitOpenError) as exc:
+            breaker.check()
+        assert str(exc.value) == 'Not contacting greenwave, it failed 2 times in a row'
+
+    @mock.patch('bodhi.server.http_client.time.monotonic', return_value=100)
+    def test_success_resets_count(self, monotonic):
+        """A success should reset the count of consecutive failures."""
+        breaker = http_client.CircuitBreaker('greenwave', 2, 30)
+
+        breaker.record(False)
+        breaker.record(True)
+        breaker.record(False)
+
+        breaker.check()
+
+    @mock.patch('bodhi.server.http_client.time.monotonic')
+    def test_half_open(self, monotonic):
+        """After the reset timeout one request is let through, and its outcome decides."""
+        breaker = http_client.CircuitBreaker('greenwave', 1, 30)
+        monotonic.return_value = 100
+        breaker.record(False)
+
+        monotonic.return_value = 131
+        breaker.check()
+        # Only one request is let through until its outcome is recorded.
+        with pytest.raises(http_client.CircuitOpenError):
+            breaker.check()
+        breaker.record(False)
+        with pytest.raises(http_client.CircuitOpenError):
+            breaker.check()
+
+        monotonic.return_value = 162
+        breaker.check()
+        breaker.record(True)
+        monotonic.return_value = 163
+        breaker.check()
+
+    @mock.patch('bodhi.server.http_client.time.monotonic', return_value=131)
+    def test_half_open_concurrent(self, monotonic):
+        """Only one of the concurrent requests should be let through when half-open."""
+        breaker = http_client.CircuitBreaker('greenwave', 1, 30)
+        with mock.patch('bodhi.server.http_client.time.monotonic', return_value=100):
+            breaker.record(False)
+        barrier = threading.Barrier(8)
+        outcomes = []
+
+        def request():
+            barrier.wait()
+            try:
+                breaker.check()
+            except http_client.CircuitOpenError:
+                outcomes.append('refused')
+            else:
+                outcomes.append('sent')
+
+        threads = [threading.Thread(target=request) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(outcomes) == ['refused'] * 7 + ['sent']
+
+        breaker.record(True)
+        breaker.check()
+
+    def test_disabled(self):
+        """Setting failures to 0 should disable the circuit breaker."""
+        breaker = http_client.CircuitBreaker('greenwave', 0, 30)
+
+        for i in range(10):
+            breaker.record(False)
+
+        breaker.check()
+
+
+class TestFakeTransport:
+    """Test the FakeTransport class."""
+
+    def test_responses_in_turn(self, transport):
+        """Responses should be returned in turn, and the last one repeated."""
+        transport.add('get', 'https://example.com/a', status=500)
+        transport.add('get', 'https://example.com/a', json={'ok': True})
+        session = http_client.get_client('example').session
+
+        assert session.get('https://example.com/a').status_code == 500
+        for i in range(2):
+            response = session.get('https://example.com/a')
+            assert response.status_code == 200
+            assert response.json() == {'ok': True}
+        assert [r.url for r in transport.requests] == ['https://example.com/a'] * 3
+
+    def test_unregistered(self, transport):
+        """Unregistered requests should get a 404."""
+        response = http_client.get_client('example').session.post('https://example.com/b')
+
+        assert response.status_code == 404
+
+    def test_exception(self, transport):
+        """A registered exception should be raised."""
+        transport.add('GET', 'https://example.com/a',
+                      exception=requests.exceptions.ConnectTimeout('too slow'))
+
+        with pytest.raises(requests.exceptions.ConnectTimeout):
+            http_client.get_client('example').session.get('https://example.com/a')
+
+
+class TestServiceAdapter:
+    """Test the ServiceAdapter class."""
+
+    @mock.patch('bodhi.server.http_client.outbound_http_request')
+    def test_metrics(self, histogram, transport):
+        """Each request should be timed, labelled by service, method and status."""
+        transport.add('GET', 'https://example.com/a', status=503)
+        transport.add('GET', 'https://example.com/b', exception=requests.exceptions.Timeout())
+        session = http_client.get_client('example').session
+
+        session.get('https://example.com/a')
+        with pytest.raises(requests.exceptions.Timeout):
+            session.get('https://example.com/b')
+
+        assert histogram.labels.mock_calls[0] == mock.call(
+            service='example', method='GET', status='503')
+        assert histogram.labels.mock_calls[2] == mock.call(
+            service='example', method='GET', status='error')
+
+    @mock.patch.dict(config, {'http.circuit_breaker_failures': 2})
+    def test_server_errors_open_circuit(self, transport):
+        """Server errors should open the circuit, and refused requests should not be sent."""
+        transport.add('GET', 'https://example.com/a', status=502)
+        session = http_client.get_client('example').session
+
+        session.get('https://example.com/a')
+        session.get('https://example.com/a')
+        with pytest.raises(http_client.CircuitOpenError):
+            session.get('https://example.com/a')
+
+        assert len(transport.requests) == 2
+
+    @mock.patch.dict(config, {'http.circuit_breaker_failures': 1})
+    def test_client_errors_keep_circuit_closed(self, transport):
+        """Client errors are not the service's fault, so they should not open the circuit."""
+        session = http_client.get_client('example').session
+
+        for i in range(3):
+            assert session.get('https://example.com/missing').status_code == 404
+
+
+class TestServiceClient:
+    """Test the ServiceClient class."""
+
+    def test_defaults(self):
+        """Services without overrides should use the global settings."""
+        client = http_client.get_client('greenwave')
+
+        assert client.timeout == config['http.timeout']
+        assert client.pool_size == config['http.pool_size']
+
+    @mock.patch.dict(config, {'http.timeouts': {'wiki': '5'}, 'http.pool_sizes': {'wiki': '2'}})
+    def test_overrides(self):
+        """Per service settings should override the global ones."""
+        client = http_client.get_client('Wiki')
+
+        assert client.timeout == 5
+        assert client.pool_size == 2
+        assert http_client.get_client('wiki') is client
+
+    @mock.patch.dict(config, {'http.backoff_base': 1.0, 'http.backoff_max': 5.0})
+    @mock.patch('bodhi.server.http_client.random.uniform', return_value=0.5)
+    def test_backoff(self, uniform):
+        """The backoff cap should grow exponentially up to http.backoff_max."""
+        client = http_client.get_client('greenwave')
+
+        assert [client.backoff(a) for a in range(4)] == [0.5] * 4
+        assert uniform.mock_calls == [
+            mock.call(0, 1.0), mock.call(0, 2.0), mock.call(0, 4.0), mock.call(0, 5.0)]
+
+    def test_reset(self):
+        """reset() should make get_client() build new clients."""
+        client = http_client.get_client('greenwave')
+
+        http_client.reset()
+
+        assert http_client.get_client('greenwave') is not client
+
+
+class TestMediaWiki:
+    """Test the MediaWiki class."""
+
+    def test_session_mounted(self):
+        """The session of the MediaWiki client should go through the wiki adapter."""
+        wiki = http_client.MediaWiki.__new__(http_client.MediaWiki)
+        wiki._session = None
+        wiki._user_agent = 'bodhi'
+
+        with mock.patch('mediawiki.MediaWiki._reset_session',
+                        lambda self: setattr(self, '_session', requests.Session())):
+            wiki._reset_session()
+
+        assert wiki._session.get_adapter('https://fedoraproject.org/w/api.php') is \
+            http_client.get_client('wiki').adapter
@@ -0,0 +1,116 @@
+# Copyright © 2024 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This module contains tests for bodhi.server.memo."""
+
+from unittest import mock
+
+from bodhi.server import memo
+
+
+class Thing(object):
+    """A class with a memoized property that counts how often it is computed."""
+
+    def __init__(self):
+        """Initialize the Thing."""
+        self.computed = 0
+
+    @memo.memoized_property
+    def answer(self):
+        """Return the answer."""
+        self.computed += 1
+        return 42
+
+
+class TestMemoizedProperty:
+    """Test the memoized_property class."""
+
+    def test_no_scope(self):
+        """The property should be computed on every access outside of a scope."""
+        thing = Thing()
+
+        assert (thing.answer, thing.answer) == (42, 42)
+
+        assert thing.computed == 2
+
+    @mock.patch('bodhi.server.memo.memoized_property_lookups')
+    def test_scope(self, lookups):
+        """The property should be computed once per scope and per instance."""
+        thing, other = Thing(), Thing()
+
+        with memo.scope() as scope:
+            assert (thing.answer, thing.answer, other.answer) == (42, 42, 42)
+
+        with memo.scope():
+            thing.answer
+
+        assert (thing.computed, other.computed) == (2, 1)
+        assert scope.lookups == {'answer': {'hits': 1, 'misses': 2}}
+        lookups.labels.assert_any_call(property='answer', result='hit')
+        lookups.labels.assert_any_call(property='answer', result='miss')
+
+    def test_invalidate(self):
+        """Invalidating the scope should compute the property again."""
+        thing = Thing()
+
+        with memo.scope():
+            thing.answer
+            memo.invalidate('any', 'event', key='arguments')
+            thing.answer
+
+        assert thing.computed == 2
+
+    def test_invalidated_while_computing(self):
+        """A value should not be kept if the scope was invalidated while computing it."""
+        class Changing(Thing):
+            @memo.memoized_property
+            def answer(self):
+                self.computed += 1
+                memo.invalidate()
+                return 42
+
+        thing = Changing()
+
+        with memo.scope():
+            thing.answer
+            thing.answer
+
+        assert thing.computed == 2
+
+    def test_class_access(self):
+        """Looking the property up on the class should return the property itself."""
+        assert isinstance(Thing.answer, memo.memoized_property)
+        assert Thing.answer.__doc__ == 'Return the answer.'
+
+
+class TestScope:
+    """Test the scope() function."""
+
+    def test_nested(self):
+        """Scopes should be restored when they end."""
+        assert memo.current_scope() is None
+
+        with memo.scope() as outer:
+            with memo.scope() as inner:
+                assert memo.current_scope() is inner
+            assert memo.current_scope() is outer
+
+        assert memo.current_scope() is None
+
+    def test_invalidate_without_scope(self):
+        """Invalidating without a scope should do nothing."""
+        memo.invalidate()
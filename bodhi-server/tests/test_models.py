@@ -36,7 +36,7 @@ import requests.exceptions
 
 from bodhi.messages.schemas import errata as errata_schemas
 from bodhi.messages.schemas import update as update_schemas
-from bodhi.server import buildsys, mail
+from bodhi.server import buildsys, mail, memo
 from bodhi.server import models as model
 from bodhi.server import Session, util
 from bodhi.server.config import config
@@ -705,6 +705,35 @@ class TestCompose(BasePyTestCase):
         assert not compose_2 > compose_1
         assert sorted([compose_1, compose_2]) == [compose_2, compose_1]
 
+    def test___lt___smaller_prioritized(self):
+        """__lt__() should return True if self has fewer updates than other."""
+        compose_1 = self._generate_compose(model.UpdateRequest.testing, False)
+        compose_2 = self._generate_compose(model.UpdateRequest.testing, False)
+        update = self.create_update(['bodhi-{}-1.fc27'.format(uuid.uuid4())])
+        update.release = compose_2.release
+        update.request = model.UpdateRequest.testing
+        update.locked = True
+        self.db.flush()
+        self.db.refresh(compose_2)
+
+        assert compose_1 < compose_2
+        assert not compose_2 < compose_1
+        assert sorted([compose_2, compose_1]) == [compose_1, compose_2]
+
+    def test___lt___stable_prioritized_over_smaller(self):
+        """__lt__() should return False if other is stable and self is not, even if smaller."""
+        compose_1 = self._generate_compose(model.UpdateRequest.testing, False)
+        compose_2 = self._generate_compose(model.UpdateRequest.stable, False)
+        update = self.create_update(['bodhi-{}-1.fc27'.format(uuid.uuid4())])
+        update.release = compose_2.release
+        update.request = model.UpdateRequest.stable
+        update.locked = True
+        self.db.flush()
+        self.db.refresh(compose_2)
+
+        assert not compose_1 < compose_2
+        assert compose_2 < compose_1
+
     def test___str__(self):
         """Ensure __str__() returns the right string."""
         compose = self._generate_compose(model.UpdateRequest.stable, False)
@@ -1105,7 +1134,7 @@ class TestModulePackage(ModelTest):
         # This should not raise any Exception.
         self.db.flush()
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_get_pkg_committers_from_pagure_with_group(self, session):
         """
         Ensure that the package committers can be found using the Pagure
@@ -1163,7 +1192,7 @@ class TestModulePackage(ModelTest):
             timeout=60)
 
     @pytest.mark.parametrize('access', (False, True))
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_hascommitaccess_module(self, session, access):
         """
         Test call to Pagure to check if a user has access to this package/branch.
@@ -1194,7 +1223,7 @@ class TestContainerPackage(ModelTest):
     klass = model.ContainerPackage
     attrs = dict(name="docker-distribution")
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_get_pkg_committers_from_pagure(self, http_session):
         """Ensure correct return value from get_pkg_committers_from_pagure()."""
         json_output = {
@@ -1241,7 +1270,7 @@ class TestContainerPackage(ModelTest):
             timeout=60)
 
     @pytest.mark.parametrize('access', (False, True))
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_hascommitaccess_container(self, session, access):
         """
         Test call to Pagure to check if a user has access to this package/branch.
@@ -1307,7 +1336,7 @@ class TestFlatpakPackage(ModelTest):
         http_session.get.return_value.json.return_value = json_output
         http_session.get.return_value.status_code = 200
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_get_pkg_committers_from_pagure_modules(self, http_session):
         """Ensure correct return value from get_pkg_committers_from_pagure()."""
         self.patch_http_session(http_session, namespace='flatpaks')
@@ -1321,7 +1350,7 @@ class TestFlatpakPackage(ModelTest):
             timeout=60)
 
     @pytest.mark.parametrize('access', (False, True))
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_hascommitaccess_flatpak(self, http_session, access):
         """
         Test call to Pagure to check if a user has access to this package/branch.
@@ -1415,7 +1444,7 @@ class TestRpmPackage(ModelTest):
         # This should not raise any Exception.
         self.db.flush()
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_get_pkg_committers_from_pagure_with_group(self, session):
         """
         Ensure that the package committers can be found using the Pagure
@@ -1471,7 +1500,7 @@ class TestRpmPackage(ModelTest):
             'https://src.fedoraproject.org/pagure/api/0/rpms/the-greatest-package?expand_group=1',
             timeout=60)
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_get_pkg_committers_from_pagure_without_group(self, session):
         """
         Ensure that the package committers can be found using the Pagure
@@ -1516,7 +1545,7 @@ class TestRpmPackage(ModelTest):
 
         assert rv == (['mprahl'], ['factory2'])
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_get_pkg_committers_from_pagure_without_group_expansion(self, session):
         """
         Ensure that the package committers can be found using the Pagure
@@ -1561,7 +1590,7 @@ class TestRpmPackage(ModelTest):
         assert rv == (['mprahl'], ['factory2'])
 
     @pytest.mark.parametrize('access', (False, True))
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_hascommitaccess_container_rpm(self, session, access):
         """
         Test call to Pagure to check if a user has access to this package/branch.
@@ -2445,8 +2474,9 @@ class TestUpdateSigned(BasePyTestCase):
 class TestUpdateUpdateTestGatingStatus(BasePyTestCase):
     """Test the Update.update_test_gating_status() method."""
 
+    @mock.patch('bodhi.server.http_client.random.uniform', mock.Mock(return_value=1))
     @mock.patch('bodhi.server.models.log.error')
-    @mock.patch('bodhi.server.util.http_session.post')
+    @mock.patch('bodhi.server.http_client.requests.Session.post')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_500_response_from_greenwave(self, sleep, post, error):
         """A 500 response from Greenwave should result in marking the test results as ignored."""
@@ -2489,7 +2519,7 @@ class TestUpdateUpdateTestGatingStatus(BasePyTestCase):
                 'status code was "500".')) for i in range(2)])
 
     @mock.patch('bodhi.server.models.log.error')
-    @mock.patch('bodhi.server.util.http_session.post')
+    @mock.patch('bodhi.server.http_client.requests.Session.post')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_timeout_from_greenwave(self, sleep, post, error):
         """Similar to the 500 test above, a timeout should also result in marking tests ignored."""
@@ -2527,6 +2557,27 @@ class TestUpdateUpdateTestGatingStatus(BasePyTestCase):
         assert error.mock_calls == [mock.call('The connection timed out.')]
 
 
+class TestUpdateMarkTestGatingDirty(BasePyTestCase):
+    """Test the Update.mark_test_gating_dirty() method."""
+
+    def test_coalesces(self):
+        """Only the first call in a window should ask for a refresh."""
+        update = model.Update.query.first()
+
+        assert update.mark_test_gating_dirty(60)
+        assert update.test_gating_dirty_since is not None
+        assert not update.mark_test_gating_dirty(60)
+
+    def test_stale_flag(self):
+        """A flag older than twice the window should be set again."""
+        update = model.Update.query.first()
+        update.test_gating_dirty_since = datetime.utcnow() - timedelta(seconds=121)
+        self.db.flush()
+
+        assert update.mark_test_gating_dirty(60)
+        assert update.test_gating_dirty_since > datetime.utcnow() - timedelta(seconds=60)
+
+
 class TestUpdateValidateBuilds(BasePyTestCase):
     """Tests for the :class:`Update` validator for builds."""
 
@@ -2910,6 +2961,15 @@ class TestUpdate(ModelTest):
         warning.assert_called_once_with('Not adding builds of %s to empty tag',
                                         'TurboGears-1.0.8-3.fc11')
 
+    def test_add_tag_koji(self):
+        """add_tag() should queue its calls on the given koji client and return None."""
+        koji = mock.Mock()
+
+        result = self.obj.add_tag('f11-updates', koji=koji)
+
+        assert result is None
+        koji.tagBuild.assert_called_once_with('f11-updates', 'TurboGears-1.0.8-3.fc11', force=True)
+
     def test_autokarma_not_nullable(self):
         """Assert that the autokarma column does not allow NULL values.
 
@@ -3540,6 +3600,40 @@ class TestUpdate(ModelTest):
 
         assert self.obj.karma == -1
 
+    def test_karma_memoized(self):
+        """Karma should be computed once per scope, and again after a comment is inserted."""
+        with mock.patch.object(model.Update, '_composite_karma', new_callable=mock.PropertyMock,
+                               return_value=(1, 0)) as composite_karma:
+            with memo.scope():
+                assert (self.obj.karma, self.obj.karma) == (1, 1)
+                assert composite_karma.call_count == 1
+
+                # Insert the comment without going through the comments of the update.
+                composite_karma.return_value = (2, 0)
+                self.db.add(model.Comment(text='foo', karma=1, update_id=self.obj.id,
+                                          user=self.db.query(model.User).first()))
+                self.db.flush()
+
+                assert (self.obj.karma, self.obj.karma) == (2, 2)
+                assert composite_karma.call_count == 2
+
+    def test_memoized_properties_invalidated(self):
+        """Memoized properties should follow changes to the update and its related objects."""
+        self.obj.comment(self.db, "foo", -1, 'foo')
+        self.obj.date_testing = datetime.utcnow() - timedelta(days=2)
+        self.obj.release.pending_signing_tag = 'f11-updates-testing-signing'
+        self.obj.builds[0].signed = False
+        self.db.flush()
+
+        with memo.scope():
+            assert (self.obj.karma, self.obj.days_in_testing, self.obj.signed) == (-1, 2, False)
+
+            self.obj.comment(self.db, "foo", 1, 'foo')
+            self.obj.date_testing = datetime.utcnow() - timedelta(days=5)
+            self.obj.builds[0].signed = True
+
+            assert (self.obj.karma, self.obj.days_in_testing, self.obj.signed) == (1, 5, True)
+
     def test__composite_karma_ignores_comments_before_new_build(self):
         """Assert that _composite_karma ignores karma from before a new build karma reset event."""
         self.obj.comment(self.db, "foo", -1, 'foo')
@@ -3749,6 +3843,18 @@ class TestUpdate(ModelTest):
         warning.assert_called_once_with(
             'Not removing builds of %s from empty tag', self.obj.title)
 
+    def test_remove_tag_build_tags(self):
+        """remove_tag() should skip builds that build_tags shows are not tagged with the tag."""
+        koji = buildsys.get_session()
+        koji.multicall = True
+        nvr = self.obj.builds[0].nvr
+
+        self.obj.remove_tag('f17-updates-testing-pending', koji=koji,
+                            build_tags={nvr: ['f17-updates-candidate']})
+
+        assert koji.multiCall() == []
+        assert buildsys.DevBuildsys.__untag__ == []
+
     def test_revoke_no_request(self):
         """revoke() should raise BodhiException on an Update with no request."""
         self.obj.request = None
@@ -4525,6 +4631,27 @@ class TestUpdate(ModelTest):
         assert not result
         assert "Failed retrieving requirements results" in reason
 
+    @mock.patch('bodhi.server.util.taskotron_results')
+    def test_check_requirements_shared_client(self, mock_taskotron_results):
+        '''Results should be cached by the given ResultsDB client'''
+        update = self.obj
+        update.requirements = 'rpmlint'
+        settings = {'resultsdb_api_url': ''}
+        mock_taskotron_results.return_value = [
+            {'testcase': {'name': 'rpmlint'}, 'data': {}, 'outcome': 'PASSED'}]
+        resultsdb = util.ResultsDBClient(settings)
+
+        for i in range(2):
+            result, reason = update.check_requirements(None, settings, resultsdb=resultsdb)
+
+            assert result
+            assert reason == 'All checks pass.'
+
+        # One query for the update, and one for each build, all made once.
+        assert mock_taskotron_results.call_count == 1 + len(update.builds)
+        assert sorted(c[1]['type'] for c in mock_taskotron_results.call_args_list) == \
+            ['bodhi_update'] + ['koji_build'] * len(update.builds)
+
     @mock.patch('bodhi.server.util.taskotron_results')
     def test_check_requirements_no_results(self, mock_taskotron_results):
         '''No results for a testcase means fail'''
@@ -4751,7 +4878,7 @@ class TestUpdate(ModelTest):
         assert str(exc.value) == "Can't waive test results on a locked update"
 
     @mock.patch('bodhi.server.util.greenwave_api_post')
-    @mock.patch('bodhi.server.util.http_session.post')
+    @mock.patch('bodhi.server.http_client.requests.Session.post')
     def test_can_waive_multiple_test_results_of_an_update(self, post, greenwave_api_post):
         """Multiple failed tests getting waived should cause multiple calls to waiverdb."""
         self.obj.status = UpdateStatus.testing
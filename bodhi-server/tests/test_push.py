@@ -24,11 +24,18 @@ from click.testing import CliRunner
 import click
 import pytest
 
-from bodhi.server import models, push
+from bodhi.server import buildsys, models, push
 
 from . import base
 
 
+def _mock_list_tags(*tags):
+    """Patch the dev buildsystem's listTags() to return the given tags, also in multicalls."""
+    return mock.patch.object(
+        buildsys.DevBuildsys, 'listTags',
+        buildsys.multicall_enabled(lambda self, build, *args, **kw: [{'name': t} for t in tags]))
+
+
 class TestFilterReleases(base.BasePyTestCase):
     """This test class contains tests for the _filter_releases() function."""
 
@@ -839,8 +846,7 @@ class TestPush(base.BasePyTestCase):
         with mock.patch('bodhi.server.push.transactional_session_maker',
                         return_value=base.TransactionalSessionMaker(self.Session)):
             # Note: this IS the signing-pending tag
-            with mock.patch('bodhi.server.buildsys.DevBuildsys.listTags',
-                            return_value=[{'name': 'f17-updates-signing-pending'}]):
+            with _mock_list_tags('f17-updates-signing-pending'):
                 with mock.patch('bodhi.server.push.compose_task') as compose_task:
                     result = cli.invoke(push.push, ['--username', 'bowlofeggs'], input='y')
                     compose_task.delay.assert_not_called()
@@ -1513,8 +1519,7 @@ class TestPush(base.BasePyTestCase):
         with mock.patch('bodhi.server.push.transactional_session_maker',
                         return_value=base.TransactionalSessionMaker(self.Session)):
             # Note: this IS the signing-pending tag
-            with mock.patch('bodhi.server.buildsys.DevBuildsys.listTags',
-                            return_value=[{'name': 'f17-updates-signing-pending'}]):
+            with _mock_list_tags('f17-updates-signing-pending'):
                 with mock.patch('bodhi.server.push.compose_task') as compose_task:
                     result = cli.invoke(push.push, ['--username', 'bowlofeggs'],
                                         input='y')
@@ -1555,8 +1560,7 @@ class TestPush(base.BasePyTestCase):
         with mock.patch('bodhi.server.push.transactional_session_maker',
                         return_value=base.TransactionalSessionMaker(self.Session)):
             # Note: this is NOT the signing-pending tag
-            with mock.patch('bodhi.server.buildsys.DevBuildsys.listTags',
-                            return_value=[{'name': 'f17-updates-testing'}]):
+            with _mock_list_tags('f17-updates-testing'):
                 with mock.patch('bodhi.server.push.compose_task') as compose_task:
                     result = cli.invoke(push.push, ['--username', 'bowlofeggs'],
                                         input='y')
@@ -1600,6 +1604,50 @@ class TetUpdateSigStatus(base.BasePyTestCase):
         """
         u = self.db.query(models.Update).first()
 
-        push.update_sig_status(u)
+        push.update_sig_status([u])
 
         assert gssapi_login.call_count == 0
+
+
+class TestUpdateSigStatusBatch(base.BasePyTestCase):
+    """Test that update_sig_status() refreshes all the builds in one batch."""
+
+    @mock.patch('bodhi.server.push.buildsys.MulticallExecutor')
+    def test_refresh(self, executor_class):
+        """Builds should be refreshed from one multicall run, and faults reported."""
+        executor = executor_class.return_value
+        updates = [self.db.query(models.Update).one(),
+                   self.create_update(['python-nose-1.3.7-11.fc17', 'gcc-12.0-1.fc17']),
+                   self.create_update(['kernel-6.0-1.fc17'])]
+        builds = [b for u in updates for b in u.builds]
+        for build in builds:
+            build.signed = False
+        builds[0].signed = True
+        executor.run.return_value = [
+            [[{'name': 'f17-updates-signing-pending'}]],
+            [[{'name': 'f17-updates-testing'}]],
+            {'faultCode': 1000, 'faultString': 'No such build'}]
+
+        with mock.patch('bodhi.server.push.click.echo') as echo:
+            push.update_sig_status(updates)
+            executor.run.assert_called_once()
+            executor.run.call_args[1]['progress'](1, 2)
+
+        assert executor.listTags.mock_calls == [mock.call(b.nvr) for b in builds[1:]]
+        assert echo.mock_calls[0] == mock.call(
+            f'Refreshing the signature status of {len(builds) - 1} builds')
+        assert mock.call(f'Build {builds[1].nvr} still unsigned') in echo.mock_calls
+        assert mock.call(f'Build {builds[2].nvr} was refreshed as signed') in echo.mock_calls
+        assert mock.call(f'Unable to get the tags of build {builds[3].nvr}: No such build',
+                         err=True) in echo.mock_calls
+        assert echo.mock_calls[-1] == mock.call('Checked 1 of 2 builds')
+        assert [b.signed for b in builds] == [True, False, True, False]
+
+    @mock.patch('bodhi.server.push.buildsys.MulticallExecutor')
+    def test_all_signed(self, executor_class):
+        """Koji should not be queried if all builds are signed."""
+        updates = self.db.query(models.Update).all()
+
+        push.update_sig_status(updates)
+
+        executor_class.assert_not_called()
@@ -20,9 +20,11 @@
 from unittest import mock
 
 from cornice import errors
+import munch
 from pyramid import testing
 
-from bodhi.server import security
+from bodhi.server import models, security
+from bodhi.server.config import config
 
 from . import base
 
@@ -199,6 +201,99 @@ class TestPackagerACLFactory(base.BasePyTestCase):
              (Allow, 'group:cool_guys', ALL_PERMISSIONS)] + [DENY_ALL])
 
 
+class TestIdentityCache:
+    """Test the IdentityCache class."""
+
+    @mock.patch('bodhi.server.security.time.monotonic')
+    def test_expiration(self, monotonic):
+        """Identities should be forgotten after authtkt.identity_cache_ttl seconds."""
+        cache = security.IdentityCache()
+        identity = munch.munchify({'name': 'guest'})
+        monotonic.return_value = 100
+
+        with mock.patch.dict(config, {'authtkt.identity_cache_ttl': 60}):
+            cache.set('ticket', identity)
+
+        monotonic.return_value = 160
+        assert cache.get('ticket') is identity
+        monotonic.return_value = 161
+        assert cache.get('ticket') is None
+
+    @mock.patch.dict(config, {'authtkt.identity_cache_ttl': 0})
+    def test_disabled(self):
+        """Nothing should be cached if the TTL is 0."""
+        cache = security.IdentityCache()
+
+        cache.set('ticket', munch.munchify({'name': 'guest'}))
+
+        assert cache.get('ticket') is None
+
+    def test_max_size(self):
+        """The cache should not grow past its maximum size."""
+        cache = security.IdentityCache(max_size=2)
+
+        for ticket in ('a', 'b', 'c'):
+            cache.set(ticket, munch.munchify({'name': ticket}))
+
+        assert cache.get('a') is None
+        assert cache.get('b') is None
+        assert cache.get('c').name == 'c'
+
+    def test_invalidate(self):
+        """All the identities of the given user should be forgotten."""
+        cache = security.IdentityCache()
+        for ticket, name in (('a', 'guest'), ('b', 'guest'), ('c', 'ralph')):
+            cache.set(ticket, munch.munchify({'name': name}))
+
+        cache.invalidate('guest')
+
+        assert cache.get('a') is None
+        assert cache.get('b') is None
+        assert cache.get('c').name == 'ralph'
+
+
+class TestLoadIdentity(base.BasePyTestCase):
+    """Test the load_identity() function."""
+
+    def test_load_identity(self):
+        """The identity should have the name, email, openid and groups of the user."""
+        request = testing.DummyRequest()
+        request.db = self.db
+        request.registry = self.registry
+        user = models.User.get('guest')
+        user.email = 'guest@example.com'
+        user.groups.append(models.Group.get('provenpackager'))
+        self.db.flush()
+
+        identity = security.load_identity(request, 'guest')
+
+        assert identity.name == 'guest'
+        assert identity.email == 'guest@example.com'
+        assert identity.openid == 'guest.id.fedoraproject.org'
+        assert identity.group_names == ['packager', 'provenpackager']
+        assert [g.name for g in identity.groups] == identity.group_names
+
+    def test_no_groups(self):
+        """Users without groups should get an empty list of groups."""
+        request = testing.DummyRequest()
+        request.db = self.db
+        request.registry = self.registry
+        self.db.add(models.User(name='lonely'))
+        self.db.flush()
+
+        identity = security.load_identity(request, 'lonely')
+
+        assert identity.groups == []
+        assert identity.group_names == []
+
+    def test_unknown_user(self):
+        """None should be returned for unknown users."""
+        request = testing.DummyRequest()
+        request.db = self.db
+
+        assert security.load_identity(request, 'nobody') is None
+
+
 class TestProtectedRequest:
     """Test the ProtectedRequest class."""
     def test___init__(self):
@@ -23,6 +23,7 @@ import os
 import shutil
 import subprocess
 import tempfile
+import threading
 
 from webob.multidict import MultiDict
 import bleach
@@ -31,7 +32,7 @@ import packaging
 import pkg_resources
 import pytest
 
-from bodhi.server import models, util
+from bodhi.server import http_client, models, util
 from bodhi.server.config import config
 from bodhi.server.exceptions import RepodataException
 from bodhi.server.models import ReleaseState, TestGatingStatus, Update
@@ -183,7 +184,7 @@ class TestBugLink:
 class TestCallAPI:
     """Test the call_api() function."""
 
-    @mock.patch('bodhi.server.util.http_session.get')
+    @mock.patch('bodhi.server.http_client.requests.Session.get')
     def test_retries_failure(self, get, sleep):
         """Assert correct operation of the retries argument when they never succeed."""
         class FakeResponse(object):
@@ -197,19 +198,22 @@ class TestCallAPI:
             def json(self):
                 return {'some': 'stuff'}
 
-        get.side_effect = [FakeResponse(503), FakeResponse(503)]
+        get.side_effect = [FakeResponse(503)] * 4
 
-        with pytest.raises(RuntimeError) as exc:
-            util.call_api('url', 'service_name', retries=1)
+        with mock.patch('bodhi.server.http_client.random.uniform', return_value=0.5) as uniform:
+            with pytest.raises(RuntimeError) as exc:
+                util.call_api('url', 'service_name', retries=3)
 
         assert str(exc.value) == \
             ('Bodhi failed to get a resource from '
              'service_name at the following URL "url". The '
              'status code was "503". The error was "{\'some\': \'stuff\'}".')
-        assert get.mock_calls == [mock.call('url', timeout=60), mock.call('url', timeout=60)]
-        sleep.assert_called_once_with(1)
+        assert get.mock_calls == [mock.call('url', timeout=60)] * 4
+        # The backoff is jittered and grows exponentially.
+        assert uniform.mock_calls == [mock.call(0, 1.0), mock.call(0, 2.0), mock.call(0, 4.0)]
+        assert sleep.mock_calls == [mock.call(0.5)] * 3
 
-    @mock.patch('bodhi.server.util.http_session.get')
+    @mock.patch('bodhi.server.http_client.requests.Session.get')
     def test_retries_success(self, get, sleep):
         """Assert correct operation of the retries argument when they succeed eventually."""
         class FakeResponse(object):
@@ -221,11 +225,24 @@ class TestCallAPI:
 
         get.side_effect = [FakeResponse(503), FakeResponse(200)]
 
-        res = util.call_api('url', 'service_name', retries=1)
+        with mock.patch('bodhi.server.http_client.random.uniform', return_value=0.5) as uniform:
+            res = util.call_api('url', 'service_name', retries=1)
 
         assert res == {'some': 'stuff'}
         assert get.mock_calls == [mock.call('url', timeout=60), mock.call('url', timeout=60)]
-        sleep.assert_called_once_with(1)
+        uniform.assert_called_once_with(0, 1.0)
+        sleep.assert_called_once_with(0.5)
+
+    @mock.patch.dict(config, {'http.timeouts': {'pagure': '5'}})
+    @mock.patch('bodhi.server.http_client.requests.Session.get')
+    def test_service_timeout(self, get, sleep):
+        """The timeout configured for the service should be used."""
+        get.return_value.status_code = 200
+        get.return_value.json.return_value = {'some': 'stuff'}
+
+        util.call_api('url', 'Pagure')
+
+        get.assert_called_once_with('url', timeout=5)
 
 
 class TestMemoized:
@@ -761,7 +778,66 @@ class TestUtils(base.BasePyTestCase):
         grouped = util.get_grouped_critpath_components('f35')
         assert grouped == {}
 
-    @mock.patch('bodhi.server.util.http_session')
+    def test_critpath_index_cached(self):
+        """The critpath index should be read once, and again only when the JSON file changes."""
+        with tempfile.TemporaryDirectory() as tempdir:
+            jsonfile = os.path.join(tempdir, 'f36.json')
+            with open(jsonfile, 'w', encoding='utf-8') as f36:
+                f36.write('{"rpm": {"core": ["TurboGears"]}}')
+            config.update({
+                'critpath.type': 'json',
+                'critpath.jsonpath': tempdir
+            })
+            index = util.get_critpath_index('f36')
+
+            with mock.patch('bodhi.server.util.read_critpath_json') as fakejson:
+                assert util.get_critpath_index('f36') is index
+                assert util.contains_critpath_component('f36', 'rpm', frozenset(['TurboGears']))
+            fakejson.assert_not_called()
+
+            with open(jsonfile, 'w', encoding='utf-8') as f36:
+                f36.write('{"rpm": {"core": ["kernel"]}}')
+            os.utime(jsonfile, ns=(0, 0))
+
+            assert util.get_critpath_index('f36') is not index
+            assert util.get_critpath_components('f36') == ['kernel']
+            assert not util.contains_critpath_component('f36', 'rpm', frozenset(['TurboGears']))
+
+    def test_critpath_index_lookups(self):
+        """The critpath index should keep the order of the JSON file when filtering."""
+        index = util.CritpathIndex({
+            'rpm': {'core': ['a', 'b', 'c'], 'apps': ['d', 'b']},
+            'module': {'core': ['m']},
+        })
+
+        assert index.component_groups['rpm']['b'] == ('core', 'apps')
+        assert index.components['module'] == frozenset(['m'])
+        assert index.grouped('rpm', frozenset(['d', 'b', 'x'])) == {
+            'core': ['b'], 'apps': ['d', 'b']}
+        assert index.grouped('rpm', frozenset(['x'])) == {}
+        assert index.grouped('flatpak') == {}
+        assert index.list('rpm') == ['a', 'b', 'c', 'd', 'b']
+        assert index.list('rpm', frozenset(['d', 'b'])) == ['b', 'd', 'b']
+        assert index.list('rpm', frozenset()) == []
+        assert index.contains('rpm', ['x', 'c'])
+        assert not index.contains('module', ['a'])
+
+    @mock.patch('bodhi.server.util.log')
+    def test_contains_critpath_component(self, mock_log):
+        """contains_critpath_component should use critpath_pkgs when not using JSON files."""
+        config.update({
+            'critpath.type': None,
+            'critpath_pkgs': ['kernel', 'glibc']
+        })
+
+        assert util.contains_critpath_component('f36', 'rpm', frozenset(['glibc', 'bash']))
+        assert not util.contains_critpath_component('f36', 'rpm', frozenset(['bash']))
+
+        config.update({'critpath.type': 'json'})
+        assert not util.contains_critpath_component('f34', 'rpm', frozenset(['glibc']))
+        mock_log.warning.assert_called_once_with('No JSON file found for collection f34')
+
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_pagure_api_get(self, session):
         """ Ensure that an API request to Pagure works as expected.
         """
@@ -801,7 +877,8 @@ class TestUtils(base.BasePyTestCase):
         rv = util.pagure_api_get('http://domain.local/api/0/rpms/python')
         assert rv == expected_json
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.random.uniform', mock.Mock(return_value=1))
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_pagure_api_get_non_500_error(self, sleep, session):
         """ Ensure that an API request to Pagure that raises an error that is
@@ -821,7 +898,8 @@ class TestUtils(base.BasePyTestCase):
         assert str(exc.value) == expected_error
         assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.random.uniform', mock.Mock(return_value=1))
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_pagure_api_get_500_error(self, sleep, session):
         """ Ensure that an API request to Pagure that triggers a 500 error
@@ -836,9 +914,10 @@ class TestUtils(base.BasePyTestCase):
             '"http://domain.local/api/0/rpms/python". The status code was '
             '"500".')
         assert str(exc.value) == expected_error
-        assert sleep.mock_calls, [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.random.uniform', mock.Mock(return_value=1))
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_pagure_api_get_non_500_error_no_json(self, sleep, session):
         """ Ensure that an API request to Pagure that raises an error that is
@@ -854,9 +933,9 @@ class TestUtils(base.BasePyTestCase):
             '"http://domain.local/api/0/rpms/python". The status code was '
             '"404". The error was "".')
         assert str(exc.value) == expected_error
-        assert sleep.mock_calls, [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_greenwave_api_post(self, session):
         """ Ensure that a POST request to Greenwave works as expected.
         """
@@ -877,7 +956,8 @@ class TestUtils(base.BasePyTestCase):
                                            data)
         assert decision == expected_json
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.random.uniform', mock.Mock(return_value=1))
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_greenwave_api_post_500_error(self, sleep, session):
         """ Ensure that a POST request to Greenwave that triggers a 500 error
@@ -899,7 +979,8 @@ class TestUtils(base.BasePyTestCase):
         assert str(exc.value) == expected_error
         assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.random.uniform', mock.Mock(return_value=1))
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_greenwave_api_post_non_500_error(self, sleep, session):
         """ Ensure that a POST request to Greenwave that raises an error that is
@@ -925,7 +1006,8 @@ class TestUtils(base.BasePyTestCase):
         assert str(exc.value) == expected_error
         assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.random.uniform', mock.Mock(return_value=1))
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_greenwave_api_post_non_500_error_no_json(self, sleep, session):
         """ Ensure that a POST request to Greenwave that raises an error that is
@@ -949,7 +1031,7 @@ class TestUtils(base.BasePyTestCase):
         assert str(exc.value) == expected_error
         assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
 
-    @mock.patch('bodhi.server.util.http_session')
+    @mock.patch('bodhi.server.http_client.ServiceClient.session')
     def test_waiverdb_api_post(self, session):
         """ Ensure that a POST request to WaiverDB works as expected.
         """
@@ -1114,6 +1196,37 @@ class TestUtils(base.BasePyTestCase):
         # This ordering is because u1 doesn't overlap with anything
         assert async_ == [u1]
 
+    def test_tagging_waves_general(self):
+        """Updates should be ranked by the chains of versions of their packages."""
+        u1 = self.create_update(['bodhi-1.0-1.fc24', 'somepkg-2.0-3.fc24'])
+        u2 = self.create_update(['somepkg-1.0-3.fc24'])
+        u3 = self.create_update(['pkga-1.0-3.fc24'])
+        u4 = self.create_update(['pkgb-1.0-3.fc24'])
+        u5 = self.create_update(['pkgc-1.0-3.fc24', 'pkgd-1.0-3.fc24'])
+        u6 = self.create_update(['pkgd-2.0-3.fc24'])
+        u7 = self.create_update(['pkgd-3.0-3.fc24'])
+
+        sync, waves = util.tagging_waves([u1, u2, u3, u4, u5, u6, u7])
+
+        assert sync == []
+        assert waves == [[u2, u3, u4, u5], [u1, u6], [u7]]
+
+    def test_tagging_waves_insanity(self):
+        """Updates that cannot be ordered should be tagged synchronously."""
+        u1 = self.create_update(['bodhi-1.0-1.fc24', 'somepkg-2.0-3.fc24'])
+        u2 = self.create_update(['pkga-1.0-3.fc24', 'pkgb-2.0-1.fc24'])  # Newer pkgb, thus >u3
+        u3 = self.create_update(['pkga-2.0-1.fc24', 'pkgb-1.0-3.fc24'])  # Newer pkga, thus >u2
+        u4 = self.create_update(['pkga-3.0-1.fc24'])  # Shares pkga with the conflicting updates
+
+        sync, waves = util.tagging_waves([u1, u2, u3, u4])
+
+        assert sync == [u2, u3, u4]
+        assert waves == [[u1]]
+
+    def test_tagging_waves_empty(self):
+        """No updates should give no waves."""
+        assert util.tagging_waves([]) == ([], [])
+
     def test_splitter(self):
         splitlist = util.splitter(["build-0.1", "build-0.2"])
         assert splitlist == ['build-0.1', 'build-0.2']
@@ -1124,7 +1237,7 @@ class TestUtils(base.BasePyTestCase):
         splitspacestring = util.splitter("build-0.1 build-0.2")
         assert splitspacestring == ['build-0.1', 'build-0.2']
 
-    @mock.patch('bodhi.server.util.requests.get')
+    @mock.patch('bodhi.server.http_client.requests.Session.get')
     @mock.patch('bodhi.server.util.log.exception')
     def test_taskotron_results_non_200(self, log_exception, mock_get):
         '''Query should stop when error is encountered'''
@@ -1139,7 +1252,19 @@ class TestUtils(base.BasePyTestCase):
         assert 'Problem talking to' in msg
         assert 'status code was %r' % mock_get.return_value.status_code in msg
 
-    @mock.patch('bodhi.server.util.requests.get')
+    @mock.patch('bodhi.server.http_client.requests.Session.get')
+    @mock.patch('bodhi.server.util.log.exception')
+    def test_taskotron_results_raise_errors(self, log_exception, mock_get):
+        '''Errors should be logged and raised if raise_errors is True'''
+        mock_get.return_value.status_code = 500
+        settings = {'resultsdb_api_url': ''}
+
+        with pytest.raises(IOError, match='status code was 500'):
+            list(util.taskotron_results(settings, raise_errors=True))
+
+        log_exception.assert_called_once()
+
+    @mock.patch('bodhi.server.http_client.requests.Session.get')
     def test_taskotron_results_paging(self, mock_get):
         '''Next pages should be retrieved'''
         mock_get.return_value.status_code = 200
@@ -1159,7 +1284,20 @@ class TestUtils(base.BasePyTestCase):
         assert mock_get.call_args[0][0] == 'url2'
         assert mock_get.call_args[1]['timeout'] == 60
 
-    @mock.patch('bodhi.server.util.requests.get')
+    def test_taskotron_results_session(self):
+        '''The given session should be used to get the pages'''
+        session = mock.MagicMock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.json.return_value = {'data': ['datum'], 'next': None}
+        settings = {'resultsdb_api_url': 'https://example.com'}
+
+        results = list(util.taskotron_results(settings, session=session, item='a'))
+
+        assert results == ['datum']
+        session.get.assert_called_once_with(
+            'https://example.com/api/v2.0/results/latest?item=a', timeout=60)
+
+    @mock.patch('bodhi.server.http_client.requests.Session.get')
     @mock.patch('bodhi.server.util.log.debug')
     def test_taskotron_results_max_queries(self, log_debug, mock_get):
         '''Only max_queries should be performed'''
@@ -1177,6 +1315,94 @@ class TestUtils(base.BasePyTestCase):
         assert 'Too many result pages, aborting at' in log_debug.call_args[0][0]
 
 
+class TestResultsDBClient:
+    """Test the ResultsDBClient class."""
+
+    @mock.patch('bodhi.server.util.taskotron_results')
+    def test_latest_results_batched(self, taskotron_results):
+        """Queries sharing type, since and testcases should be batched and split by item."""
+        def results(settings, session, **query):
+            items = query['item'].split(',')
+            for item in items:
+                yield {'testcase': {'name': 'rpmlint'}, 'data': {'item': [item]}}
+            if len(items) > 1:
+                yield {'testcase': {'name': 'rpmlint'}, 'data': {}}
+        taskotron_results.side_effect = results
+        client = util.ResultsDBClient({'resultsdb_api_url': ''}, workers=2)
+        client.batch_size = 2
+        queries = [('bodhi_update', 'FEDORA-2017-1', '2017-01-01', 'rpmlint'),
+                   ('koji_build', 'a-1-1.fc17', '2017-01-02', 'rpmlint'),
+                   ('koji_build', 'b-1-1.fc17', '2017-01-02', 'rpmlint'),
+                   ('koji_build', 'c-1-1.fc17', '2017-01-02', 'rpmlint')]
+
+        results = client.latest_results(queries)
+
+        assert results == [
+            [{'testcase': {'name': 'rpmlint'}, 'data': {'item': [q[1]]}}] for q in queries]
+        assert sorted((c[1]['item'], c[1].get('_distinct_on')) for c in
+                      taskotron_results.call_args_list) == [
+            ('FEDORA-2017-1', None), ('a-1-1.fc17,b-1-1.fc17', 'item'), ('c-1-1.fc17', None)]
+        adapter = http_client.get_client('resultsdb').adapter
+        for c in taskotron_results.call_args_list:
+            assert c[1]['raise_errors']
+            assert c[1]['session'].get_adapter('https://example.com') is adapter
+
+    def test_session_per_thread(self):
+        """Each thread should get its own session, mounted on the resultsdb adapter."""
+        client = util.ResultsDBClient({'resultsdb_api_url': ''})
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(client.session))
+        thread.start()
+        thread.join()
+
+        assert client.session is client.session
+        assert sessions[0] is not client.session
+        assert sessions[0].get_adapter('https://example.com') is \
+            client.session.get_adapter('https://example.com')
+
+    @mock.patch('bodhi.server.util.taskotron_results')
+    def test_latest_results_failed_query(self, taskotron_results):
+        """A failed query should be raised and not cached, unlike the successful ones."""
+        def results(settings, session, **query):
+            if query['item'] == 'b-1-1.fc17':
+                raise IOError('status code was 500')
+            yield {'testcase': {'name': 'rpmlint'}, 'data': {'item': [query['item']]}}
+        taskotron_results.side_effect = results
+        client = util.ResultsDBClient({'resultsdb_api_url': ''}, workers=2)
+        client.batch_size = 1
+        queries = [('koji_build', 'a-1-1.fc17', '2017-01-02', 'rpmlint'),
+                   ('koji_build', 'b-1-1.fc17', '2017-01-02', 'rpmlint')]
+
+        with pytest.raises(IOError, match='status code was 500'):
+            client.latest_results(queries)
+
+        taskotron_results.reset_mock()
+        taskotron_results.side_effect = None
+        taskotron_results.return_value = [{'testcase': {'name': 'rpmlint'}, 'data': {}}]
+
+        results = client.latest_results(queries)
+
+        assert results == [
+            [{'testcase': {'name': 'rpmlint'}, 'data': {'item': ['a-1-1.fc17']}}],
+            [{'testcase': {'name': 'rpmlint'}, 'data': {}}]]
+        # Only the failed query is sent again.
+        assert [c[1]['item'] for c in taskotron_results.call_args_list] == ['b-1-1.fc17']
+
+    @mock.patch('bodhi.server.util.taskotron_results')
+    def test_latest_results_cached(self, taskotron_results):
+        """Results should only be queried once per (type, item, since, testcases)."""
+        taskotron_results.return_value = [{'testcase': {'name': 'rpmlint'}, 'data': {}}]
+        client = util.ResultsDBClient({'resultsdb_api_url': ''})
+        query = ('koji_build', 'a-1-1.fc17', '2017-01-02', 'rpmlint')
+
+        assert client.latest_results([query, query]) == [taskotron_results.return_value] * 2
+        assert client.latest_results([query]) == [taskotron_results.return_value]
+        # Another since is another query.
+        client.latest_results([query[:2] + ('2017-01-03', 'rpmlint')])
+
+        assert taskotron_results.call_count == 2
+
+
 class TestCMDFunctions:
     @mock.patch('bodhi.server.log.debug')
     @mock.patch('bodhi.server.log.error')
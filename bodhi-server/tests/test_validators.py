@@ -22,6 +22,7 @@ from datetime import date, datetime, timedelta
 from cornice.errors import Errors
 from fedora_messaging import api, testing as fml_testing
 import koji
+import munch
 from pyramid import exceptions
 import pytest
 
@@ -64,7 +65,7 @@ class TestValidateCSRFToken(BasePyTestCase):
 
 class TestGetValidRequirements:
     """Test the _get_valid_requirements() function."""
-    @mock.patch('bodhi.server.util.requests.get')
+    @mock.patch('bodhi.server.http_client.requests.Session.get')
     def test__get_valid_requirements(self, get):
         """Test normal operation."""
         get.return_value.status_code = 200
@@ -185,6 +186,40 @@ class TestValidateQAAcls(BasePyTestCase):
     'bodhi.server.validators.config',
     {'pagure_url': 'http://domain.local', 'admin_packager_groups': ['provenpackager'],
      'mandatory_packager_groups': ['packager']})
+class TestCachedPagureCalls(BasePyTestCase):
+    """Test the _cached_pagure_calls() function."""
+
+    @mock.patch('bodhi.server.validators.pagure_acl_request')
+    def test_concurrent_misses(self, histogram):
+        """Calls that are not cached should all be made and timed, and exceptions returned."""
+        error = RuntimeError('oh no')
+        calls = {
+            'a': ('hascommit', lambda: True),
+            'b': ('hascommit', lambda: False),
+            'c': ('committers', mock.Mock(side_effect=error)),
+        }
+
+        results = validators._cached_pagure_calls(calls)
+
+        assert results == {'a': True, 'b': False, 'c': error}
+        assert histogram.labels.call_count == 3
+        histogram.labels.assert_any_call(call='committers')
+
+    def test_cached_not_called(self):
+        """Cached results should be returned without calling Pagure."""
+        validators._cached_pagure_calls({'a': ('hascommit', lambda: True),
+                                         'b': ('hascommit', lambda: False)})
+        call = mock.Mock()
+
+        with mock.patch('bodhi.server.validators.ThreadPoolExecutor') as executor:
+            results = validators._cached_pagure_calls({'a': ('hascommit', call),
+                                                       'b': ('hascommit', call)})
+
+        assert results == {'a': True, 'b': False}
+        call.assert_not_called()
+        executor.assert_not_called()
+
+
 class TestValidateAcls(BasePyTestCase):
     """ Test the validate_acls() function.
     """
@@ -284,6 +319,25 @@ class TestValidateAcls(BasePyTestCase):
         mock_access.assert_not_called()
         mock_gpcfp.assert_not_called()
 
+    @mock.patch('bodhi.server.validators.User.get')
+    @mock.patch('bodhi.server.models.Package.hascommitaccess',
+                return_value=False)
+    @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
+    def test_validate_acls_identity_groups(self, mock_access, get):
+        """ Test validate_acls uses the groups of an identity loaded by the
+        security policy instead of querying the user.
+        """
+        mock_request = self.get_mock_request()
+        mock_request.identity = munch.munchify(
+            {'name': 'guest', 'groups': [{'name': 'provenpackager'}],
+             'group_names': ['provenpackager']})
+
+        validators.validate_acls(mock_request)
+
+        assert not len(mock_request.errors)
+        get.assert_not_called()
+        mock_access.assert_not_called()
+
     @mock.patch('bodhi.server.models.Package.hascommitaccess',
                 return_value=False)
     @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
@@ -366,6 +420,67 @@ class TestValidateAcls(BasePyTestCase):
             'Unable to retrieve committers list from Pagure for bodhi.'
         )
 
+    @mock.patch('bodhi.server.models.Package.hascommitaccess',
+                return_value=True)
+    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+                return_value=(['guest'], []))
+    @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
+    def test_validate_acls_pagure_cached(self, mock_gpcfp, mock_access):
+        """Pagure's answers should be cached between requests."""
+        for i in range(2):
+            mock_request = self.get_mock_request()
+            validators.validate_acls(mock_request)
+            assert not len(mock_request.errors)
+            assert mock_request.buildinfo['bodhi-2.0-1.fc17']['people'] == ['guest']
+
+        mock_access.assert_called_once_with('guest', 'f17')
+        mock_gpcfp.assert_called_once_with()
+
+    @mock.patch('bodhi.server.models.Package.hascommitaccess',
+                return_value=False)
+    @mock.patch('bodhi.server.validators.time.time')
+    @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
+    def test_validate_acls_pagure_negative_ttl(self, time, mock_access):
+        """Refused access should be cached for pagure_acl_cache_negative_ttl seconds."""
+        for now in (1000, 1059, 1061):
+            time.return_value = now
+            mock_request = self.get_mock_request()
+            validators.validate_acls(mock_request)
+            assert mock_request.errors.status == 403
+
+        assert mock_access.call_count == 2
+
+    @mock.patch('bodhi.server.models.Package.hascommitaccess',
+                side_effect=[RuntimeError('some error'), True])
+    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+                return_value=(['guest'], []))
+    @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
+    def test_validate_acls_pagure_errors_not_cached(self, mock_gpcfp, mock_access):
+        """Errors should not be cached, so the next request asks Pagure again."""
+        mock_request = self.get_mock_request()
+        validators.validate_acls(mock_request)
+        assert mock_request.errors[0]['description'] == 'some error'
+
+        mock_request = self.get_mock_request()
+        validators.validate_acls(mock_request)
+        assert not len(mock_request.errors)
+        assert mock_access.call_count == 2
+
+    @mock.patch('bodhi.server.models.Package.hascommitaccess',
+                return_value=True)
+    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+                return_value=(['guest'], []))
+    @mock.patch.dict('bodhi.server.validators.config',
+                     {'acl_system': 'pagure', 'pagure_acl_cache_ttl': 0,
+                      'pagure_acl_cache_negative_ttl': 0})
+    def test_validate_acls_pagure_cache_disabled(self, mock_gpcfp, mock_access):
+        """Pagure should be asked every time if the cache is disabled."""
+        for i in range(2):
+            validators.validate_acls(self.get_mock_request())
+
+        assert mock_access.call_count == 2
+        assert mock_gpcfp.call_count == 2
+
     @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'dummy'})
     def test_validate_acls_dummy(self):
         """ Test validate_acls when the acl system is dummy.
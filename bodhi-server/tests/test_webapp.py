@@ -19,7 +19,7 @@
 
 from unittest import mock
 
-from bodhi.server import webapp
+from bodhi.server import memo, webapp
 
 
 class TestCompleteDatabaseSession:
@@ -64,3 +64,19 @@ class TestPrepareRequest:
 
         event.request.add_finished_callback.assert_called_once_with(
             webapp._complete_database_session)
+
+
+class TestMemoizeTween:
+    """Test the memoize_tween_factory() function."""
+
+    def test_scope(self):
+        """The handler should run in a memoization scope that ends with the request."""
+        scopes = []
+        handler = mock.Mock(side_effect=lambda request: scopes.append(memo.current_scope()))
+        tween = webapp.memoize_tween_factory(handler, mock.Mock())
+
+        response = tween(mock.Mock())
+
+        assert response is None
+        assert isinstance(scopes[0], memo.Scope)
+        assert memo.current_scope() is None
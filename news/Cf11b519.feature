@@ -0,0 +1 @@
+The `untag_branched` Celery task now runs every day at 04:13 through Celery beat, so `bodhi-untag-branched` no longer needs its own cron job, and it accepts a `--dry-run` option